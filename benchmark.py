@@ -0,0 +1,293 @@
+"""Scaling benchmarks for the API endpoints and ingestion paths.
+
+Each size gets a seeded synthetic graph (see synthetic_graph.py), which is
+loaded through every upload format and then queried through every read
+endpoint, in process through Flask's test client so network noise stays
+out of the numbers. Every step is run ``repeat`` times and reported by
+its median and best time; with memory tracking on, one extra run per step
+under tracemalloc records the peak of Python and NumPy allocations.
+
+Results are written as JSON, and ``compare`` lists the steps that got
+slower between two result files::
+
+    python benchmark.py run --sizes 1000 10000 100000 --output new.json
+    python benchmark.py compare old.json new.json --threshold 0.2
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import networkx as nx
+import numpy as np
+
+import synthetic_graph
+from binary_snapshot import encode_csr
+from csr_graph import CSRGraph
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.2  # slowdown reported as a regression by compare
+
+SINGLE_WRITES = 200       # add_node / add_edge requests per run
+QUERY_SOURCES = 50        # activities queried by the impact steps
+BULK_BATCH_SIZE = 10000   # items per add_*_bulk request, as load_data.py sends them
+
+RESULTS_FORMAT = 1
+
+
+class Bench:
+    """One graph size: the generated data, the app and the recorded steps."""
+
+    def __init__(self, app_module, size, seed, repeat, memory):
+        self.app = app_module
+        self.client = app_module.app.test_client()
+        self.size = size
+        self.repeat = repeat
+        self.memory = memory
+        self.data = synthetic_graph.generate_graph(size, seed=seed)
+        self.results = []
+        rng = np.random.default_rng(seed)
+        activities = [node['name'] for node in self.data['nodes'] if node['type'] == 'activity']
+        self.sources = [activities[i] for i in rng.choice(len(activities), min(QUERY_SOURCES, len(activities)),
+                                                           replace=False)]
+
+    def request(self, method, url, **kwargs):
+        response = self.client.open(url, method=method, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method} {url} returned {response.status_code}: {response.data[:200]!r}')
+        return response
+
+    def step(self, name, run, ops=1, setup=None):
+        """Time ``run()`` (after an untimed ``setup()``, if given) and record it"""
+        times = []
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        peak = None
+        if self.memory:
+            if setup is not None:
+                setup()
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+            run()
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            tracemalloc.stop()
+        median = statistics.median(times)
+        result = {
+            'size': self.size,
+            'step': name,
+            'ops': ops,
+            'median_seconds': median,
+            'min_seconds': min(times),
+            'ops_per_second': ops / median if median > 0 else None,
+            'peak_bytes': peak,
+        }
+        self.results.append(result)
+        print(f"{self.size:>9} {name:<28} {median * 1000:>11.2f} ms {_rate(result):>14}"
+              f" {_megabytes(peak):>10}", flush=True)
+        return result
+
+    def upload(self, filename, body):
+        self.request('POST', '/api/upload_data',
+                     data={'file': (io.BytesIO(body), filename)}, content_type='multipart/form-data')
+
+    def run_ingestion(self):
+        data = self.data
+        json_body = json.dumps(data).encode('utf-8')
+        csv_body = synthetic_graph.to_frame(data).to_csv(index=False).encode('utf-8')
+        ndjson_body = b''.join(synthetic_graph.ndjson_lines(data))
+        kgs_body = encode_csr(CSRGraph(synthetic_graph.to_graph(data)))
+        self.step('upload_csv', lambda: self.upload('graph.csv', csv_body), ops=len(data['edges']))
+        self.step('upload_ndjson', lambda: self.upload('graph.ndjson', ndjson_body),
+                  ops=len(data['nodes']) + len(data['edges']))
+        self.step('upload_kgs', lambda: self.upload('graph.kgs', kgs_body), ops=len(data['edges']))
+
+        def bulk():
+            for start in range(0, len(data['nodes']), BULK_BATCH_SIZE):
+                self.request('POST', '/api/add_nodes_bulk', json={'nodes': data['nodes'][start:start + BULK_BATCH_SIZE]})
+            for start in range(0, len(data['edges']), BULK_BATCH_SIZE):
+                self.request('POST', '/api/add_edges_bulk',
+                             json={'edges': data['edges'][start:start + BULK_BATCH_SIZE], 'match': 'id'})
+        self.step('add_bulk', bulk, ops=len(data['nodes']) + len(data['edges']), setup=self.app.G.clear)
+        # Leaves the graph loaded for the read steps
+        self.step('upload_json', lambda: self.upload('graph.json', json_body), ops=len(data['edges']))
+
+    def run_writes(self):
+        counter = iter(range(10 ** 9))
+        names = self.sources
+
+        def add_nodes():
+            for _ in range(SINGLE_WRITES):
+                i = next(counter)
+                self.request('POST', '/api/add_node', json={'id': f'bench_{i}', 'type': 'factor', 'name': f'Bench {i}'})
+
+        def add_edges():
+            for i in range(SINGLE_WRITES):
+                self.request('POST', '/api/add_edge', json={'source': names[i % len(names)], 'target': f'Bench {i}',
+                                                            'relationship': 'causes'})
+        self.step('add_node', add_nodes, ops=SINGLE_WRITES)
+        # Edges to the first SINGLE_WRITES bench nodes; repeats overwrite the same edges
+        self.step('add_edge', add_edges, ops=SINGLE_WRITES)
+
+    def run_reads(self):
+        touch = iter(range(10 ** 9))
+
+        def write():
+            # One change, so the next read cannot be served from a cache
+            i = next(touch)
+            self.request('POST', '/api/add_node', json={'id': f'touch_{i}', 'type': 'location', 'name': f'Touch {i}'})
+
+        self.step('get_graph_after_write', lambda: self.request('GET', '/api/get_graph'), setup=write)
+        self.step('get_graph_cached', lambda: self.request('GET', '/api/get_graph'))
+        self.step('get_graph_cached_gzip',
+                  lambda: self.request('GET', '/api/get_graph', headers={'Accept-Encoding': 'gzip'}))
+        version = {}
+        self.step('get_graph_delta', lambda: self.request('GET', f"/api/get_graph?since={version['since']}"),
+                  setup=lambda: (version.update(since=self.app.G.version), write()))
+
+        def impacts():
+            for name in self.sources:
+                self.request('GET', '/api/query_impacts', query_string={'source': name})
+        self.step('query_impacts', impacts, ops=len(self.sources), setup=self.app.impact_cache.clear)
+        self.step('query_impacts_cached', impacts, ops=len(self.sources))
+        self.step('query_impacts_batch',
+                  lambda: self.request('POST', '/api/query_impacts_batch', json={'sources': self.sources}),
+                  ops=len(self.sources), setup=self.app.impact_cache.clear)
+        self.step('impact_scores',
+                  lambda: self.request('GET', '/api/impact_scores', query_string=[('source', s) for s in self.sources]),
+                  ops=len(self.sources))
+        def paths():
+            for name in self.sources:
+                self.request('GET', '/api/impact_paths', query_string={'source': name})
+        self.step('impact_paths', paths, ops=len(self.sources))
+        self.step('pattern_query',
+                  lambda: self.request('GET', '/api/pattern_query',
+                                       query_string={'pattern': 'activity -causes-> factor -affects-> consequence',
+                                                     'limit': 100000}))
+        self.step('subgraph_overview', lambda: self.request('GET', '/api/subgraph?max_nodes=500'))
+        self.step('subgraph_2_hops',
+                  lambda: self.request('GET', '/api/subgraph', query_string={'node': self.sources[0], 'hops': 2}))
+
+
+def _rate(result):
+    rate = result['ops_per_second']
+    return f'{rate:,.0f}/s' if rate is not None and result['ops'] > 1 else ''
+
+
+def _megabytes(peak):
+    return f'{peak / 2 ** 20:.1f} MB' if peak is not None else ''
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=DEFAULT_SIZES, seed=0, repeat=DEFAULT_REPEAT, memory=True, groups=('ingest', 'writes', 'reads')):
+    """Run the benchmark for every size; returns the results document"""
+    # Benchmark an in-memory graph, whatever the environment configures
+    os.environ.pop('KG_DATA_DIR', None)
+    os.environ.pop('KG_SHARED_SNAPSHOT', None)
+    os.environ.setdefault('KG_LOG_LEVEL', 'WARNING')
+    import knowledge_graph_app
+
+    print(f"{'nodes':>9} {'step':<28} {'median':>14} {'throughput':>14} {'peak':>10}")
+    results = []
+    for size in sizes:
+        bench = Bench(knowledge_graph_app, size, seed, repeat, memory)
+        if 'ingest' in groups:
+            bench.run_ingestion()
+        else:
+            bench.upload('graph.json', json.dumps(bench.data).encode('utf-8'))
+        if 'writes' in groups:
+            bench.run_writes()
+        if 'reads' in groups:
+            bench.run_reads()
+        results.extend(bench.results)
+        knowledge_graph_app.G.clear()
+    return {
+        'format': RESULTS_FORMAT,
+        'commit': _commit(),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'seed': seed,
+        'repeat': repeat,
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'networkx': nx.__version__,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Pair up the steps of two results documents; returns the rows whose
+    median time grew by more than ``threshold`` (0.2 = 20%)"""
+    before = {(r['size'], r['step']): r for r in baseline['results']}
+    rows = []
+    for result in current['results']:
+        old = before.get((result['size'], result['step']))
+        if old is None or not old['median_seconds']:
+            continue
+        change = result['median_seconds'] / old['median_seconds'] - 1
+        rows.append((result['size'], result['step'], old['median_seconds'], result['median_seconds'], change))
+    print(f"{'nodes':>9} {'step':<28} {'before':>12} {'after':>12} {'change':>8}")
+    for size, step, old, new, change in rows:
+        flag = '  REGRESSION' if change > threshold else ''
+        print(f"{size:>9} {step:<28} {old * 1000:>9.2f} ms {new * 1000:>9.2f} ms {change:>+8.1%}{flag}")
+    return [row for row in rows if row[4] > threshold]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the API endpoints on synthetic graphs')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmarks and write a results file')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='graph sizes in nodes')
+    run_parser.add_argument('--seed', type=int, default=0, help='graph generator seed')
+    run_parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='timed runs per step')
+    run_parser.add_argument('--groups', nargs='+', choices=['ingest', 'writes', 'reads'],
+                            default=['ingest', 'writes', 'reads'], help='step groups to run')
+    run_parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc peak memory runs')
+    run_parser.add_argument('--output', default='benchmark_results.json', help='results file to write')
+    compare_parser = commands.add_parser('compare', help='compare two results files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                                help='relative slowdown reported as a regression')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        document = run(args.sizes, seed=args.seed, repeat=args.repeat, memory=not args.no_memory, groups=args.groups)
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"Wrote {args.output}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} steps slower by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
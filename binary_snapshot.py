@@ -0,0 +1,422 @@
+"""Compact binary graph snapshots that can be memory-mapped.
+
+Layout (little-endian, every section starts on an 8-byte boundary)::
+
+    header            64 bytes, see HEADER
+    string_offsets    uint64[S + 1]  byte offsets into the string blob
+    indptr            int64[V + 1]   CSR row pointers
+    indices           int32[E]       edge targets
+    node_types        int16[V]       codes into the type names
+    relations         int16[E]       codes into the relationship names
+    weights           float64[E]     edge weights (1.0 when unset)
+    weight_set        bool[E]        whether each edge's weight was set
+    integer_ids       bool[V]        whether each node id is an integer
+    string blob       UTF-8          S = 2V + T + R strings: node ids, node
+                                     names, type names, relationship names
+
+The header holds the counts, the graph version and a CRC32 of everything
+after it. Opening a file maps it and parses only the header; arrays are
+zero-copy views, so pages are read from disk as traversals touch them.
+
+A graph round-trips exactly as long as it only holds what the app
+stores: string or integer node ids, string names, and the ``type``,
+``name``, ``relationship`` and ``weight`` attributes. Integer ids are
+written in decimal and flagged in ``integer_ids``. A missing type or
+relationship is stored as the empty string, so an empty type or
+relationship name cannot be stored. write_snapshot and encode_csr raise
+ValueError for graphs they cannot represent (see snapshot_error).
+
+Version 2 files (magic ``KGSNAP02``) have no ``weight_set`` or
+``integer_ids`` sections: weights other than 1.0 count as set and ids
+are strings. Version 1 files (``KGSNAP01``) also have no weights section
+and are read with every weight set to 1.0.
+"""
+import argparse
+import json
+import mmap
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+from csr_graph import CSRGraph
+
+MAGIC = b'KGSNAP03'
+WEIGHTED_MAGIC = b'KGSNAP02'
+UNWEIGHTED_MAGIC = b'KGSNAP01'
+FORMATS = {MAGIC: 3, WEIGHTED_MAGIC: 2, UNWEIGHTED_MAGIC: 1}
+NODE_ATTRIBUTES = {'type', 'name'}
+EDGE_ATTRIBUTES = {'relationship', 'weight'}
+# magic, graph version, nodes, edges, types, relationships, strings, crc32, reserved
+HEADER = struct.Struct('<8sQQQIIQII8x')
+ALIGNMENT = 8
+CRC_CHUNK = 1 << 24
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def _section_layout(node_count, edge_count, string_count, file_format=3):
+    """Return ``[(name, dtype, count, offset)]`` for the array sections and the blob offset."""
+    sections = []
+    offset = HEADER.size
+    layout = [('string_offsets', np.uint64, string_count + 1),
+              ('indptr', np.int64, node_count + 1),
+              ('indices', np.int32, edge_count),
+              ('node_types', np.int16, node_count),
+              ('relations', np.int16, edge_count)]
+    if file_format >= 2:
+        layout.append(('weights', np.float64, edge_count))
+    if file_format >= 3:
+        layout.append(('weight_set', np.bool_, edge_count))
+        layout.append(('integer_ids', np.bool_, node_count))
+    for name, dtype, count in layout:
+        sections.append((name, dtype, count, offset))
+        size = np.dtype(dtype).itemsize * count
+        offset += size + _padding(size)
+    return sections, offset
+
+
+def _code_names(names, kind):
+    """Type or relationship names as stored: None as the empty string."""
+    for name in names:
+        if name is not None and (not isinstance(name, str) or not name):
+            raise ValueError(f'Cannot store {kind} {name!r}: must be a non-empty string')
+    return ['' if name is None else name for name in names]
+
+
+def _id_kinds(node_ids):
+    """Whether each node id is an integer; raises ValueError for ids that are neither int nor str."""
+    integer = []
+    for n in node_ids:
+        kind = type(n)
+        if kind is not str and kind is not int:
+            raise ValueError(f'Cannot store node id {n!r}: ids must be strings or integers')
+        integer.append(kind is int)
+    return np.array(integer, dtype=np.bool_)
+
+
+def snapshot_error(graph):
+    """Return why the snapshot format cannot hold ``graph`` exactly, or None.
+
+    encode_csr checks what a CSRGraph still knows (ids and type and
+    relationship names); this also checks the attributes the CSRGraph
+    drops: every node needs a string name, and only the type, name,
+    relationship and weight attributes are kept.
+    """
+    for n, attrs in graph.nodes(data=True):
+        if not isinstance(attrs.get('name'), str):
+            return f'Node {n!r} has no string name'
+        if not attrs.keys() <= NODE_ATTRIBUTES:
+            return f'Node {n!r} has attributes {sorted(attrs.keys() - NODE_ATTRIBUTES)} the snapshot cannot store'
+        if 'type' in attrs and not isinstance(attrs['type'], str):
+            return f'Node {n!r} has a type that is not a string'
+    for u, v, attrs in graph.edges(data=True):
+        if not attrs.keys() <= EDGE_ATTRIBUTES:
+            return f'Edge {u!r} -> {v!r} has attributes {sorted(attrs.keys() - EDGE_ATTRIBUTES)} the snapshot cannot store'
+        if 'relationship' in attrs and not isinstance(attrs['relationship'], str):
+            return f'Edge {u!r} -> {v!r} has a relationship that is not a string'
+        weight = attrs.get('weight')
+        if weight is not None and (isinstance(weight, bool) or not isinstance(weight, (int, float))):
+            return f'Edge {u!r} -> {v!r} has a weight that is not a number'
+    return None
+
+
+def encode_csr(csr):
+    """Serialize a CSRGraph into snapshot bytes.
+
+    Raises ValueError if the ids or type and relationship names cannot be
+    stored exactly (see the module docstring).
+    """
+    type_names = _code_names(csr.type_names, 'node type')
+    relationship_names = _code_names(csr.relationship_names, 'relationship')
+    integer_ids = _id_kinds(csr.node_ids)
+    strings = [str(n).encode('utf-8') for n in csr.node_ids]
+    strings += [str(name).encode('utf-8') for name in csr.names]
+    strings += [name.encode('utf-8') for name in type_names + relationship_names]
+
+    string_offsets = np.zeros(len(strings) + 1, dtype=np.uint64)
+    np.cumsum(np.fromiter(map(len, strings), dtype=np.uint64, count=len(strings)), out=string_offsets[1:])
+    arrays = {
+        'string_offsets': string_offsets,
+        'indptr': np.asarray(csr.indptr, dtype=np.int64),
+        'indices': np.asarray(csr.indices, dtype=np.int32),
+        'node_types': np.asarray(csr.node_types, dtype=np.int16),
+        'relations': np.asarray(csr.relations, dtype=np.int16),
+        'weights': np.asarray(csr.weights, dtype=np.float64),
+        'weight_set': np.asarray(csr.weight_set, dtype=np.bool_),
+        'integer_ids': integer_ids
+    }
+
+    parts = []
+    for name, dtype, _, _ in _section_layout(len(csr.node_ids), len(csr.indices), len(strings))[0]:
+        data = arrays[name].astype(dtype, copy=False).tobytes()
+        parts.append(data)
+        parts.append(b'\0' * _padding(len(data)))
+    parts.append(b''.join(strings))
+    payload = b''.join(parts)
+
+    header = HEADER.pack(MAGIC, csr.version or 0, len(csr.node_ids), len(csr.indices),
+                         len(type_names), len(relationship_names), len(strings),
+                         zlib.crc32(payload), 0)
+    return header + payload
+
+
+def write_snapshot(graph, path):
+    """Write a KnowledgeGraph to ``path`` in the binary snapshot format.
+
+    Raises ValueError if the snapshot could not hold the graph exactly.
+    """
+    error = snapshot_error(graph)
+    if error:
+        raise ValueError(error)
+    data = encode_csr(CSRGraph(graph))
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(data)
+
+
+def _edge_attrs(relationship, weight=None):
+    attrs = {'relationship': relationship} if relationship else {}
+    if weight is not None:
+        attrs['weight'] = weight
+    return attrs
+
+
+class SnapshotStrings:
+    """A run of a snapshot's strings, decoded only when accessed.
+
+    Stands in for the object arrays of node ids and names in a CSRGraph
+    built by to_csr: indexing with an int returns one string, indexing with
+    an index array or mask returns an object array of just those strings,
+    and ``== value`` compares the encoded bytes without decoding any.
+    Entries flagged in ``integer`` are returned as ints.
+    """
+
+    def __init__(self, snapshot, start, count, integer=None):
+        self._offsets = snapshot.string_offsets[start:start + count + 1]
+        self._blob = snapshot._blob
+        self._integer = integer
+        self.nbytes = 0  # nothing is held beyond the snapshot's own pages
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _get(self, i):
+        value = self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes().decode('utf-8')
+        return int(value) if self._integer is not None and self._integer[i] else value
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._get(range(len(self))[key])
+        key = np.asarray(key)
+        if key.dtype == np.bool_:
+            key = np.flatnonzero(key)
+        values = np.empty(key.shape, dtype=object)
+        values.reshape(-1)[:] = [self._get(i) for i in key.reshape(-1).tolist()]
+        return values
+
+    def __iter__(self):
+        offsets = self._offsets.tolist()
+        blob = self._blob.data
+        integer = self._integer.tolist() if self._integer is not None else None
+        for i, (start, end) in enumerate(zip(offsets, offsets[1:])):
+            value = bytes(blob[start:end]).decode('utf-8')
+            yield int(value) if integer is not None and integer[i] else value
+
+    def tolist(self):
+        return list(self)
+
+    def __eq__(self, value):
+        encoded = np.frombuffer(str(value).encode('utf-8'), dtype=np.uint8)
+        starts = self._offsets[:-1].astype(np.int64)
+        matches = np.diff(self._offsets) == len(encoded)
+        candidates = np.flatnonzero(matches)
+        if len(candidates) and len(encoded):
+            stored = self._blob[starts[candidates, None] + np.arange(len(encoded))]
+            matches[candidates] = (stored == encoded).all(axis=1)
+        if self._integer is not None:
+            matches &= ~self._integer if isinstance(value, str) else self._integer
+        return matches
+
+    __hash__ = None
+
+
+class BinarySnapshot:
+    """Read-only view of snapshot bytes in any buffer (mmap, bytes, shared memory)."""
+
+    def __init__(self, buffer, verify=False):
+        self._buffer = memoryview(buffer)
+        if len(self._buffer) < HEADER.size:
+            raise ValueError('Snapshot is truncated')
+        (magic, self.version, self.node_count, self.edge_count, self.type_count,
+         self.relationship_count, self.string_count, self.crc32, _) = HEADER.unpack_from(self._buffer)
+        if magic not in FORMATS:
+            raise ValueError('Not a knowledge graph snapshot')
+
+        file_format = FORMATS[magic]
+        sections, blob_offset = _section_layout(self.node_count, self.edge_count, self.string_count,
+                                                file_format=file_format)
+        for name, dtype, count, offset in sections:
+            setattr(self, name, np.frombuffer(self._buffer, dtype=dtype, count=count, offset=offset))
+        if file_format < 2:
+            self.weights = np.ones(self.edge_count, dtype=np.float64)
+        if file_format < 3:
+            self.weight_set = self.weights != 1.0
+            self.integer_ids = np.zeros(self.node_count, dtype=np.bool_)
+        blob_size = int(self.string_offsets[-1]) if self.string_count else 0
+        if blob_offset + blob_size > len(self._buffer):
+            raise ValueError('Snapshot is truncated')
+        self._blob = np.frombuffer(self._buffer, dtype=np.uint8, count=blob_size, offset=blob_offset)
+        if verify:
+            self.verify()
+
+    def verify(self):
+        """Check the payload against the header's CRC32; raises ValueError on mismatch."""
+        payload = self._buffer[HEADER.size:]
+        crc = 0
+        for start in range(0, len(payload), CRC_CHUNK):
+            crc = zlib.crc32(payload[start:start + CRC_CHUNK], crc)
+        if crc != self.crc32:
+            raise ValueError('Snapshot checksum mismatch')
+
+    def string(self, k):
+        start = int(self.string_offsets[k])
+        end = int(self.string_offsets[k + 1])
+        return self._blob[start:end].tobytes().decode('utf-8')
+
+    def _strings(self, start, count):
+        offsets = self.string_offsets[start:start + count + 1].tolist()
+        blob = self._blob.data
+        return [bytes(blob[a:b]).decode('utf-8') for a, b in zip(offsets, offsets[1:])]
+
+    def _node_ids(self):
+        node_ids = self._strings(0, self.node_count)
+        for i in np.flatnonzero(self.integer_ids).tolist():
+            node_ids[i] = int(node_ids[i])
+        return node_ids
+
+    def node_id(self, i):
+        return int(self.string(i)) if self.integer_ids[i] else self.string(i)
+
+    def node_name(self, i):
+        return self.string(self.node_count + i)
+
+    @property
+    def type_names(self):
+        names = self._strings(2 * self.node_count, self.type_count)
+        return [name or None for name in names]
+
+    @property
+    def relationship_names(self):
+        names = self._strings(2 * self.node_count + self.type_count, self.relationship_count)
+        return [name or None for name in names]
+
+    def to_csr(self):
+        """Return a CSRGraph whose arrays are views of this snapshot. Ids and
+        names are decoded as they are used (see SnapshotStrings)."""
+        return CSRGraph.from_arrays(
+            self.version,
+            SnapshotStrings(self, 0, self.node_count, integer=self.integer_ids),
+            SnapshotStrings(self, self.node_count, self.node_count),
+            self.node_types, self.type_names,
+            self.indptr, self.indices, self.relations,
+            self.relationship_names, self.weights, self.weight_set)
+
+    def load_into(self, graph):
+        """Replace the contents of a networkx graph with this snapshot."""
+        node_ids = self._node_ids()
+        names = self._strings(self.node_count, self.node_count)
+        type_names = self.type_names
+        relationship_names = self.relationship_names
+        graph.clear()
+        graph.add_nodes_from(
+            (node_id, {'type': type_names[code], 'name': name} if type_names[code] else {'name': name})
+            for node_id, name, code in zip(node_ids, names, self.node_types.tolist()))
+        sources = np.repeat(np.arange(self.node_count), np.diff(self.indptr)).tolist()
+        graph.add_edges_from(
+            (node_ids[u], node_ids[v], _edge_attrs(relationship_names[code], weight if weight_set else None))
+            for u, v, code, weight, weight_set in zip(sources, self.indices.tolist(), self.relations.tolist(),
+                                                      self.weights.tolist(), self.weight_set.tolist()))
+
+    def release(self):
+        """Drop the array views so the underlying buffer can be closed."""
+        for name in ('string_offsets', 'indptr', 'indices', 'node_types', 'relations', 'weights',
+                     'weight_set', 'integer_ids', '_blob'):
+            setattr(self, name, None)
+        self._buffer.release()
+
+
+class MappedSnapshot(BinarySnapshot):
+    """BinarySnapshot backed by a read-only memory map of a file."""
+
+    def __init__(self, path, verify=False):
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            super().__init__(self._mmap, verify=verify)
+        except Exception:
+            self._file.close()
+            raise
+
+    def close(self):
+        self.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def convert_json(json_path, snapshot_path):
+    """Convert a nodes/edges JSON file (the sample_data.json schema) to a snapshot."""
+    from graph_store import KnowledgeGraph
+
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+    graph = KnowledgeGraph()
+    graph.add_nodes_from((node['id'], {'type': node['type'], 'name': node['name']}) for node in data['nodes'])
+    graph.add_edges_from((edge['source'], edge['target'], _edge_attrs(edge['relationship'], edge.get('weight')))
+                         for edge in data['edges'])
+    size = write_snapshot(graph, snapshot_path)
+    return len(graph), graph.number_of_edges(), size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert and inspect binary graph snapshots')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help='convert a nodes/edges JSON file to a snapshot')
+    convert.add_argument('json_path')
+    convert.add_argument('snapshot_path')
+    info = commands.add_parser('info', help='print the header of a snapshot and verify its checksum')
+    info.add_argument('snapshot_path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        nodes, edges, size = convert_json(args.json_path, args.snapshot_path)
+        print(f"Wrote {args.snapshot_path}: {nodes} nodes, {edges} edges, {size} bytes")
+    else:
+        with MappedSnapshot(args.snapshot_path) as snapshot:
+            try:
+                snapshot.verify()
+                status = 'ok'
+            except ValueError as e:
+                status = str(e)
+            print(f"version: {snapshot.version}")
+            print(f"nodes: {snapshot.node_count}")
+            print(f"edges: {snapshot.edge_count}")
+            print(f"node types: {snapshot.type_names}")
+            print(f"relationships: {snapshot.relationship_names}")
+            print(f"checksum: {status}")
+            if status != 'ok':
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
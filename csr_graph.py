@@ -0,0 +1,613 @@
+import threading
+import time
+
+import numpy as np
+
+
+def _row_positions(indptr, rows):
+    """Return ``(counts, positions)``: the entry count of each of ``rows``
+    and the array positions of all their entries, row by row."""
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    total = int(counts.sum())
+    # Position of each gathered entry: its row start plus its offset within the row
+    row_offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return counts, np.repeat(starts, counts) + (np.arange(total) - row_offsets)
+
+
+class _SearchBuffers:
+    """Scratch arrays reused by the searches on one CSRGraph.
+
+    A search takes a buffer holding a ``stamp`` and a ``parent`` array of
+    one entry per node. A node counts as visited when its stamp equals the
+    buffer's current ``generation``, so the arrays are allocated once and
+    never cleared, and a search costs time in proportion to what it
+    reaches rather than to the size of the graph. Concurrent searches each
+    take their own buffer; at most one per concurrent search is kept.
+    """
+
+    class Buffer:
+        def __init__(self, size):
+            self.stamp = np.zeros(size, dtype=np.uint32)
+            self.parent = np.empty(size, dtype=np.int64)
+            self.generation = 0
+
+    def __init__(self, size):
+        self.size = size
+        self._free = []
+
+    def acquire(self):
+        try:
+            buffer = self._free.pop()
+        except IndexError:
+            buffer = self.Buffer(self.size)
+        buffer.generation += 1
+        if buffer.generation > np.iinfo(np.uint32).max:
+            buffer.stamp[:] = 0
+            buffer.generation = 1
+        return buffer
+
+    def release(self, buffer):
+        self._free.append(buffer)
+
+
+class CSRGraph:
+    """Immutable compressed-sparse-row snapshot of a directed graph.
+
+    Nodes are numbered 0..V-1 in graph insertion order. The out-edges of
+    node i are ``indices[indptr[i]:indptr[i + 1]]`` (int32 node indices) with
+    matching relationship codes in ``relations``; ``node_types`` holds a type
+    code per node. Codes index into ``type_names`` / ``relationship_names``.
+    ``weights`` holds each edge's ``weight`` attribute (1.0 when unset) and
+    ``weight_set`` whether it was set, so an explicit 1.0 is told apart.
+    Traversals run on these arrays a whole BFS level at a time instead of
+    walking networkx's dict-of-dicts adjacency one edge at a time.
+
+    Built from a graph, the snapshot is kept next to it and adds to its
+    memory: 15 bytes per edge, plus per node two object-array slots that
+    point at the graph's own id and name strings and an entry in the id
+    ``index`` dict. Memory is only saved where no networkx graph is built
+    at all, as when serving from a mapped binary snapshot.
+    """
+
+    def __init__(self, graph):
+        node_attrs = graph._node
+        succ = graph._succ
+        node_ids = list(node_attrs)
+        index = {n: i for i, n in enumerate(node_ids)}
+
+        type_codes = {}
+        node_types = np.fromiter(
+            (type_codes.setdefault(attrs.get('type'), len(type_codes)) for attrs in node_attrs.values()),
+            dtype=np.int16, count=len(node_ids))
+
+        degrees = np.fromiter((len(succ[n]) for n in node_ids), dtype=np.int64, count=len(node_ids))
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(degrees, out=indptr[1:])
+        edge_count = int(indptr[-1])
+
+        indices = np.fromiter(
+            (index[v] for n in node_ids for v in succ[n]),
+            dtype=np.int32, count=edge_count)
+        relationship_codes = {}
+        relations = np.fromiter(
+            (relationship_codes.setdefault(attrs.get('relationship'), len(relationship_codes))
+             for n in node_ids for attrs in succ[n].values()),
+            dtype=np.int16, count=edge_count)
+        weights = np.fromiter(
+            (attrs.get('weight', np.nan) for n in node_ids for attrs in succ[n].values()),
+            dtype=np.float64, count=edge_count)
+        weight_set = ~np.isnan(weights)
+        weights[~weight_set] = 1.0
+
+        self._setup(getattr(graph, 'version', None), node_ids,
+                    [attrs.get('name', n) for n, attrs in node_attrs.items()],
+                    node_types, list(type_codes), indptr, indices, relations,
+                    list(relationship_codes), weights, weight_set, index=index)
+
+    @classmethod
+    def from_arrays(cls, version, node_ids, names, node_types, type_names,
+                    indptr, indices, relations, relationship_names, weights=None, weight_set=None):
+        """Wrap existing arrays (e.g. views of a mapped snapshot file) without copying them.
+
+        Without ``weight_set``, edges count as weighted where their weight
+        is not 1.0.
+        """
+        if weights is None:
+            weights = np.ones(len(indices), dtype=np.float64)
+        if weight_set is None:
+            weight_set = weights != 1.0
+        snapshot = cls.__new__(cls)
+        snapshot._setup(version, node_ids, names, node_types, list(type_names),
+                        indptr, indices, relations, list(relationship_names), weights, weight_set)
+        return snapshot
+
+    def _setup(self, version, node_ids, names, node_types, type_names,
+               indptr, indices, relations, relationship_names, weights, weight_set, index=None):
+        self.version = version
+        # Object arrays let whole index arrays be mapped back to ids and names
+        # at once; anything else that supports the same indexing (such as a
+        # snapshot's lazily decoded strings) is used as given
+        if isinstance(node_ids, list):
+            node_ids = np.fromiter(node_ids, dtype=object, count=len(node_ids))
+        if isinstance(names, list):
+            names = np.fromiter(names, dtype=object, count=len(names))
+        self._id_array = node_ids
+        self._name_array = names
+        self._index = index
+        self._name_index = None
+        self.node_types = node_types
+        self.type_names = type_names
+        self.type_codes = {name: code for code, name in enumerate(type_names)}
+        self.indptr = indptr
+        self.indices = indices
+        self.relations = relations
+        self.relationship_names = relationship_names
+        self.relationship_codes = {name: code for code, name in enumerate(relationship_names)}
+        self.weights = weights
+        self.weight_set = weight_set
+        self._reverse = None
+        self._degrees = None
+        self._partitions = {}
+        self._search_buffers = _SearchBuffers(len(self._id_array))
+
+    @property
+    def node_ids(self):
+        """Node ids in index order."""
+        return self._id_array
+
+    @property
+    def names(self):
+        """Node names in index order."""
+        return self._name_array
+
+    @property
+    def index(self):
+        """Node id -> node index, built on first use."""
+        if self._index is None:
+            self._index = {n: i for i, n in enumerate(self._id_array)}
+        return self._index
+
+    def build_indexes(self):
+        """Build the id and name lookups now instead of on first use."""
+        self.index
+        self.node_id_for_name(None)
+
+    def __len__(self):
+        return len(self._id_array)
+
+    @property
+    def edge_count(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the arrays, counting the id and name arrays' pointers
+        but not the strings they point at or the id index."""
+        return (self.indptr.nbytes + self.indices.nbytes + self.relations.nbytes
+                + self.node_types.nbytes + self.weights.nbytes + self.weight_set.nbytes
+                + self._id_array.nbytes + self._name_array.nbytes)
+
+    def successors(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def expand(self, frontier):
+        """Return ``(sources, targets, edge_positions)`` for every out-edge of
+        the nodes in ``frontier``, in frontier order then adjacency order."""
+        counts, positions = _row_positions(self.indptr, frontier)
+        if not len(positions):
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        return np.repeat(frontier, counts), self.indices[positions], positions
+
+    def bfs_levels(self, source, max_depth=None):
+        """Breadth-first search from node index ``source``.
+
+        Yields ``(nodes, parents)`` arrays for each level, nodes in first
+        discovery order, so the first parent recorded for a node lies on a
+        shortest path to it. Returns when the search is exhausted or
+        ``max_depth`` levels have been produced.
+        """
+        buffer = self._search_buffers.acquire()
+        try:
+            yield from self._bfs_levels(source, max_depth, buffer)
+        finally:
+            self._search_buffers.release(buffer)
+
+    def _bfs_levels(self, source, max_depth, buffer):
+        stamp, generation = buffer.stamp, buffer.generation
+        stamp[source] = generation
+        frontier = np.array([source], dtype=np.int64)
+        depth = 0
+        while len(frontier) and (max_depth is None or depth < max_depth):
+            depth += 1
+            sources, targets, _ = self.expand(frontier)
+            fresh = stamp[targets] != generation
+            sources, targets = sources[fresh], targets[fresh]
+            # Keep the first discovery of each node, in discovery order
+            _, first = np.unique(targets, return_index=True)
+            first.sort()
+            frontier = targets[first]
+            stamp[frontier] = generation
+            yield frontier, sources[first]
+
+    def descendants(self, source, max_depth=None):
+        """Return the indices of every node reachable from ``source``."""
+        levels = [nodes for nodes, _ in self.bfs_levels(source, max_depth)]
+        return np.concatenate(levels) if levels else np.empty(0, dtype=np.int64)
+
+    def impacts(self, source_id, max_depth=None, limit=None, target_type='consequence', check=None):
+        """Same contract as impact_engine.find_impacts, computed on the arrays."""
+        source = self.index[source_id]
+        if limit is not None and limit <= 0:
+            return [], {source_id}
+        target_code = self.type_codes.get(target_type, -1)
+        reached = [np.array([source])]
+        impacts = []
+
+        # Parent pointers are only read for nodes this search has reached,
+        # so the buffer's array needs no clearing
+        buffer = self._search_buffers.acquire()
+        parent = buffer.parent
+        try:
+            depth = 0
+            for nodes, parents in self._bfs_levels(source, max_depth, buffer):
+                if check is not None:
+                    check()
+                depth += 1
+                reached.append(nodes)
+                parent[nodes] = parents
+                hits = nodes[self.node_types[nodes] == target_code]
+                if limit is not None:
+                    hits = hits[:limit - len(impacts)]
+                if len(hits):
+                    # Every hit on this level has a path of depth + 1 nodes; walk
+                    # the parent pointers for all of them at once
+                    paths = np.empty((len(hits), depth + 1), dtype=np.int64)
+                    paths[:, depth] = hits
+                    for k in range(depth, 0, -1):
+                        paths[:, k - 1] = parent[paths[:, k]]
+                    impacts.extend(
+                        {'consequence': consequence, 'path': path}
+                        for consequence, path in zip(self._name_array[hits].tolist(),
+                                                     self._name_array[paths].tolist())
+                    )
+                if limit is not None and len(impacts) >= limit:
+                    break
+        finally:
+            self._search_buffers.release(buffer)
+
+        return impacts, set(self._id_array[np.concatenate(reached)].tolist())
+
+    def predecessors_csr(self):
+        """Return ``(indptr, indices, edge_positions)`` of the reversed graph,
+        built on first use. ``edge_positions`` maps each reversed edge back
+        to its position in the forward arrays (e.g. to look up its weight)."""
+        if self._reverse is None:
+            n = len(self.node_ids)
+            edge_sources = np.repeat(np.arange(n, dtype=np.int32), np.diff(self.indptr))
+            order = np.argsort(self.indices, kind='stable')
+            indptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=n), out=indptr[1:])
+            self._reverse = (indptr, edge_sources[order], order)
+        return self._reverse
+
+    def relation_partitions(self, reverse=False):
+        """Edges grouped by relationship and endpoint types, built on first use.
+
+        Returns ``(nodes, others, positions, slices)``: three edge arrays
+        sorted by (relationship, node type, other type, node), where
+        ``nodes`` holds each edge's source and ``others`` its target (the
+        other way round if ``reverse``), and ``positions`` maps back to the
+        forward arrays. ``slices`` maps each (relationship code, node type
+        code, other type code) present to its ``(start, end)`` range, so
+        the edges of one relationship between two types can be scanned, or
+        looked up per node with searchsorted, without touching the rest.
+        """
+        if reverse not in self._partitions:
+            sources = np.repeat(np.arange(len(self.node_ids), dtype=np.int32), np.diff(self.indptr))
+            nodes, others = (self.indices, sources) if reverse else (sources, self.indices)
+            node_types, other_types = self.node_types[nodes], self.node_types[others]
+            order = np.lexsort((nodes, other_types, node_types, self.relations))
+            width = max(len(self.type_names), 1)
+            keys = (self.relations[order].astype(np.int64) * width + node_types[order]) * width + other_types[order]
+            starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.empty(0, dtype=np.int64)
+            ends = np.r_[starts[1:], len(keys)].astype(np.int64)
+            slices = {}
+            for key, start, end in zip(keys[starts].tolist(), starts.tolist(), ends.tolist()):
+                rest, other_type = divmod(key, width)
+                relation, node_type = divmod(rest, width)
+                slices[relation, node_type, other_type] = (start, end)
+            self._partitions[reverse] = (nodes[order], others[order], order, slices)
+        return self._partitions[reverse]
+
+    def degrees(self):
+        """Total (in + out) degree of every node, computed on first use."""
+        if self._degrees is None:
+            self._degrees = np.diff(self.indptr) + np.diff(self.predecessors_csr()[0])
+        return self._degrees
+
+    def neighborhood(self, seeds=None, hops=1, node_types=None, relationships=None,
+                     direction='both', max_nodes=None):
+        """Nodes within ``hops`` edges of the node indices in ``seeds``.
+
+        Only edges whose relationship is in ``relationships`` are followed
+        and only nodes whose type is in ``node_types`` are added (either
+        may be None for no filter; seeds are always kept). ``direction`` is
+        ``'out'``, ``'in'`` or ``'both'``. When a level would take the
+        selection past ``max_nodes``, only its highest-degree nodes are
+        kept (ties by node order) and the search stops there. Without seeds
+        the result is every node passing the type filter, pruned the same
+        way.
+
+        Returns ``(nodes, edge_positions, truncated)``: sorted node indices,
+        the forward-array positions of the edges among them that pass the
+        relationship filter, and whether the budget cut anything off.
+        """
+        n = len(self.node_ids)
+        allowed_nodes = None
+        if node_types is not None:
+            allowed_nodes = np.isin(self.node_types, [self.type_codes[t] for t in node_types
+                                                      if t in self.type_codes])
+        allowed_edges = None
+        if relationships is not None:
+            allowed_edges = np.isin(self.relations, [self.relationship_codes[r] for r in relationships
+                                                     if r in self.relationship_codes])
+        truncated = False
+
+        if seeds is None:
+            nodes = np.arange(n) if allowed_nodes is None else np.flatnonzero(allowed_nodes)
+            hops = 0
+        else:
+            nodes = np.unique(np.asarray(seeds, dtype=np.int64))
+        if max_nodes is not None and len(nodes) > max_nodes:
+            nodes, truncated = self._highest_degree(nodes, max_nodes), True
+        selected = np.zeros(n, dtype=bool)
+        selected[nodes] = True
+        count = len(nodes)
+
+        frontier = nodes
+        for _ in range(hops):
+            if truncated or not len(frontier):
+                break
+            reached = []
+            if direction in ('out', 'both'):
+                _, targets, positions = self.expand(frontier)
+                reached.append(targets if allowed_edges is None else targets[allowed_edges[positions]])
+            if direction in ('in', 'both'):
+                rev_indptr, rev_indices, rev_positions = self.predecessors_csr()
+                _, positions = _row_positions(rev_indptr, frontier)
+                sources = rev_indices[positions]
+                reached.append(sources if allowed_edges is None
+                               else sources[allowed_edges[rev_positions[positions]]])
+            frontier = np.unique(np.concatenate(reached)).astype(np.int64)
+            frontier = frontier[~selected[frontier]]
+            if allowed_nodes is not None:
+                frontier = frontier[allowed_nodes[frontier]]
+            if max_nodes is not None and count + len(frontier) > max_nodes:
+                frontier, truncated = self._highest_degree(frontier, max_nodes - count), True
+            selected[frontier] = True
+            count += len(frontier)
+
+        nodes = np.flatnonzero(selected)
+        _, targets, positions = self.expand(nodes)
+        keep = selected[targets]
+        if allowed_edges is not None:
+            keep &= allowed_edges[positions]
+        return nodes, positions[keep], truncated
+
+    def _highest_degree(self, nodes, count):
+        """The ``count`` nodes of ``nodes`` with the highest degree, sorted by index."""
+        order = np.lexsort((nodes, -self.degrees()[nodes]))
+        return np.sort(nodes[order[:count]])
+
+    def edge_sources(self, positions):
+        """Source node index of each forward-array edge position."""
+        return np.searchsorted(self.indptr, positions, side='right') - 1
+
+    def multi_impacts(self, source_ids, max_depth=None, limit=None, target_type='consequence', check=None):
+        """impacts() for many sources in one shared traversal.
+
+        Returns ``{source_id: (impacts, reached)}``. Sources are searched 64
+        at a time, each owning one bit of a uint64 word per node, so every
+        BFS level expands the union of all the sources' frontiers once and
+        ORs the source bits along the edges, instead of walking the
+        downstream subgraph the sources share once per source. Paths are
+        rebuilt afterwards, for the consequences found only, by walking
+        predecessors level by level.
+
+        Every path is a shortest path, but where several exist the one
+        picked may differ from impacts(); within one level consequences
+        come out in node order rather than discovery order.
+        """
+        unique = list(dict.fromkeys(source_ids))
+        if limit is not None and limit <= 0:
+            return {source_id: ([], {source_id}) for source_id in unique}
+        results = {}
+        for start in range(0, len(unique), 64):
+            results.update(self._multi_impacts_chunk(unique[start:start + 64], max_depth, limit,
+                                                     target_type, check))
+        return results
+
+    def _multi_impacts_chunk(self, source_ids, max_depth, limit, target_type, check):
+        count = len(source_ids)
+        target_code = self.type_codes.get(target_type, -1)
+        one = np.uint64(1)
+        bits = np.left_shift(one, np.arange(count, dtype=np.uint64))
+        sources = np.array([self.index[s] for s in source_ids], dtype=np.int64)
+        order = np.argsort(sources)
+        seen = np.zeros(len(self.node_ids), dtype=np.uint64)
+        seen[sources] = bits
+        active = np.bitwise_or.reduce(bits)
+        found = np.zeros(count, dtype=np.int64)
+
+        levels = [(sources[order], bits[order])]  # per depth: sorted nodes and the bits new to them
+        level_hits = []                           # per depth: (source slots, consequence nodes)
+        frontier, frontier_bits = levels[0]
+        depth = 0
+        while len(frontier) and (max_depth is None or depth < max_depth):
+            if check is not None:
+                check()
+            depth += 1
+            _, targets, _ = self.expand(frontier)
+            edge_bits = np.repeat(frontier_bits, self.indptr[frontier + 1] - self.indptr[frontier])
+            fresh = edge_bits & ~seen[targets]
+            keep = fresh != 0
+            targets, fresh = targets[keep], fresh[keep]
+            if not len(targets):
+                break
+            # OR together the bits arriving at each target
+            by_target = np.argsort(targets, kind='stable')
+            targets, fresh = targets[by_target], fresh[by_target]
+            starts = np.flatnonzero(np.r_[True, targets[1:] != targets[:-1]])
+            nodes = targets[starts]
+            node_bits = np.bitwise_or.reduceat(fresh, starts)
+            seen[nodes] |= node_bits
+            levels.append((nodes, node_bits))
+
+            is_hit = self.node_types[nodes] == target_code
+            hit_nodes, hit_bits = nodes[is_hit], node_bits[is_hit]
+            # One (slot, node) pair per set bit, grouped by slot in node order
+            pair_rows, pair_slots = np.nonzero(
+                np.unpackbits(hit_bits.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')[:, :count])
+            by_slot = np.argsort(pair_slots, kind='stable')
+            pair_slots, hits = pair_slots[by_slot], hit_nodes[pair_rows[by_slot]]
+            if limit is not None and len(hits):
+                group_starts = np.searchsorted(pair_slots, pair_slots)
+                keep = np.arange(len(hits)) - group_starts < limit - found[pair_slots]
+                pair_slots, hits = pair_slots[keep], hits[keep]
+            found += np.bincount(pair_slots, minlength=count)
+            if limit is not None:
+                # Sources that reached their limit stop after this level
+                for slot in np.flatnonzero(found >= limit).tolist():
+                    active &= ~bits[slot]
+            level_hits.append((pair_slots, hits))
+
+            frontier_bits = node_bits & active
+            keep = frontier_bits != 0
+            frontier, frontier_bits = nodes[keep], frontier_bits[keep]
+
+        impacts = [[] for _ in range(count)]
+        slots = np.concatenate([level_slots for level_slots, _ in level_hits] or [np.empty(0, dtype=np.int64)])
+        if len(slots):
+            hits = np.concatenate([nodes for _, nodes in level_hits])
+            depths = np.repeat(np.arange(1, len(level_hits) + 1), [len(nodes) for _, nodes in level_hits])
+            paths = self._rebuild_paths(levels, slots, hits, depths, bits)
+            offset = 0
+            for depth, (level_slots, nodes) in enumerate(level_hits, start=1):
+                level_paths = paths[offset:offset + len(nodes), :depth + 1]
+                offset += len(nodes)
+                for slot, consequence, path in zip(level_slots.tolist(), self._name_array[nodes].tolist(),
+                                                   self._name_array[level_paths].tolist()):
+                    impacts[slot].append({'consequence': consequence, 'path': path})
+
+        reached_nodes = np.flatnonzero(seen)
+        reached_bits = seen[reached_nodes]
+        return {
+            source_id: (impacts[slot], set(self._id_array[reached_nodes[(reached_bits & bits[slot]) != 0]].tolist()))
+            for slot, source_id in enumerate(source_ids)
+        }
+
+    def _rebuild_paths(self, levels, slots, hits, depths, bits):
+        """Paths from each hit's source to the hit, as rows of an index array.
+
+        Column k holds the path's node on BFS level k, so row i is a path
+        up to column ``depths[i]`` (the rest is padding). Stepping back one
+        level at a time, each path moves to the first predecessor its
+        source reached on the level before.
+        """
+        rev_indptr, rev_indices, _ = self.predecessors_csr()
+        max_depth = int(depths.max())
+        paths = np.zeros((len(hits), max_depth + 1), dtype=np.int64)
+        paths[np.arange(len(hits)), depths] = hits
+        masks = bits[slots]
+        position = np.full(len(self.node_ids), -1, dtype=np.int64)
+        for k in range(max_depth, 0, -1):
+            rows = np.flatnonzero(depths >= k)
+            counts, positions = _row_positions(rev_indptr, paths[rows, k])
+            owners = np.repeat(np.arange(len(rows)), counts)
+            candidates = rev_indices[positions]
+
+            # A candidate qualifies if the path's source reached it on level k - 1
+            level_nodes, level_bits = levels[k - 1]
+            position[level_nodes] = np.arange(len(level_nodes))
+            found = position[candidates]
+            ok = found >= 0
+            ok[ok] = (level_bits[found[ok]] & masks[rows[owners[ok]]]) != 0
+            position[level_nodes] = -1
+
+            chosen = np.flatnonzero(ok)
+            _, first = np.unique(owners[chosen], return_index=True)
+            paths[rows, k - 1] = candidates[chosen[first]]
+        return paths
+
+    def node_id_for_name(self, name):
+        """Return the id of the first node called ``name``, or None."""
+        if self._name_index is None:
+            name_index = {}
+            for i, node_name in enumerate(self.names):
+                name_index.setdefault(node_name, i)
+            self._name_index = name_index
+        i = self._name_index.get(name)
+        return None if i is None else self.node_ids[i]
+
+    def node_ids_at(self, indices):
+        """Map an array of node indices back to a list of node ids."""
+        return self._id_array[indices].tolist()
+
+
+class CSRSnapshot:
+    """Lazily rebuilt CSRGraph for a KnowledgeGraph.
+
+    current() rebuilds the snapshot when the graph version has moved on.
+    To keep write-heavy periods from rebuilding on every read, a stale
+    snapshot is only rebuilt if at least ``min_interval`` seconds have passed
+    since the last rebuild; otherwise current() returns None and the caller
+    should fall back to traversing the graph directly. Callers that have no
+    such fallback pass ``force=True`` to rebuild regardless; the result is
+    kept, so later readers of the same version share it. Concurrent readers
+    share one rebuild; the graph itself must not change during it.
+    """
+
+    def __init__(self, graph, min_interval=1.0):
+        self.graph = graph
+        self.min_interval = min_interval
+        self._snapshot = None
+        self._built_at = None
+        self._lock = threading.Lock()
+        self.rebuilds = 0
+
+    def current(self, force=False):
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.graph.version:
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == self.graph.version:
+                return snapshot  # another reader rebuilt it while we waited
+            now = time.monotonic()
+            if not force and self._built_at is not None and now - self._built_at < self.min_interval:
+                return None
+            self._snapshot = CSRGraph(self.graph)
+            self._built_at = now
+            self.rebuilds += 1
+            return self._snapshot
+
+    def install(self, csr):
+        """Serve ``csr``, which must hold the graph's current contents (e.g. the
+        mapped file it was just loaded from), as the snapshot of the graph's
+        current version instead of rebuilding one."""
+        with self._lock:
+            csr.version = self.graph.version
+            self._snapshot = csr
+            self._built_at = time.monotonic()
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'version': snapshot.version if snapshot else None,
+            'nodes': len(snapshot) if snapshot else 0,
+            'edges': snapshot.edge_count if snapshot else 0,
+            'bytes': snapshot.nbytes if snapshot else 0,
+            'rebuilds': self.rebuilds
+        }
@@ -0,0 +1,289 @@
+import functools
+from collections import deque
+
+import networkx as nx
+
+
+class KnowledgeGraph(nx.DiGraph):
+    """DiGraph that keeps secondary indexes on node name and type.
+
+    Every networkx mutation entry point (add_node, add_nodes_from, add_edge,
+    add_edges_from, the remove_* methods, clear and clear_edges) is routed
+    through the indexes, so lookups by name or type are O(1) and stay in sync no
+    matter which code path changed the graph. Attributes changed directly
+    through ``G.nodes[n][...]`` bypass the indexes; use add_node to update.
+
+    The same entry points bump ``version`` and notify listeners registered
+    with add_listener, which is how caches derived from the graph learn what
+    changed. A listener is called as ``listener(event, items)`` where event is
+    one of 'add_nodes', 'add_edges', 'remove_nodes', 'remove_edges' or 'clear'
+    and items is a list of node ids or ``(u, v)`` pairs. Added nodes and edges
+    include ones that already existed and only had their attributes updated.
+    Removing a node first reports the removal of its edges.
+    """
+
+    def __init__(self, incoming_graph_data=None, **attr):
+        # Indexes and listeners must exist before the base class loads incoming data
+        self.version = 0
+        self._listeners = []
+        self._indexed = {}        # node id -> (name, type) as currently indexed
+        self._name_index = {}     # name -> {node id: None}, in insertion order
+        self._type_index = {}     # type -> {node id: None}, in insertion order
+        self._duplicate_names = set()
+        super().__init__(incoming_graph_data, **attr)
+
+    # Index maintenance
+
+    def _index_node(self, n):
+        attrs = self._node[n]
+        entry = (attrs.get('name'), attrs.get('type'))
+        old = self._indexed.get(n)
+        if old == entry:
+            return
+        if old is not None:
+            self._unindex_node(n)
+        name, node_type = entry
+        if name is not None:
+            ids = self._name_index.setdefault(name, {})
+            ids[n] = None
+            if len(ids) > 1:
+                self._duplicate_names.add(name)
+        if node_type is not None:
+            self._type_index.setdefault(node_type, {})[n] = None
+        self._indexed[n] = entry
+
+    def _unindex_node(self, n):
+        entry = self._indexed.pop(n, None)
+        if entry is None:
+            return
+        name, node_type = entry
+        if name is not None:
+            ids = self._name_index[name]
+            del ids[n]
+            if not ids:
+                del self._name_index[name]
+            if len(ids) < 2:
+                self._duplicate_names.discard(name)
+        if node_type is not None:
+            ids = self._type_index[node_type]
+            del ids[n]
+            if not ids:
+                del self._type_index[node_type]
+
+    # Change notification
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _notify(self, event, items):
+        self.version += 1
+        for listener in self._listeners:
+            listener(event, items)
+
+    # Lookups
+
+    def node_id_for_name(self, name):
+        """Return the id of the node called ``name``, or None.
+
+        When several nodes share a name the one indexed first wins, so the
+        answer does not depend on dict iteration order elsewhere.
+        """
+        ids = self._name_index.get(name)
+        if not ids:
+            return None
+        return next(iter(ids))
+
+    def node_ids_for_name(self, name):
+        """Return the ids of every node called ``name``, oldest first."""
+        return list(self._name_index.get(name, ()))
+
+    def nodes_of_type(self, node_type):
+        """Return the ids of every node with the given type, oldest first."""
+        return list(self._type_index.get(node_type, ()))
+
+    def has_name(self, name):
+        return name in self._name_index
+
+    @property
+    def duplicate_names(self):
+        """Names that are currently shared by more than one node."""
+        return sorted(self._duplicate_names)
+
+    # Mutation overrides
+
+    def add_node(self, node_for_adding, **attr):
+        super().add_node(node_for_adding, **attr)
+        self._index_node(node_for_adding)
+        self._notify('add_nodes', [node_for_adding])
+
+    def add_nodes_from(self, nodes_for_adding, **attr):
+        nodes_for_adding = list(nodes_for_adding)
+        super().add_nodes_from(nodes_for_adding, **attr)
+        added = []
+        for n in nodes_for_adding:
+            try:
+                known = n in self._node
+            except TypeError:  # (node, attr_dict) tuples are unhashable
+                known = False
+            if not known:
+                n = n[0]
+            self._index_node(n)
+            added.append(n)
+        self._notify('add_nodes', added)
+
+    def add_edge(self, u_of_edge, v_of_edge, **attr):
+        new_nodes = [n for n in (u_of_edge, v_of_edge) if n not in self._node]
+        super().add_edge(u_of_edge, v_of_edge, **attr)
+        if new_nodes:
+            self._notify('add_nodes', list(dict.fromkeys(new_nodes)))
+        self._notify('add_edges', [(u_of_edge, v_of_edge)])
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        ebunch_to_add = list(ebunch_to_add)
+        node = self._node
+        new_nodes = {}
+        for e in ebunch_to_add:
+            for n in e[:2]:
+                if n not in node:
+                    new_nodes[n] = None
+        super().add_edges_from(ebunch_to_add, **attr)
+        if new_nodes:
+            self._notify('add_nodes', list(new_nodes))
+        self._notify('add_edges', [tuple(e[:2]) for e in ebunch_to_add])
+
+    def _incident_edges(self, nodes):
+        edges = {}
+        for n in nodes:
+            for v in self._succ[n]:
+                edges[(n, v)] = None
+            for u in self._pred[n]:
+                edges[(u, n)] = None
+        return list(edges)
+
+    def remove_node(self, n):
+        edges = self._incident_edges([n]) if n in self._node else []
+        super().remove_node(n)
+        self._unindex_node(n)
+        if edges:
+            self._notify('remove_edges', edges)
+        self._notify('remove_nodes', [n])
+
+    def remove_nodes_from(self, nodes):
+        nodes = [n for n in nodes if n in self._node]
+        edges = self._incident_edges(nodes)
+        super().remove_nodes_from(nodes)
+        if edges:
+            self._notify('remove_edges', edges)
+        for n in nodes:
+            self._unindex_node(n)
+        self._notify('remove_nodes', nodes)
+
+    def remove_edge(self, u, v):
+        super().remove_edge(u, v)
+        self._notify('remove_edges', [(u, v)])
+
+    def remove_edges_from(self, ebunch):
+        edges = [tuple(e[:2]) for e in ebunch if self.has_edge(*e[:2])]
+        super().remove_edges_from(edges)
+        self._notify('remove_edges', edges)
+
+    def clear(self):
+        super().clear()
+        self._indexed.clear()
+        self._name_index.clear()
+        self._type_index.clear()
+        self._duplicate_names.clear()
+        self._notify('clear', [])
+
+    def clear_edges(self):
+        edges = list(self.edges())
+        super().clear_edges()
+        self._notify('remove_edges', edges)
+
+    def replace_with(self, other):
+        """Take over ``other``'s nodes and edges, leaving ``other`` empty.
+
+        The adjacency and index dicts are moved rather than copied, so the
+        swap itself is O(1). Listeners see a clear followed by one add of
+        every node and one add of every edge, the same events as loading
+        into an empty graph. Used to build a graph somewhere nobody reads
+        it (an upload being validated, a snapshot file being loaded) and
+        then swap it in at once.
+        """
+        self.clear()
+        for name in ('_node', '_adj', '_pred', '_indexed', '_name_index', '_type_index', '_duplicate_names'):
+            mine = getattr(self, name)
+            setattr(self, name, getattr(other, name))
+            setattr(other, name, mine)
+        for graph in (self, other):
+            graph._succ = graph._adj
+            graph._drop_cached_views()
+        if self._node:
+            self._notify('add_nodes', list(self._node))
+        edges = [(u, v) for u, neighbors in self._succ.items() for v in neighbors]
+        if edges:
+            self._notify('add_edges', edges)
+
+    def _drop_cached_views(self):
+        """Forget the node/edge views networkx caches on first use, which
+        still point at the dicts replace_with moved away."""
+        for klass in type(self).__mro__:
+            for name, value in vars(klass).items():
+                if isinstance(value, functools.cached_property):
+                    self.__dict__.pop(name, None)
+        getattr(self, '__networkx_cache__', {}).clear()
+
+
+class ChangeLog:
+    """Bounded log of graph changes for serving deltas between versions.
+
+    Registers itself as a listener on a KnowledgeGraph and keeps the most
+    recent ``(version, event, items)`` records, holding at most ``max_items``
+    node ids and edges in total. changes_since returns the net effect of
+    every change after a given version, or None when that version is older
+    than the log reaches (or the graph was cleared since), in which case the
+    caller has to send a full snapshot instead.
+    """
+
+    def __init__(self, graph, max_items=100000):
+        self.graph = graph
+        self.max_items = max_items
+        self._records = deque()
+        self._items = 0
+        self.floor = graph.version   # oldest version a delta can start from
+        graph.add_listener(self.record)
+
+    def record(self, event, items):
+        version = self.graph.version
+        if event == 'clear':
+            self._records.clear()
+            self._items = 0
+            self.floor = version
+            return
+        self._records.append((version, event, items))
+        self._items += len(items)
+        while self._items > self.max_items and self._records:
+            dropped_version, _, dropped_items = self._records.popleft()
+            self._items -= len(dropped_items)
+            self.floor = dropped_version
+
+    def changes_since(self, version):
+        """Return ``(node_ids, edges)``, the nodes and ``(u, v)`` edges touched
+        after ``version``, or None if the log cannot answer. Whether each one
+        was added, updated or removed is read off the current graph."""
+        if version < self.floor or version > self.graph.version:
+            return None
+        nodes = {}
+        edges = {}
+        # Records are in version order, so walk back from the newest
+        for record_version, event, items in reversed(self._records):
+            if record_version <= version:
+                break
+            if event in ('add_nodes', 'remove_nodes'):
+                nodes.update(dict.fromkeys(items))
+            else:
+                edges.update(dict.fromkeys(items))
+        return list(nodes), list(edges)
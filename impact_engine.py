@@ -0,0 +1,176 @@
+import threading
+from collections import OrderedDict
+
+
+def _node_name(graph, n):
+    return graph._node[n].get('name', n)
+
+
+def _rebuild_path(parents, target):
+    path = [target]
+    parent = parents[target]
+    while parent is not None:
+        path.append(parent)
+        parent = parents[parent]
+    path.reverse()
+    return path
+
+
+def find_impacts(graph, source, max_depth=None, limit=None, target_type='consequence', check=None):
+    """Return every node of ``target_type`` reachable from ``source``.
+
+    A single breadth-first search records a parent pointer for each node it
+    reaches, and each result path is rebuilt from that tree, so the cost is
+    O(V + E) for the whole query instead of one shortest-path search per
+    consequence. Paths are shortest paths (in hops) and results come out in
+    order of distance from the source.
+
+    ``max_depth`` bounds the number of hops explored and ``limit`` stops the
+    search once that many consequences have been found. ``check``, if given,
+    is called before each BFS level and may raise to abort the search.
+
+    Returns a ``(impacts, reached)`` tuple: the list of
+    ``{'consequence': name, 'path': [names]}`` dicts and the set of node ids
+    the search touched, which is what the result depends on.
+    """
+    # Walk the raw adjacency dicts; the public views add a wrapper per lookup
+    succ = graph._succ
+    nodes = graph._node
+    parents = {source: None}
+    impacts = []
+    if limit is not None and limit <= 0:
+        return impacts, set(parents)
+
+    frontier = [source]
+    depth = 0
+    while frontier and (max_depth is None or depth < max_depth):
+        if check is not None:
+            check()
+        depth += 1
+        next_frontier = []
+        for u in frontier:
+            for v in succ[u]:
+                if v in parents:
+                    continue
+                parents[v] = u
+                next_frontier.append(v)
+                if nodes[v].get('type') == target_type:
+                    impacts.append({
+                        'consequence': _node_name(graph, v),
+                        'path': [_node_name(graph, n) for n in _rebuild_path(parents, v)]
+                    })
+                    if limit is not None and len(impacts) >= limit:
+                        return impacts, set(parents)
+        frontier = next_frontier
+
+    return impacts, set(parents)
+
+
+class ImpactCache:
+    """LRU cache of impact query results with precise invalidation.
+
+    Each entry remembers the set of nodes its search reached. A result can
+    only change when one of those nodes changes or gains or loses an
+    outgoing edge, so graph change notifications (see
+    KnowledgeGraph.add_listener) drop exactly the entries that depend on the
+    touched nodes and leave the rest cached. Size is bounded both by entry
+    count and by ``max_cost``, the total number of node references held
+    across all entries. All methods are thread-safe.
+    """
+
+    def __init__(self, max_entries=1024, max_cost=1000000):
+        self.max_entries = max_entries
+        self.max_cost = max_cost
+        self._entries = OrderedDict()   # key -> (version, impacts, reached, cost)
+        self._dependents = {}           # node id -> set of keys whose search reached it
+        self._cost = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the cached impacts for ``key``, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, impacts, reached):
+        cost = len(reached) + sum(len(impact['path']) for impact in impacts)
+        if cost > self.max_cost:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (version, impacts, reached, cost)
+            self._cost += cost
+            for n in reached:
+                self._dependents.setdefault(n, set()).add(key)
+            while len(self._entries) > self.max_entries or self._cost > self.max_cost:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _discard(self, key):
+        _, _, reached, cost = self._entries.pop(key)
+        self._cost -= cost
+        for n in reached:
+            keys = self._dependents.get(n)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._dependents[n]
+
+    def invalidate_nodes(self, nodes):
+        """Drop every entry whose search reached one of ``nodes``."""
+        with self._lock:
+            for n in nodes:
+                keys = self._dependents.get(n)
+                if not keys:
+                    continue
+                for key in list(keys):
+                    self._discard(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._dependents.clear()
+            self._cost = 0
+
+    def graph_changed(self, event, items):
+        """KnowledgeGraph listener that invalidates affected entries."""
+        if event == 'clear':
+            self.clear()
+        elif event in ('add_edges', 'remove_edges'):
+            # Only searches that reached the edge's source could traverse it
+            self.invalidate_nodes(u for u, _ in items)
+        else:
+            self.invalidate_nodes(items)
+
+    def stats(self):
+        with self._lock:
+            return self._stats()
+
+    def _stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'cost': self._cost,
+            'max_entries': self.max_entries,
+            'max_cost': self.max_cost,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }
@@ -0,0 +1,269 @@
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+# Columns of the tabular (CSV / JSON list) upload format
+TABULAR_COLUMNS = ['source', 'source_type', 'target', 'target_type', 'relation']
+
+# Optional tabular column holding a numeric edge weight; blank cells leave the edge unweighted
+WEIGHT_COLUMN = 'weight'
+
+# Rows parsed and applied at a time, which bounds peak memory for large uploads
+DEFAULT_CHUNK_ROWS = 100000
+
+# Records applied at a time by NDJSON uploads
+DEFAULT_NDJSON_BATCH = 10000
+
+# How many offending rows to list in a validation error
+MAX_REPORTED_ROWS = 10
+
+
+def _row_list(mask):
+    rows = [int(i) + 1 for i in mask[mask].index[:MAX_REPORTED_ROWS]]
+    more = int(mask.sum()) - len(rows)
+    text = ', '.join(str(r) for r in rows)
+    return f'{text} (and {more} more)' if more > 0 else text
+
+
+def _node_ids(types, names):
+    return types + '_' + names.str.replace(' ', '_', regex=False)
+
+
+def weight_error(weight):
+    """Return a validation error for an edge weight, or None if it is valid.
+    Weights must be finite, non-negative numbers."""
+    if isinstance(weight, bool) or not isinstance(weight, (int, float)):
+        return 'weight must be a number'
+    if not math.isfinite(weight) or weight < 0:
+        return 'weight must be a finite, non-negative number'
+    return None
+
+
+def edge_attrs(relationship, weight=None):
+    """Edge attribute dict; ``weight`` is stored only when one was given."""
+    if weight is None:
+        return {'relationship': relationship}
+    return {'relationship': relationship, 'weight': float(weight)}
+
+
+def _frame_weights(df):
+    """Numeric weights of a chunk (NaN for blank cells), or None without a weight column."""
+    if WEIGHT_COLUMN not in df.columns:
+        return None
+    return pd.to_numeric(df[WEIGHT_COLUMN], errors='coerce').astype(float)
+
+
+def validate_edge_frame(df, node_types, relationship_types):
+    """Check a chunk of tabular rows column-wise and raise ValueError on the
+    first problem found. Rows are reported 1-based, counting data rows only."""
+    missing = [column for column in TABULAR_COLUMNS if column not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required field: '{missing[0]}'. "
+                         f"Expected columns: {', '.join(TABULAR_COLUMNS)}")
+
+    empty = df[TABULAR_COLUMNS].isna().any(axis=1)
+    if empty.any():
+        raise ValueError(f'Empty required field in rows {_row_list(empty)}')
+
+    bad_types = ~df['source_type'].isin(node_types) | ~df['target_type'].isin(node_types)
+    if bad_types.any():
+        raise ValueError(f'Invalid node type in rows {_row_list(bad_types)}. '
+                         f'Must be one of: {list(node_types)}')
+
+    bad_relations = ~df['relation'].isin(relationship_types)
+    if bad_relations.any():
+        raise ValueError(f'Invalid relationship type in rows {_row_list(bad_relations)}. '
+                         f'Must be one of: {list(relationship_types)}')
+
+    weights = _frame_weights(df)
+    if weights is not None:
+        bad_weights = df[WEIGHT_COLUMN].notna() & ~(np.isfinite(weights) & (weights >= 0))
+        if bad_weights.any():
+            raise ValueError(f'Invalid weight in rows {_row_list(bad_weights)}. '
+                             f'Must be a finite, non-negative number')
+
+
+def add_edge_frame(graph, df, node_types, relationship_types):
+    """Validate one chunk of tabular rows and add its nodes and edges to graph.
+
+    Node ids are derived as ``<type>_<name with spaces as underscores>``, the
+    same scheme the row-by-row loader used, but computed on whole columns.
+    Returns ``(node_count, edge_count)`` for the chunk.
+    """
+    validate_edge_frame(df, node_types, relationship_types)
+
+    weights = _frame_weights(df)
+    if weights is None:
+        weights = [None] * len(df)
+    else:
+        weights = [None if math.isnan(w) else w for w in weights.tolist()]
+    df = df[TABULAR_COLUMNS].astype(str)
+    source_ids = _node_ids(df['source_type'], df['source'])
+    target_ids = _node_ids(df['target_type'], df['target'])
+
+    nodes = pd.concat([
+        pd.DataFrame({'id': source_ids, 'type': df['source_type'], 'name': df['source']}),
+        pd.DataFrame({'id': target_ids, 'type': df['target_type'], 'name': df['target']})
+    ], ignore_index=True).drop_duplicates('id', keep='last')
+
+    graph.add_nodes_from(
+        (node_id, {'type': node_type, 'name': name})
+        for node_id, node_type, name in zip(nodes['id'], nodes['type'], nodes['name'])
+    )
+    graph.add_edges_from(
+        (source_id, target_id, edge_attrs(relationship, weight))
+        for source_id, target_id, relationship, weight in zip(source_ids, target_ids, df['relation'], weights)
+    )
+    return len(nodes), len(df)
+
+
+def load_csv(graph, file, node_types, relationship_types, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Stream a tabular CSV into graph chunk by chunk.
+
+    Returns the number of rows processed. Chunks before an invalid one have
+    already been applied when ValueError is raised, so uploads load into a
+    separate graph and only replace the served one on success.
+    """
+    rows = 0
+    for chunk in pd.read_csv(file, chunksize=chunk_rows, dtype=str):
+        add_edge_frame(graph, chunk, node_types, relationship_types)
+        rows += len(chunk)
+    return rows
+
+
+def load_records(graph, records, node_types, relationship_types, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Add a list of tabular row dicts to graph in chunks. Returns the row count."""
+    for start in range(0, len(records), chunk_rows):
+        chunk = pd.DataFrame(records[start:start + chunk_rows])
+        chunk.index += start
+        add_edge_frame(graph, chunk, node_types, relationship_types)
+    return len(records)
+
+
+def _node_record_error(record, node_types):
+    if not all([record.get('id'), record.get('type'), record.get('name')]):
+        return 'Missing required fields: id, type, name'
+    if not isinstance(record['id'], (str, int)):
+        return 'id must be a string or an integer'
+    if record['type'] not in node_types:
+        return f'Invalid node type. Must be one of: {list(node_types)}'
+    return None
+
+
+def _edge_record_error(record, relationship_types):
+    if not all([record.get('source'), record.get('target'), record.get('relationship')]):
+        return 'Missing required fields: source, target, relationship'
+    if not isinstance(record['source'], (str, int)) or not isinstance(record['target'], (str, int)):
+        return 'source and target must be strings or integers'
+    if record['relationship'] not in relationship_types:
+        return f'Invalid relationship type. Must be one of: {list(relationship_types)}'
+    if record.get('weight') is not None:
+        return weight_error(record['weight'])
+    return None
+
+
+def _ndjson_record_error(record, node_types, relationship_types):
+    if not isinstance(record, dict):
+        return 'Record must be an object'
+    kind = record.get('kind')
+    if kind == 'node':
+        return _node_record_error(record, node_types)
+    if kind == 'edge':
+        return _edge_record_error(record, relationship_types)
+    return 'kind must be "node" or "edge"'
+
+
+def load_graph_json(graph, data, node_types, relationship_types):
+    """Add a ``{"nodes": [...], "edges": [...]}`` document to graph.
+
+    Nodes and edges take the same fields as NDJSON records, without
+    ``kind``. Every record is checked, and both ends of every edge must be
+    among the nodes or already in graph, before anything is added; raises
+    ValueError naming the first bad record. Returns ``(nodes, edges)``.
+    """
+    nodes, edges = data['nodes'], data['edges']
+    if not isinstance(nodes, list) or not isinstance(edges, list):
+        raise ValueError('"nodes" and "edges" must be arrays')
+    for index, node in enumerate(nodes):
+        error = _node_record_error(node, node_types) if isinstance(node, dict) else 'Record must be an object'
+        if error:
+            raise ValueError(f'Node {index}: {error}')
+    ids = {node['id'] for node in nodes}
+    for index, edge in enumerate(edges):
+        error = _edge_record_error(edge, relationship_types) if isinstance(edge, dict) else 'Record must be an object'
+        if error:
+            raise ValueError(f'Edge {index}: {error}')
+        for end in ('source', 'target'):
+            if edge[end] not in ids and edge[end] not in graph:
+                raise ValueError(f'Edge {index}: {end.capitalize()} node "{edge[end]}" not found')
+    graph.add_nodes_from((node['id'], {'type': node['type'], 'name': node['name']}) for node in nodes)
+    graph.add_edges_from((edge['source'], edge['target'], edge_attrs(edge['relationship'], edge.get('weight')))
+                         for edge in edges)
+    return len(nodes), len(edges)
+
+
+def load_ndjson(graph, stream, node_types, relationship_types,
+                batch_size=DEFAULT_NDJSON_BATCH, progress=None):
+    """Stream newline-delimited JSON records into graph.
+
+    Each non-blank line is one record tagged by ``kind``::
+
+        {"kind": "node", "id": "activity_1", "type": "activity", "name": "Mining"}
+        {"kind": "edge", "source": "activity_1", "target": "factor_1", "relationship": "causes",
+         "weight": 0.8}
+
+    Edges refer to nodes by id, like the nodes/edges JSON format, and may
+    carry an optional ``weight``; both ends must be nodes already in graph
+    or on an earlier line. Lines are
+    read one at a time and applied every ``batch_size`` records, so memory
+    stays flat regardless of the upload size. ``progress`` is called with a
+    dict of running counts after every batch. Returns the final counts;
+    raises ValueError naming the first bad line, after applying the batches
+    before it (uploads load into a separate graph for that reason).
+    """
+    counts = {'lines': 0, 'bytes': 0, 'nodes': 0, 'edges': 0}
+    nodes = []
+    edges = []
+    batch_ids = set()  # ids of the nodes not applied yet
+
+    def flush():
+        if nodes:
+            graph.add_nodes_from(nodes)
+            counts['nodes'] += len(nodes)
+            nodes.clear()
+            batch_ids.clear()
+        if edges:
+            graph.add_edges_from(edges)
+            counts['edges'] += len(edges)
+            edges.clear()
+        if progress is not None:
+            progress(dict(counts))
+
+    for line_number, line in enumerate(stream, 1):
+        counts['lines'] = line_number
+        counts['bytes'] += len(line)
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f'Invalid JSON on line {line_number}: {e}')
+        error = _ndjson_record_error(record, node_types, relationship_types)
+        if error:
+            raise ValueError(f'Line {line_number}: {error}')
+        if record['kind'] == 'node':
+            nodes.append((record['id'], {'type': record['type'], 'name': record['name']}))
+            batch_ids.add(record['id'])
+        else:
+            for end in ('source', 'target'):
+                if record[end] not in batch_ids and record[end] not in graph:
+                    raise ValueError(f'Line {line_number}: {end.capitalize()} node "{record[end]}" not found')
+            edges.append((record['source'], record['target'],
+                          edge_attrs(record['relationship'], record.get('weight'))))
+        if len(nodes) + len(edges) >= batch_size:
+            flush()
+
+    flush()
+    return counts
@@ -0,0 +1,189 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job that noticed it has been cancelled."""
+
+
+class JobQueueFull(Exception):
+    """Raised by JobManager.submit when too many jobs are pending."""
+
+
+class Job:
+    """One background task and its outcome."""
+
+    def __init__(self, kind, key, params, cache=True):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.params = params
+        self.cache = cache
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+        self._future = None
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def check(self):
+        """Raise JobCancelled if cancellation was requested. Long-running job
+        functions call this at convenient points (e.g. once per BFS level)."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def wait(self, timeout=None):
+        """Block until the job has finished; returns False on timeout."""
+        return self._finished.wait(timeout)
+
+    def to_json(self, include_result=False):
+        data = {
+            'id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'cancel_requested': self.cancel_requested,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error
+        }
+        if include_result and self.status == DONE:
+            data['result'] = self.result
+        return data
+
+
+class JobManager:
+    """Runs jobs on a bounded thread pool.
+
+    At most ``max_workers`` jobs run at once and at most ``max_pending``
+    may be queued or running; submit() raises JobQueueFull beyond that.
+    Submitting a job whose ``key`` matches one that is still queued or
+    running returns that job instead of starting another. Finished jobs are
+    kept for ``result_ttl`` seconds; when ``cache`` is set, an identical
+    submission in that window also returns the finished job.
+    """
+
+    def __init__(self, max_workers=2, max_pending=100, result_ttl=300):
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='graph-job')
+        self._lock = threading.Lock()
+        self._jobs = {}        # id -> Job, in submission order
+        self._by_key = {}      # key -> Job that later identical submissions reuse
+        self.submitted = 0
+        self.deduplicated = 0
+
+    def submit(self, kind, key, params, func, cache=True):
+        """Run ``func(job)`` in the background and return ``(job, deduplicated)``.
+
+        The function's return value becomes the job result; it may raise
+        JobCancelled after calling job.check().
+        """
+        with self._lock:
+            self._expire()
+            existing = self._by_key.get(key)
+            if existing is not None:
+                self.deduplicated += 1
+                return existing, True
+            pending = sum(1 for job in self._jobs.values() if job.status not in FINISHED)
+            if pending >= self.max_pending:
+                raise JobQueueFull(f'Too many pending jobs (maximum {self.max_pending})')
+            job = Job(kind, key, params, cache=cache)
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            self.submitted += 1
+            job._future = self._executor.submit(self._run, job, func)
+        return job, False
+
+    def _run(self, job, func):
+        with self._lock:
+            if job.status != QUEUED:
+                return
+            job.status = RUNNING
+            job.started_at = time.time()
+        try:
+            job.check()  # cancelled after its worker picked it up but before it started
+            result = func(job)
+        except JobCancelled:
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            self._finish(job, FAILED, error=str(e))
+        else:
+            self._finish(job, DONE, result=result)
+
+    def _finish(self, job, status, result=None, error=None):
+        with self._lock:
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished_at = time.time()
+            # Only successful, cacheable results are handed to later submissions
+            if self._by_key.get(job.key) is job and not (status == DONE and job.cache):
+                del self._by_key[job.key]
+        job._finished.set()
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            self._expire()
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """Request cancellation. A queued job is cancelled at once; a running
+        one stops the next time it calls job.check(). Returns the job, or
+        None if it is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED:
+                return job
+            job._cancel.set()
+            if job.status != QUEUED or not job._future.cancel():
+                return job
+        self._finish(job, CANCELLED)
+        return job
+
+    def _expire(self):
+        """Forget finished jobs older than the TTL. Caller holds the lock."""
+        cutoff = time.time() - self.result_ttl
+        expired = [job for job in self._jobs.values()
+                   if job.status in FINISHED and job.finished_at < cutoff]
+        for job in expired:
+            del self._jobs[job.id]
+            if self._by_key.get(job.key) is job:
+                del self._by_key[job.key]
+
+    def shutdown(self):
+        with self._lock:
+            jobs = list(self._jobs)
+        for job_id in jobs:
+            self.cancel(job_id)
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            counts = {status: 0 for status in (QUEUED, RUNNING) + FINISHED}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return dict(counts, submitted=self.submitted, deduplicated=self.deduplicated,
+                        max_pending=self.max_pending, result_ttl=self.result_ttl)
@@ -1,13 +1,109 @@
-from flask import Flask, request, jsonify, render_template
-import networkx as nx
+from flask import Flask, request, jsonify, render_template, Response, send_file
+import numpy as np
+import atexit
+import functools
+import hashlib
+import hmac
 import json
-import pandas as pd
-from datetime import datetime
+import logging
+import os
+import tempfile
+import threading
+import time
+from dotenv import load_dotenv
+from graph_store import KnowledgeGraph, ChangeLog
+from impact_engine import find_impacts, ImpactCache
+from scoring import impact_scores
+from path_search import k_shortest_paths
+from pattern_query import parse_pattern, match_pattern
+from layout import LayoutCache
+from metrics import MetricsRegistry, SIZE_BUCKETS, CONTENT_TYPE as METRICS_CONTENT_TYPE
+import profiling
+import ingest
+from payload_cache import GraphPayloadCache, dump_json
+from csr_graph import CSRGraph, CSRSnapshot
+from binary_snapshot import BinarySnapshot, MappedSnapshot, encode_csr, snapshot_error
+from persistence import GraphJournal
+from concurrency import ReadWriteLock
+from shared_snapshot import SnapshotPublisher, SnapshotReader
+from jobs import JobManager, JobQueueFull, DONE, FINISHED
+from werkzeug.datastructures import FileStorage
+
+load_dotenv()
+
+# Log level from KG_LOG_LEVEL (DEBUG shows every node and edge added)
+logging.basicConfig(level=os.environ.get('KG_LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Initialize the knowledge graph
-G = nx.DiGraph()
+# Initialize the knowledge graph (indexed by node name and type)
+G = KnowledgeGraph()
+
+# Requests that read G share this lock and run in parallel; requests that
+# change it take it exclusively, so readers never see a half-applied write
+graph_lock = ReadWriteLock()
+
+# Impact query results, invalidated per node as the graph changes
+IMPACT_CACHE_MAX_ENTRIES = 1024
+IMPACT_CACHE_MAX_COST = 1000000  # total node references held by cached results
+impact_cache = ImpactCache(max_entries=IMPACT_CACHE_MAX_ENTRIES, max_cost=IMPACT_CACHE_MAX_COST)
+G.add_listener(impact_cache.graph_changed)
+
+# Array (CSR) copy of the graph used for traversals; while the graph is
+# changing, impact reads fall back to walking G directly between rebuilds,
+# and endpoints that need the arrays force one rebuild per version
+CSR_REBUILD_INTERVAL = 1.0  # seconds
+csr_snapshot = CSRSnapshot(G, min_interval=CSR_REBUILD_INTERVAL)
+
+# Weighted impact scoring (/api/impact_scores)
+SCORE_DEFAULT_K = 10
+SCORE_MAX_K = 1000
+SCORE_DEFAULT_DEPTH = 10
+SCORE_MAX_DEPTH = 100
+
+# Multi-path enumeration (/api/impact_paths)
+PATHS_DEFAULT_K = 3
+PATHS_MAX_K = 100
+PATHS_DEFAULT_DEPTH = 6
+PATHS_MAX_DEPTH = 20
+PATHS_DEFAULT_MAX = 1000
+PATHS_MAX_PATHS = 100000
+PATHS_DEFAULT_BUDGET = 1.0  # seconds
+PATHS_MAX_BUDGET = 30.0
+
+# Pattern queries (/api/pattern_query)
+PATTERN_DEFAULT_LIMIT = 1000
+PATTERN_MAX_LIMIT = 100000
+
+# Neighborhood extraction (/api/subgraph)
+SUBGRAPH_DEFAULT_NODES = 500
+SUBGRAPH_MAX_NODES = 20000
+SUBGRAPH_MAX_HOPS = 10
+
+# Server-side node positions, computed once per graph version on a
+# background thread and sent with /api/get_graph and /api/subgraph once
+# ready; larger graphs are not laid out
+LAYOUT_MAX_NODES = 2000
+layout_cache = LayoutCache(max_nodes=LAYOUT_MAX_NODES)
+
+# Request and traversal metrics, served at /api/metrics in the Prometheus
+# text format. Routes are labelled by their URL rule, not the raw path, so
+# the number of label values stays bounded
+metrics = MetricsRegistry()
+metrics.counter('kg_http_requests_total', 'HTTP requests by route, method and status',
+                labels=('route', 'method', 'status'))
+metrics.counter('kg_http_request_errors_total', 'HTTP requests answered with a 5xx status',
+                labels=('route', 'method'))
+metrics.histogram('kg_http_request_duration_seconds', 'Time spent producing the response',
+                  labels=('route', 'method'))
+metrics.histogram('kg_traversal_nodes', 'Nodes reached by a graph traversal',
+                  labels=('query',), buckets=SIZE_BUCKETS)
+
+# Recent changes, so /api/get_graph?since=<version> can return deltas
+CHANGE_LOG_MAX_ITEMS = 100000
+change_log = ChangeLog(G, max_items=CHANGE_LOG_MAX_ITEMS)
 
 # Node types
 NODE_TYPES = {
@@ -26,155 +122,1097 @@ RELATIONSHIP_TYPES = [
     'impacts'
 ]
 
+# Largest batch accepted by the bulk insert endpoints
+MAX_BULK_ITEMS = 50000
+
+# Rows parsed and applied at a time by CSV / JSON list uploads
+UPLOAD_CHUNK_ROWS = ingest.DEFAULT_CHUNK_ROWS
+
+# Records applied at a time by NDJSON uploads
+UPLOAD_NDJSON_BATCH = ingest.DEFAULT_NDJSON_BATCH
+
+# Progress of the most recent upload, polled through /api/upload_progress
+upload_progress = {'status': 'idle'}
+
+# Background jobs (/api/jobs) for long impact queries and uploads
+JOB_TYPES = ['query_impacts', 'upload']
+JOB_WORKERS = 2
+JOB_MAX_PENDING = 100
+JOB_RESULT_TTL = 300  # seconds a finished job and its result are kept
+JOB_MAX_WAIT = 30  # longest a ?wait= poll may block, in seconds
+job_manager = JobManager(max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING, result_ttl=JOB_RESULT_TTL)
+
+# Durable storage: set KG_DATA_DIR to keep the graph in a write-ahead log
+# plus snapshots there and reload it on startup
+DATA_DIR = os.environ.get('KG_DATA_DIR')
+WAL_FLUSH_INTERVAL = float(os.environ.get('KG_WAL_FLUSH_INTERVAL', '0.01'))  # seconds per group commit
+SNAPSHOT_EVERY = int(os.environ.get('KG_SNAPSHOT_EVERY', '100000'))  # logged items between snapshots
+journal = None
+
+# Fast startup: set KG_LOAD_SNAPSHOT to a .kgs file (see binary_snapshot.py)
+# to load it into an empty graph on startup. Reads are answered from its
+# memory-mapped arrays right away while G is built from it in the background,
+# and writes wait for that build. KG_LOAD_SNAPSHOT_VERIFY=1 checks the file's
+# CRC first, which reads all of it
+LOAD_SNAPSHOT = os.environ.get('KG_LOAD_SNAPSHOT')
+LOAD_SNAPSHOT_VERIFY = os.environ.get('KG_LOAD_SNAPSHOT_VERIFY', '').lower() in ('1', 'true', 'yes')
+mapped_snapshot = None
+mapped_csr = None   # the mapped file's CSRGraph while G is being built from it
+graph_ready = threading.Event()   # cleared while G is being built
+graph_ready.set()
+
+# Multi-process serving: with KG_SHARED_SNAPSHOT set, the writer process
+# (KG_SHARED_ROLE=writer, the default) publishes the graph to POSIX shared
+# memory under that name, and reader processes (KG_SHARED_ROLE=reader)
+# serve get_graph and query_impacts from it and refuse writes
+SHARED_SNAPSHOT = os.environ.get('KG_SHARED_SNAPSHOT')
+SHARED_ROLE = os.environ.get('KG_SHARED_ROLE', 'writer')
+SHARED_PUBLISH_INTERVAL = float(os.environ.get('KG_SHARED_PUBLISH_INTERVAL', '0.5'))  # seconds between publishes
+shared_publisher = None
+shared_reader = None
+
+# Request profiling, off unless KG_PROFILING=1. A request sent with an
+# X-Profile header (or ?profile=1) then runs under cProfile, and requests
+# slower than KG_PROFILE_SLOW_MS have their stacks sampled; the newest
+# KG_PROFILE_KEEP profiles are kept in KG_PROFILE_DIR and served by
+# /api/profiles. If KG_PROFILE_TOKEN is set, profiling a request and
+# reading profiles require it in the X-Profile-Token header; it is never
+# taken from the query string, which ends up in access logs
+PROFILING = os.environ.get('KG_PROFILING', '').lower() in ('1', 'true', 'yes')
+PROFILE_TOKEN = os.environ.get('KG_PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('KG_PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'kg-profiles')
+PROFILE_KEEP = int(os.environ.get('KG_PROFILE_KEEP', '50'))
+PROFILE_SLOW_MS = float(os.environ.get('KG_PROFILE_SLOW_MS', '0'))  # 0 turns slow-request sampling off
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('KG_PROFILE_SAMPLE_INTERVAL', '0.005'))  # seconds
+profile_store = None
+slow_sampler = None
+
+def init_persistence(directory):
+    """Recover G from directory and journal every later change to it"""
+    global journal
+    journal = GraphJournal(G, directory, flush_interval=WAL_FLUSH_INTERVAL, snapshot_every=SNAPSHOT_EVERY,
+                           lock=graph_lock)
+    replayed = journal.recover()
+    journal.start()
+    logger.info("Recovered graph from %s: %d nodes, %d edges, %d log records replayed", directory, len(G), G.number_of_edges(), replayed)
+    return journal
+
+def load_snapshot_file(path, verify=LOAD_SNAPSHOT_VERIFY):
+    """Replace G with a binary snapshot file.
+
+    The file is mapped and its arrays answer reads at once (see
+    _snapshot_csr); G is built from it on a background thread and swapped
+    in when done, and writes wait until then (graph_ready). The file stays
+    mapped, so the CSR snapshot of the loaded version remains a view of it
+    rather than a rebuild.
+    """
+    global mapped_snapshot, mapped_csr
+    graph_ready.wait()
+    start = time.perf_counter()
+    snapshot = MappedSnapshot(path, verify=verify)
+    csr = snapshot.to_csr()
+    with graph_lock.write():
+        graph_ready.clear()
+        G.clear()
+        csr_snapshot.install(csr)
+        mapped_snapshot, mapped_csr = snapshot, csr
+    logger.info("Mapped %s: %d nodes, %d edges in %.2f s", path, snapshot.node_count, snapshot.edge_count,
+                time.perf_counter() - start)
+    threading.Thread(target=_build_graph, args=(snapshot, csr, path), name='kg-load-snapshot', daemon=True).start()
+    return snapshot
+
+def _build_graph(snapshot, csr, path):
+    """Build G from a mapped snapshot file (see load_snapshot_file)"""
+    global mapped_csr
+    start = time.perf_counter()
+    try:
+        csr.build_indexes()  # before the first lookup has to
+        staged = KnowledgeGraph()
+        snapshot.load_into(staged)
+        with graph_lock.write():
+            G.replace_with(staged)
+            csr_snapshot.install(csr)
+            mapped_csr = None
+        logger.info("Built graph from %s in %.2f s", path, time.perf_counter() - start)
+    except Exception:
+        logger.exception("Error building the graph from %s", path)
+        with graph_lock.write():
+            mapped_csr = None
+            G.clear()  # so the installed CSR snapshot is stale
+    finally:
+        graph_ready.set()
+    if journal is not None:
+        journal.commit()
+
+def init_profiling(directory, keep=PROFILE_KEEP, slow_ms=PROFILE_SLOW_MS):
+    """Keep request profiles in directory and sample requests slower than slow_ms"""
+    global profile_store, slow_sampler
+    profile_store = profiling.ProfileStore(directory, max_profiles=keep)
+    if slow_ms > 0:
+        slow_sampler = profiling.SlowRequestSampler(profile_store, slow_ms / 1000, interval=PROFILE_SAMPLE_INTERVAL)
+    logger.info("Profiling requests into %s", directory)
+
+def init_shared_snapshots(name, role):
+    """Publish G to shared memory (writer) or serve reads from it (reader)"""
+    global shared_publisher, shared_reader
+    if role == 'reader':
+        shared_reader = SnapshotReader(name)
+        shared_reader.start()
+        atexit.register(shared_reader.close)
+        logger.info("Serving shared snapshots from %s", name)
+    elif role == 'writer':
+        shared_publisher = SnapshotPublisher(G, name, lock=graph_lock, interval=SHARED_PUBLISH_INTERVAL,
+                                             source=_published_csr)
+        shared_publisher.start()
+        atexit.register(shared_publisher.close)
+        logger.info("Publishing shared snapshots as %s", name)
+    else:
+        raise ValueError(f'KG_SHARED_ROLE must be "writer" or "reader", not "{role}"')
+
+def _published_csr():
+    """The CSRGraph the shared snapshot publisher writes out for G"""
+    return mapped_csr if mapped_csr is not None else CSRGraph(G)
+
+def _shared_csr():
+    """The current shared snapshot, or an error response if none is published yet"""
+    csr = shared_reader.current()
+    if csr is None:
+        return None, (jsonify({'error': 'No shared snapshot has been published yet'}), 503)
+    return csr, None
+
+def _snapshot_csr():
+    """The CSRGraph reads are answered from instead of G, if any: the shared
+    snapshot in reader workers, or the mapped snapshot file while G is being
+    built from it. Returns ``(csr, error_response)``; csr is None when reads
+    should use G."""
+    if shared_reader is not None:
+        return _shared_csr()
+    return mapped_csr, None
+
+def reads_graph(view):
+    """Run a view while holding the graph lock for reading"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with graph_lock.read():
+            return view(*args, **kwargs)
+    return wrapper
+
+def _apply_write(func, *args, **kwargs):
+    """Call func with exclusive access to the graph.
+
+    When persistence is on, this returns once the changes are durable; that
+    wait happens after the lock is released so concurrent writers still
+    share one fsync. Writes wait while G is being built from a snapshot file.
+    """
+    graph_ready.wait()
+    with graph_lock.write():
+        result = func(*args, **kwargs)
+    if journal is not None:
+        journal.commit()
+    return result
+
+READ_ONLY_WORKER_ERROR = 'This worker serves a read-only shared snapshot; send writes to the writer process'
+
+def _receive_body():
+    """Read and parse the request body now; Flask keeps the result for the
+    view, so a write never waits on a slow client while holding the lock"""
+    request.get_data(parse_form_data=True)
+    if request.is_json:
+        request.get_json(silent=True)
+
+def writes_graph(view):
+    """Run a view with exclusive access to the graph (see _apply_write)"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if shared_reader is not None:
+            return jsonify({'error': READ_ONLY_WORKER_ERROR}), 403
+        _receive_body()
+        return _apply_write(view, *args, **kwargs)
+    return wrapper
+
+def _optional_int_arg(name):
+    """Read a non-negative integer query parameter, or None if it is absent"""
+    return _optional_int(request.args.get(name), name)
+
+def _optional_int(value, name):
+    """Validate a non-negative integer option, or None if it is absent"""
+    if value is None or value == '':
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+    if value < 0:
+        raise ValueError(f'{name} must be non-negative')
+    return value
+
+def _node_fields_error(node_id, node_type, node_name):
+    """Return a validation error for a node's fields, or None if they are valid"""
+    if not all([node_id, node_type, node_name]):
+        return 'Missing required fields: id, type, name'
+    if node_type not in NODE_TYPES:
+        return f'Invalid node type. Must be one of: {list(NODE_TYPES.keys())}'
+    return None
+
+def _edge_fields_error(source, target, relationship, weight=None):
+    """Return a validation error for an edge's fields, or None if they are valid"""
+    if not all([source, target, relationship]):
+        return 'Missing required fields: source, target, relationship'
+    if relationship not in RELATIONSHIP_TYPES:
+        return f'Invalid relationship type. Must be one of: {RELATIONSHIP_TYPES}'
+    if weight is not None:
+        return ingest.weight_error(weight)
+    return None
+
+def _bulk_items(data, key):
+    """Extract the item list from a bulk request: a bare array or {key: [...]}"""
+    if isinstance(data, dict):
+        data = data.get(key)
+    if not isinstance(data, list):
+        raise ValueError(f'Expected a JSON array of {key} or an object with a "{key}" array')
+    if len(data) > MAX_BULK_ITEMS:
+        raise ValueError(f'Too many {key} in one request (maximum {MAX_BULK_ITEMS})')
+    return data
+
+if DATA_DIR:
+    init_persistence(DATA_DIR)
+
+if LOAD_SNAPSHOT:
+    if len(G):
+        logger.info("Not loading %s: the recovered graph is not empty", LOAD_SNAPSHOT)
+    else:
+        load_snapshot_file(LOAD_SNAPSHOT)
+
+if SHARED_SNAPSHOT:
+    init_shared_snapshots(SHARED_SNAPSHOT, SHARED_ROLE)
+
+if PROFILING:
+    init_profiling(PROFILE_DIR)
+
+def _served_graph():
+    """The graph this worker answers reads from: the shared snapshot (None
+    until one is published), the mapped snapshot file while G is being built
+    from it, or G"""
+    if shared_reader is not None:
+        return shared_reader.current()
+    return mapped_csr if mapped_csr is not None else G
+
+def _served_edge_count():
+    graph = _served_graph()
+    if graph is None:
+        return 0
+    if graph is G:
+        # Counting walks every adjacency dict, which must not change meanwhile
+        with graph_lock.read():
+            return G.number_of_edges()
+    return graph.edge_count
+
+metrics.gauge('kg_graph_nodes', 'Nodes in the graph', lambda: len(_served_graph() or ()))
+metrics.gauge('kg_graph_edges', 'Edges in the graph', _served_edge_count)
+metrics.gauge('kg_graph_version', 'Graph version, incremented by every change',
+              lambda: getattr(_served_graph(), 'version', 0))
+
+@app.before_request
+def _start_request_timer():
+    request.environ['kg.start_time'] = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    """Count the request and time it up to the response being produced
+    (streamed bodies are still being sent when this runs)"""
+    start = request.environ.get('kg.start_time')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('kg_http_request_duration_seconds', time.perf_counter() - start, route, request.method)
+        metrics.inc('kg_http_requests_total', route, request.method, str(response.status_code))
+        if response.status_code >= 500:
+            metrics.inc('kg_http_request_errors_total', route, request.method)
+    return response
+
+def _profile_authorized():
+    """Whether the request carries the profiling token, if one is configured"""
+    if not PROFILE_TOKEN:
+        return True
+    token = request.headers.get('X-Profile-Token', '')
+    return hmac.compare_digest(token.encode('utf-8'), PROFILE_TOKEN.encode('utf-8'))
+
+@app.before_request
+def _start_request_profile():
+    """Profile requests that ask for it; watch the rest for slowness"""
+    if profile_store is None:
+        return
+    wanted = request.headers.get('X-Profile') or request.args.get('profile')
+    if wanted and wanted != '0' and _profile_authorized():
+        request.environ['kg.profiler'] = profiling.start_profiler()
+    elif slow_sampler is not None:
+        slow_sampler.begin()
+        request.environ['kg.sampled'] = True
+
+@app.after_request
+def _save_request_profile(response):
+    """Store the profile of this request, if one was taken, and name it in X-Profile-Id"""
+    profiler = request.environ.pop('kg.profiler', None)
+    sampled = request.environ.pop('kg.sampled', False)
+    if profiler is None and not sampled:
+        return response
+    start = request.environ.get('kg.start_time')
+    meta = {
+        'method': request.method,
+        'path': request.path,
+        'query': request.query_string.decode('utf-8', 'replace'),
+        'route': request.url_rule.rule if request.url_rule is not None else None,
+        'status': response.status_code,
+        'seconds': round(time.perf_counter() - start, 6) if start is not None else None,
+    }
+    try:
+        if profiler is not None:
+            profile_id = profiling.save_profiler(profile_store, profiler, meta)
+        else:
+            profile_id = slow_sampler.end(meta)
+    except OSError:
+        logger.exception("Error saving request profile")
+        return response
+    if profile_id is not None:
+        response.headers['X-Profile-Id'] = profile_id
+        logger.info("Profiled %s %s in %.3f s as %s", request.method, request.path, meta['seconds'] or 0, profile_id)
+    return response
+
 @app.route('/')
 def index():
-    print("Serving index page")  # Debug print
     return render_template('index.html')
 
 @app.route('/api/add_node', methods=['POST'])
+@writes_graph
 def add_node():
     try:
         data = request.json
-        print(f"Received node data: {data}")  # Debug print
         
         node_id = data.get('id')
         node_type = data.get('type')
         node_name = data.get('name')
         
-        print(f"Parsed: id={node_id}, type={node_type}, name={node_name}")  # Debug print
+        error = _node_fields_error(node_id, node_type, node_name)
+        if error:
+            return jsonify({'error': error}), 400
         
-        if not all([node_id, node_type, node_name]):
-            return jsonify({'error': 'Missing required fields: id, type, name'}), 400
-        
-        if node_type not in NODE_TYPES:
-            return jsonify({'error': f'Invalid node type. Must be one of: {list(NODE_TYPES.keys())}'}), 400
+        # Names are used to address nodes in add_edge and query_impacts, so they must be unique
+        existing_ids = [n for n in G.node_ids_for_name(node_name) if n != node_id]
+        if existing_ids:
+            return jsonify({'error': f'Node name "{node_name}" is already used by node "{existing_ids[0]}"'}), 409
         
         # Add the node to the graph
         G.add_node(node_id, type=node_type, name=node_name)
-        print(f"Added node: {node_id} ({node_type}: {node_name})")  # Debug print
-        print(f"Graph now has {len(G.nodes())} nodes")  # Debug print
+        logger.debug("Added node %s (%s: %s), graph now has %d nodes", node_id, node_type, node_name, len(G))
         
         return jsonify({'message': 'Node added successfully'})
     
     except Exception as e:
-        print(f"Error adding node: {str(e)}")  # Debug print
+        logger.exception("Error adding node")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/add_edge', methods=['POST'])
+@writes_graph
 def add_edge():
     try:
         data = request.json
-        print(f"Received edge data: {data}")  # Debug print
         
         source = data.get('source')
         target = data.get('target')
         relationship = data.get('relationship')
+        weight = data.get('weight')  # Optional, used by /api/impact_scores
         
-        print(f"Parsed: source={source}, target={target}, relationship={relationship}")  # Debug print
-        
-        if not all([source, target, relationship]):
-            return jsonify({'error': 'Missing required fields: source, target, relationship'}), 400
+        error = _edge_fields_error(source, target, relationship, weight)
+        if error:
+            return jsonify({'error': error}), 400
         
-        if relationship not in RELATIONSHIP_TYPES:
-            return jsonify({'error': f'Invalid relationship type. Must be one of: {RELATIONSHIP_TYPES}'}), 400
+        # Resolve node names to IDs through the name index
+        source_id = G.node_id_for_name(source)
+        target_id = G.node_id_for_name(target)
         
-        # Check if both nodes exist
-        source_exists = any(G.nodes[node]['name'] == source for node in G.nodes())
-        target_exists = any(G.nodes[node]['name'] == target for node in G.nodes())
-        
-        if not source_exists:
+        if source_id is None:
             return jsonify({'error': f'Source node "{source}" not found'}), 404
-        if not target_exists:
+        if target_id is None:
             return jsonify({'error': f'Target node "{target}" not found'}), 404
         
-        # Find the actual node IDs
-        source_id = None
-        target_id = None
-        for node_id, node_data in G.nodes(data=True):
-            if node_data['name'] == source:
-                source_id = node_id
-            if node_data['name'] == target:
-                target_id = node_id
-        
         # Add the edge to the graph
-        G.add_edge(source_id, target_id, relationship=relationship)
-        print(f"Added edge: {source_id} -> {target_id} ({relationship})")  # Debug print
-        print(f"Graph now has {len(G.edges())} edges")  # Debug print
+        G.add_edge(source_id, target_id, **ingest.edge_attrs(relationship, weight))
+        logger.debug("Added edge %s -> %s (%s)", source_id, target_id, relationship)
         
         return jsonify({'message': 'Edge added successfully'})
     
     except Exception as e:
-        print(f"Error adding edge: {str(e)}")  # Debug print
+        logger.exception("Error adding edge")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/get_graph', methods=['GET'])
-def get_graph():
-    graph_data = {
-        'nodes': [],
-        'edges': []
-    }
+@app.route('/api/add_nodes_bulk', methods=['POST'])
+@writes_graph
+def add_nodes_bulk():
+    """Add a batch of nodes. Every node is validated first and the batch is
+    applied only if all of them are valid; otherwise per-item errors are returned."""
+    try:
+        nodes = _bulk_items(request.json, 'nodes')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.warning("Error reading bulk nodes: %s", e)
+        return jsonify({'error': str(e)}), 500
     
-    for node in G.nodes(data=True):
-        node_data = {
-            'id': node[0],
-            'name': node[1].get('name', node[0]),  # Use ID as name if not set
-            'type': node[1].get('type', 'unknown')  # Use 'unknown' if type not set
-        }
-        graph_data['nodes'].append(node_data)
+    errors = []
+    valid = []
+    batch_names = {}
+    for index, node in enumerate(nodes):
+        if not isinstance(node, dict):
+            errors.append({'index': index, 'error': 'Node must be an object'})
+            continue
+        node_id = node.get('id')
+        node_type = node.get('type')
+        node_name = node.get('name')
+        error = _node_fields_error(node_id, node_type, node_name)
+        if error is None:
+            existing_ids = [n for n in G.node_ids_for_name(node_name) if n != node_id]
+            if batch_names.get(node_name, node_id) != node_id:
+                existing_ids.append(batch_names[node_name])
+            if existing_ids:
+                error = f'Node name "{node_name}" is already used by node "{existing_ids[0]}"'
+        if error:
+            errors.append({'index': index, 'error': error})
+            continue
+        batch_names[node_name] = node_id
+        valid.append((node_id, {'type': node_type, 'name': node_name}))
     
-    for edge in G.edges(data=True):
-        edge_data = {
-            'source': edge[0],
-            'target': edge[1],
-            'relationship': edge[2].get('relationship', 'unknown')  # Use 'unknown' if relationship not set
-        }
-        graph_data['edges'].append(edge_data)
+    if errors:
+        return jsonify({
+            'error': f'{len(errors)} of {len(nodes)} nodes are invalid; no nodes were added',
+            'errors': errors
+        }), 400
     
-    return jsonify(graph_data)
+    G.add_nodes_from(valid)
+    logger.debug("Bulk added %d nodes, graph now has %d nodes", len(valid), len(G))
+    return jsonify({'message': 'Nodes added successfully', 'added': len(valid)})
+
+@app.route('/api/add_edges_bulk', methods=['POST'])
+@writes_graph
+def add_edges_bulk():
+    """Add a batch of edges. Endpoints are node names like in add_edge, or node
+    IDs when the request object sets "match": "id". The batch is applied only if
+    every edge is valid; otherwise per-item errors are returned."""
+    try:
+        data = request.json
+        edges = _bulk_items(data, 'edges')
+        match = data.get('match', 'name') if isinstance(data, dict) else 'name'
+        if match not in ('name', 'id'):
+            raise ValueError('match must be "name" or "id"')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.warning("Error reading bulk edges: %s", e)
+        return jsonify({'error': str(e)}), 500
+    
+    if match == 'id':
+        def resolve(key):
+            return key if key in G else None
+    else:
+        resolve = G.node_id_for_name
+    
+    errors = []
+    valid = []
+    for index, edge in enumerate(edges):
+        if not isinstance(edge, dict):
+            errors.append({'index': index, 'error': 'Edge must be an object'})
+            continue
+        source = edge.get('source')
+        target = edge.get('target')
+        relationship = edge.get('relationship')
+        weight = edge.get('weight')
+        error = _edge_fields_error(source, target, relationship, weight)
+        if error is None:
+            source_id = resolve(source)
+            target_id = resolve(target)
+            if source_id is None:
+                error = f'Source node "{source}" not found'
+            elif target_id is None:
+                error = f'Target node "{target}" not found'
+        if error:
+            errors.append({'index': index, 'error': error})
+            continue
+        valid.append((source_id, target_id, ingest.edge_attrs(relationship, weight)))
+    
+    if errors:
+        return jsonify({
+            'error': f'{len(errors)} of {len(edges)} edges are invalid; no edges were added',
+            'errors': errors
+        }), 400
+    
+    G.add_edges_from(valid)
+    logger.debug("Bulk added %d edges", len(valid))
+    return jsonify({'message': 'Edges added successfully', 'added': len(valid)})
+
+def _node_json(node_id, attrs):
+    return {
+        'id': node_id,
+        'name': attrs.get('name', node_id),  # Use ID as name if not set
+        'type': attrs.get('type', 'unknown')  # Use 'unknown' if type not set
+    }
+
+def _edge_json(source, target, attrs):
+    edge = {
+        'source': source,
+        'target': target,
+        'relationship': attrs.get('relationship', 'unknown')  # Use 'unknown' if relationship not set
+    }
+    if 'weight' in attrs:
+        edge['weight'] = attrs['weight']
+    return edge
+
+def _graph_delta(since):
+    """Build a delta response from the change log, or None if a full snapshot is needed"""
+    changes = change_log.changes_since(since)
+    if changes is None:
+        return None
+    node_ids, edges = changes
+    delta = {
+        'version': G.version,
+        'since': since,
+        'full': False,
+        'nodes': [],
+        'edges': [],
+        'removed_nodes': [],
+        'removed_edges': []
+    }
+    for node_id in node_ids:
+        if node_id in G:
+            delta['nodes'].append(_node_json(node_id, G.nodes[node_id]))
+        else:
+            delta['removed_nodes'].append(node_id)
+    if delta['nodes']:
+        csr, positions = _graph_layout()
+        if positions is not None:
+            _set_positions(delta['nodes'], positions[[csr.index[node['id']] for node in delta['nodes']]])
+    for source, target in edges:
+        if G.has_edge(source, target):
+            delta['edges'].append(_edge_json(source, target, G.edges[source, target]))
+        else:
+            delta['removed_edges'].append({'source': source, 'target': target})
+    return delta
+
+def _graph_layout():
+    """Return ``(csr, positions)`` for G, positions in CSR (= G) node order,
+    or ``(None, None)`` when G is too large to lay out"""
+    if len(G) > LAYOUT_MAX_NODES:
+        return None, None
+    csr = csr_snapshot.current(force=True)
+    return csr, layout_cache.positions(csr)
+
+def _set_positions(nodes, positions):
+    """Add layout coordinates to node payloads, one row of positions per node;
+    nodes the finished layout does not cover yet (NaN rows) get none"""
+    for node, (x, y) in zip(nodes, np.round(positions, 1).tolist()):
+        if x == x:
+            node['x'] = x
+            node['y'] = y
+
+def _graph_snapshot():
+    nodes = [_node_json(node_id, attrs) for node_id, attrs in G.nodes(data=True)]
+    _, positions = _graph_layout()
+    if positions is not None:
+        _set_positions(nodes, positions)
+    return {
+        'version': G.version,
+        'full': True,
+        'nodes': nodes,
+        'edges': [_edge_json(source, target, attrs) for source, target, attrs in G.edges(data=True)]
+    }
+
+def _csr_nodes_json(csr, nodes):
+    """Node payloads for an array of CSRGraph node indices"""
+    types = [name or 'unknown' for name in csr.type_names]
+    return [{'id': node_id, 'name': name, 'type': types[code]}
+            for node_id, name, code in zip(csr.node_ids_at(nodes), csr._name_array[nodes].tolist(),
+                                           csr.node_types[nodes].tolist())]
+
+def _csr_edges_json(csr, sources, positions):
+    """Edge payloads for CSRGraph edge positions and their source node indices"""
+    relationships = [name or 'unknown' for name in csr.relationship_names]
+    edges = [{'source': source, 'target': target, 'relationship': relationships[code]}
+             for source, target, code in zip(csr.node_ids_at(sources), csr.node_ids_at(csr.indices[positions]),
+                                             csr.relations[positions].tolist())]
+    # Unset weights are stored as 1.0, so only the ones that were set are reported
+    weights = csr.weights[positions]
+    for k in np.flatnonzero(csr.weight_set[positions]).tolist():
+        edges[k]['weight'] = float(weights[k])
+    return edges
+
+def _csr_snapshot_json(csr):
+    """Full snapshot payload built from a CSRGraph (a shared snapshot in reader workers)"""
+    sources = np.repeat(np.arange(len(csr)), np.diff(csr.indptr))
+    nodes = _csr_nodes_json(csr, np.arange(len(csr)))
+    positions = layout_cache.positions(csr)
+    if positions is not None:
+        _set_positions(nodes, positions)
+    return {
+        'version': csr.version,
+        'full': True,
+        'nodes': nodes,
+        'edges': _csr_edges_json(csr, sources, np.arange(csr.edge_count))
+    }
+
+graph_payload = GraphPayloadCache(_graph_snapshot)
+
+@app.route('/api/get_graph', methods=['GET'])
+@reads_graph
+def get_graph():
+    try:
+        since = _optional_int_arg('since')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    accept_gzip = 'gzip' in request.accept_encodings
+    csr, error = _snapshot_csr()
+    if error:
+        return error
+    if csr is not None:
+        # There is no change log for a shared or mapped snapshot, so these
+        # are always answered with a full snapshot
+        body, etag, encoding = graph_payload.get(csr.version, accept_gzip=accept_gzip,
+                                                 build=lambda: _csr_snapshot_json(csr),
+                                                 variant=layout_cache.version)
+    else:
+        # Clients that already hold a version get only what changed since then
+        if since is not None:
+            delta = _graph_delta(since)
+            if delta is not None:
+                return jsonify(delta)
+        
+        # Full snapshots are served from a per-version cache of encoded bytes,
+        # rebuilt when a newer layout has finished
+        body, etag, encoding = graph_payload.get(G.version, accept_gzip=accept_gzip,
+                                                 variant=layout_cache.version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def _find_impacts(source_id, max_depth=None, limit=None, check=None):
+    """Run an impact search on the CSR snapshot, or on G while it is stale"""
+    snapshot = csr_snapshot.current()
+    if snapshot is not None:
+        return snapshot.impacts(source_id, max_depth=max_depth, limit=limit, check=check)
+    return find_impacts(G, source_id, max_depth=max_depth, limit=limit, check=check)
+
+def _impact_source(source_name):
+    """Resolve an impact query's source node.
+
+    Returns ``(csr, source_id, error_response)``; ``csr`` is the snapshot
+    to search instead of G (see _snapshot_csr) or None.
+    """
+    if not source_name:
+        return None, None, (jsonify({'error': 'Source node required'}), 400)
+    csr, error = _snapshot_csr()
+    if error:
+        return None, None, error
+    source_id = (csr if csr is not None else G).node_id_for_name(source_name)
+    if source_id is None:
+        return None, None, (jsonify({'error': f'Source node "{source_name}" not found'}), 404)
+    return csr, source_id, None
+
+def _impact_cache_key(csr, source_id, max_depth, limit):
+    """Return ``(cache_key, version)`` for an impact query"""
+    if csr is not None:
+        # Shared snapshots never change in place, so their version is part of the key
+        return (csr.version, source_id, max_depth, limit), csr.version
+    return (source_id, max_depth, limit), G.version
+
+def _cached_impacts(csr, source_id, max_depth=None, limit=None, check=None):
+    """Impacts of source_id, through the impact cache. The caller holds the graph lock for reading."""
+    cache_key, version = _impact_cache_key(csr, source_id, max_depth, limit)
+    impacts = impact_cache.get(cache_key)
+    if impacts is None:
+        if csr is not None:
+            impacts, reached = csr.impacts(source_id, max_depth=max_depth, limit=limit, check=check)
+        else:
+            impacts, reached = _find_impacts(source_id, max_depth=max_depth, limit=limit, check=check)
+        impact_cache.put(cache_key, version, impacts, reached)
+        metrics.observe('kg_traversal_nodes', len(reached), 'impacts')
+    return impacts
 
 @app.route('/api/query_impacts', methods=['GET'])
+@reads_graph
 def query_impacts():
     source_name = request.args.get('source')
-    if not source_name:
-        return jsonify({'error': 'Source node required'}), 400
-    
-    print(f"Querying impacts for source: {source_name}")  # Debug print
-    print(f"Available nodes: {[G.nodes[node]['name'] for node in G.nodes()]}")  # Debug print
     
     # Find the node ID by name
-    source_id = None
-    for node_id, node_data in G.nodes(data=True):
-        if node_data['name'] == source_name:
-            source_id = node_id
-            break
+    csr, source_id, error = _impact_source(source_name)
+    if error:
+        return error
+    
+    try:
+        max_depth = _optional_int_arg('max_depth')
+        limit = _optional_int_arg('limit')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        impacts = _cached_impacts(csr, source_id, max_depth=max_depth, limit=limit)
+        logger.debug("Found %d impacts of %s", len(impacts), source_id)
+        return jsonify(impacts)
+    
+    except Exception as e:
+        logger.exception("Error finding impacts of %s", source_id)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/query_impacts_batch', methods=['POST'])
+@reads_graph
+def query_impacts_batch():
+    """Impacts of many sources at once. Takes {"sources": [names], "max_depth": n,
+    "limit": n}; sources missing from the impact cache are searched together in
+    one traversal (see CSRGraph.multi_impacts). Results are keyed by source name."""
+    data = request.get_json(silent=True)
+    try:
+        names = _bulk_items(data, 'sources')
+        options = data if isinstance(data, dict) else {}
+        max_depth = _optional_int(options.get('max_depth'), 'max_depth')
+        limit = _optional_int(options.get('limit'), 'limit')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not all(isinstance(name, str) for name in names):
+        return jsonify({'error': 'Source names must be strings'}), 400
+    names = list(dict.fromkeys(names))
+    
+    csr, error = _snapshot_csr()
+    if error:
+        return error
+    index = csr if csr is not None else G
+    
+    results, not_found, misses = {}, [], {}
+    for name in names:
+        source_id = index.node_id_for_name(name)
+        if source_id is None:
+            not_found.append(name)
+            continue
+        results[name] = impact_cache.get(_impact_cache_key(csr, source_id, max_depth, limit)[0])
+        if results[name] is None:
+            misses[name] = source_id
+    
+    try:
+        if misses:
+            snapshot = csr if csr is not None else csr_snapshot.current()
+            if snapshot is not None:
+                computed = snapshot.multi_impacts(list(misses.values()), max_depth=max_depth, limit=limit)
+            else:
+                computed = {source_id: find_impacts(G, source_id, max_depth=max_depth, limit=limit)
+                            for source_id in misses.values()}
+            for name, source_id in misses.items():
+                impacts, reached = computed[source_id]
+                cache_key, version = _impact_cache_key(csr, source_id, max_depth, limit)
+                impact_cache.put(cache_key, version, impacts, reached)
+                metrics.observe('kg_traversal_nodes', len(reached), 'impacts')
+                results[name] = impacts
+    except Exception as e:
+        logger.exception("Error finding batch impacts")
+        return jsonify({'error': str(e)}), 500
+    
+    logger.debug("Batch impacts for %d sources, %d computed", len(results), len(misses))
+    return jsonify({
+        'version': csr.version if csr is not None else G.version,
+        'results': results,
+        'not_found': not_found
+    })
+
+def _read_csr():
+    """A CSRGraph of the current graph to run array traversals on: the shared
+    snapshot in reader workers, otherwise the CSR snapshot of G (rebuilt and
+    kept if stale). Returns ``(csr, error_response)``."""
+    if shared_reader is not None:
+        return _shared_csr()
+    return csr_snapshot.current(force=True), None
+
+def _score_options():
+    """Read and validate the k / max_depth / damping query parameters"""
+    k = _optional_int_arg('k')
+    k = SCORE_DEFAULT_K if k is None else k
+    if not 1 <= k <= SCORE_MAX_K:
+        raise ValueError(f'k must be between 1 and {SCORE_MAX_K}')
+    max_depth = _optional_int_arg('max_depth')
+    max_depth = SCORE_DEFAULT_DEPTH if max_depth is None else max_depth
+    if not 1 <= max_depth <= SCORE_MAX_DEPTH:
+        raise ValueError(f'max_depth must be between 1 and {SCORE_MAX_DEPTH}')
+    try:
+        damping = float(request.args.get('damping', 1.0))
+    except ValueError:
+        raise ValueError('damping must be a number')
+    if not 0 < damping <= 1:
+        raise ValueError('damping must be greater than 0 and at most 1')
+    return k, max_depth, damping
+
+@app.route('/api/impact_scores', methods=['GET'])
+@reads_graph
+def query_impact_scores():
+    """Top-k consequences per source, ranked by weighted impact score (see
+    scoring.py). Takes one or more ?source= names, or scores every activity
+    when none is given, plus optional k, max_depth and damping."""
+    try:
+        k, max_depth, damping = _score_options()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    csr, error = _read_csr()
+    if error:
+        return error
     
+    names = request.args.getlist('source')
+    not_found = []
+    if names:
+        names = list(dict.fromkeys(names))
+        sources = {}
+        for name in names:
+            source_id = csr.node_id_for_name(name)
+            if source_id is None:
+                not_found.append(name)
+            else:
+                sources[name] = source_id
+    else:
+        activities = np.flatnonzero(csr.node_types == csr.type_codes.get('activity', -1))
+        sources = dict(zip(csr._name_array[activities].tolist(), csr.node_ids_at(activities)))
+    
+    try:
+        scores = impact_scores(csr, list(sources.values()), max_depth=max_depth, damping=damping, k=k)
+    except Exception as e:
+        logger.exception("Error scoring impacts")
+        return jsonify({'error': str(e)}), 500
+    
+    logger.debug("Scored impacts for %d sources", len(sources))
+    return jsonify({
+        'version': csr.version,
+        'results': {name: scores[source_id] for name, source_id in sources.items()},
+        'not_found': not_found
+    })
+
+def _list_arg(name, choices):
+    """Read a comma-separated query parameter restricted to choices, or None if it is absent"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    items = [item.strip() for item in value.split(',') if item.strip()]
+    invalid = [item for item in items if item not in choices]
+    if invalid:
+        raise ValueError(f'Invalid {name}: {invalid[0]}. Must be one of: {list(choices)}')
+    return items
+
+def _bounded_int_arg(name, default, maximum):
+    """Read an integer query parameter between 1 and maximum"""
+    value = _optional_int_arg(name)
+    value = default if value is None else value
+    if not 1 <= value <= maximum:
+        raise ValueError(f'{name} must be between 1 and {maximum}')
+    return value
+
+def _path_options():
+    """Read and validate the k / max_depth / max_paths / time_budget query parameters"""
+    k = _bounded_int_arg('k', PATHS_DEFAULT_K, PATHS_MAX_K)
+    max_depth = _bounded_int_arg('max_depth', PATHS_DEFAULT_DEPTH, PATHS_MAX_DEPTH)
+    max_paths = _bounded_int_arg('max_paths', PATHS_DEFAULT_MAX, PATHS_MAX_PATHS)
+    try:
+        time_budget = float(request.args.get('time_budget', PATHS_DEFAULT_BUDGET))
+    except ValueError:
+        raise ValueError('time_budget must be a number')
+    if not 0 < time_budget <= PATHS_MAX_BUDGET:
+        raise ValueError(f'time_budget must be greater than 0 and at most {PATHS_MAX_BUDGET}')
+    return k, max_depth, max_paths, time_budget
+
+@app.route('/api/impact_paths', methods=['GET'])
+@reads_graph
+def query_impact_paths():
+    """The k shortest paths from ?source= to each consequence, or to the
+    ?target= nodes (repeatable), ranked by hops then by the product of edge
+    weights (see path_search.py). max_depth, max_paths and time_budget
+    (seconds) bound the search; when one is hit, the paths found so far
+    are returned and truncated names the limit."""
+    try:
+        k, max_depth, max_paths, time_budget = _path_options()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    source_name = request.args.get('source')
+    if not source_name:
+        return jsonify({'error': 'Source node required'}), 400
+    
+    csr, error = _read_csr()
+    if error:
+        return error
+    source_id = csr.node_id_for_name(source_name)
     if source_id is None:
         return jsonify({'error': f'Source node "{source_name}" not found'}), 404
+    target_ids, not_found = None, []
+    if request.args.getlist('target'):
+        target_ids = []
+        for name in dict.fromkeys(request.args.getlist('target')):
+            target_id = csr.node_id_for_name(name)
+            if target_id is None:
+                not_found.append(name)
+            else:
+                target_ids.append(target_id)
     
-    print(f"Found source node ID: {source_id}")  # Debug print
+    start = time.perf_counter()
+    try:
+        found, truncated = k_shortest_paths(csr, source_id, k=k, max_depth=max_depth, max_paths=max_paths,
+                                            time_budget=time_budget, target_ids=target_ids)
+    except Exception as e:
+        logger.exception("Error enumerating paths from %s", source_id)
+        return jsonify({'error': str(e)}), 500
+    seconds = time.perf_counter() - start
     
-    impacts = []
+    names = csr._name_array
+    results = []
+    # Targets with the shortest, then strongest, best path first
+    for target, paths in sorted(found.items(), key=lambda item: (len(item[1][0][0]), -item[1][0][2], item[0])):
+        results.append({
+            'consequence': names[target],
+            'paths': [{
+                'path': names[list(nodes)].tolist(),
+                'relationships': [csr.relationship_names[code] for code in csr.relations[list(positions)].tolist()],
+                'hops': len(positions),
+                'weight': weight
+            } for nodes, positions, weight in paths]
+        })
+    metrics.observe('kg_traversal_nodes', len(results), 'impact_paths')
+    logger.debug("Paths from %s: %d targets, truncated=%s, %.3f s", source_id, len(results), truncated, seconds)
+    return jsonify({
+        'version': csr.version,
+        'source': source_name,
+        'results': results,
+        'paths': sum(len(paths) for paths in found.values()),
+        'truncated': truncated or False,
+        'seconds': round(seconds, 6),
+        'not_found': not_found
+    })
+
+@app.route('/api/pattern_query', methods=['GET'])
+@reads_graph
+def query_pattern():
+    """Matches of a typed ?pattern= such as
+    'activity -causes-> factor -affects-> consequence where activity = X'
+    (grammar in pattern_query.py), up to ?limit= of them."""
     try:
-        for target in nx.descendants(G, source_id):
-            if G.nodes[target]['type'] == 'consequence':
-                path = nx.shortest_path(G, source_id, target)
-                impacts.append({
-                    'consequence': G.nodes[target]['name'],
-                    'path': [G.nodes[node]['name'] for node in path]
-                })
-        
-        print(f"Found {len(impacts)} impact paths")  # Debug print
-        return jsonify(impacts)
+        limit = _bounded_int_arg('limit', PATTERN_DEFAULT_LIMIT, PATTERN_MAX_LIMIT)
+        pattern = parse_pattern(request.args.get('pattern'), NODE_TYPES, RELATIONSHIP_TYPES)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    csr, error = _read_csr()
+    if error:
+        return error
+    try:
+        nodes, positions, truncated, plan = match_pattern(csr, pattern, limit=limit)
+    except Exception as e:
+        logger.exception("Error matching pattern %r", request.args.get('pattern'))
+        return jsonify({'error': str(e)}), 500
+    
+    metrics.observe('kg_traversal_nodes', len(nodes), 'pattern')
+    relationship_names = np.array(csr.relationship_names, dtype=object)
+    return jsonify({
+        'version': csr.version,
+        'steps': pattern.labels,
+        'edges': [[pattern.labels[source], pattern.labels[target]] for source, target, _ in pattern.edges],
+        'matches': [{'nodes': names, 'relationships': relationships}
+                    for names, relationships in zip(csr._name_array[nodes].tolist(),
+                                                    relationship_names[csr.relations[positions]].tolist())],
+        'truncated': truncated or False,
+        'plan': plan
+    })
+
+def _subgraph_options():
+    """Read and validate the hops / max_nodes / direction / filter query parameters"""
+    hops = _optional_int_arg('hops')
+    hops = 1 if hops is None else hops
+    if hops > SUBGRAPH_MAX_HOPS:
+        raise ValueError(f'hops must be at most {SUBGRAPH_MAX_HOPS}')
+    max_nodes = _optional_int_arg('max_nodes')
+    max_nodes = SUBGRAPH_DEFAULT_NODES if max_nodes is None else max_nodes
+    if not 1 <= max_nodes <= SUBGRAPH_MAX_NODES:
+        raise ValueError(f'max_nodes must be between 1 and {SUBGRAPH_MAX_NODES}')
+    direction = request.args.get('direction', 'both')
+    if direction not in ('out', 'in', 'both'):
+        raise ValueError('direction must be "out", "in" or "both"')
+    return {
+        'hops': hops,
+        'max_nodes': max_nodes,
+        'direction': direction,
+        'node_types': _list_arg('types', list(NODE_TYPES.keys())),
+        'relationships': _list_arg('relationships', RELATIONSHIP_TYPES)
+    }
+
+@app.route('/api/subgraph', methods=['GET'])
+@reads_graph
+def get_subgraph():
+    """The k-hop neighborhood of the nodes given as ?node=<name> and/or
+    ?id=<id> (each may repeat), for drawing large graphs a piece at a time.
+    Optional: hops (default 1), direction (out, in or both), types and
+    relationships (comma-separated filters) and max_nodes, past which the
+    lowest-degree nodes of the last level are dropped. Without any node the
+    highest-degree nodes of the whole graph are returned. Each node reports
+    its degree and how many of its edges were left out as "hidden"."""
+    try:
+        options = _subgraph_options()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    csr, error = _read_csr()
+    if error:
+        return error
     
-    except nx.NetworkXNoPath:
-        print("No path found to consequences")  # Debug print
-        return jsonify([])
+    names = request.args.getlist('node')
+    ids = request.args.getlist('id')
+    seeds, not_found = None, []
+    if names or ids:
+        seeds = []
+        for name in names:
+            source_id = csr.node_id_for_name(name)
+            if source_id is None:
+                not_found.append(name)
+            else:
+                seeds.append(csr.index[source_id])
+        for node_id in ids:
+            if node_id in csr.index:
+                seeds.append(csr.index[node_id])
+            else:
+                not_found.append(node_id)
+    
+    try:
+        nodes, positions, truncated = csr.neighborhood(seeds, **options)
+        metrics.observe('kg_traversal_nodes', len(nodes), 'subgraph')
+        sources = csr.edge_sources(positions)
+        shown = np.bincount(np.concatenate([sources, csr.indices[positions]]), minlength=len(csr))
+        degrees = csr.degrees()[nodes]
+        hidden = degrees - shown[nodes]
+        node_list = _csr_nodes_json(csr, nodes)
+        for node, degree, count in zip(node_list, degrees.tolist(), hidden.tolist()):
+            node['degree'] = degree
+            node['hidden'] = count
+        coordinates = layout_cache.positions(csr)
+        if coordinates is not None:
+            _set_positions(node_list, coordinates[nodes])
     except Exception as e:
-        print(f"Error finding impacts: {str(e)}")  # Debug print
+        logger.exception("Error extracting subgraph")
         return jsonify({'error': str(e)}), 500
+    
+    logger.debug("Subgraph: %d nodes, %d edges, truncated=%s", len(nodes), len(positions), truncated)
+    return jsonify({
+        'version': csr.version,
+        'nodes': node_list,
+        'edges': _csr_edges_json(csr, sources, positions),
+        'truncated': truncated,
+        'not_found': not_found
+    })
 
 @app.route('/api/upload_data', methods=['POST'])
 def upload_data():
+    if shared_reader is not None:
+        return jsonify({'error': READ_ONLY_WORKER_ERROR}), 403
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
@@ -182,95 +1220,134 @@ def upload_data():
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
+    payload, status = _ingest_upload(file)
+    return jsonify(payload), status
+
+def _ingest_upload(file):
+    """Replace G with the contents of an uploaded file; returns (payload, status).
+
+    The file is loaded into a separate graph without holding the graph
+    lock, and G is replaced with it (an O(1) swap under the write lock) only
+    once all of it has loaded, so a bad row anywhere leaves G unchanged and
+    reads carry on meanwhile.
+    """
+    staged = KnowledgeGraph()
+    payload, status = _load_upload(staged, file)
+    if status == 200:
+        _apply_write(_replace_graph, staged)
+    return payload, status
+
+def _replace_graph(staged):
+    G.replace_with(staged)
+    logger.info("Graph updated: %d nodes, %d edges", len(G), G.number_of_edges())
+
+def _load_upload(graph, file):
+    """Load an uploaded file into graph, an empty KnowledgeGraph; returns (payload, status)"""
     try:
-        print(f"Processing file: {file.filename}")  # Debug print
+        logger.info("Processing upload %s", file.filename)
         
         if file.filename.endswith('.csv'):
-            df = pd.read_csv(file)
-            print(f"CSV loaded: {len(df)} rows")  # Debug print
+            # Stream the CSV in chunks
+            try:
+                rows = ingest.load_csv(graph, file, NODE_TYPES, RELATIONSHIP_TYPES, chunk_rows=UPLOAD_CHUNK_ROWS)
+            except ValueError as e:
+                logger.warning("CSV validation error: %s", e)
+                return {'error': str(e)}, 400
+            logger.info("CSV loaded: %d rows", rows)
+        elif file.filename.endswith('.kgs'):
+            # Binary snapshot, as produced by /api/export_snapshot or binary_snapshot.py
+            try:
+                snapshot = BinarySnapshot(file.read(), verify=True)
+            except ValueError as e:
+                return {'error': f'Invalid snapshot: {str(e)}'}, 400
+            snapshot.load_into(graph)
+            return {'message': 'Data uploaded successfully', 'nodes': snapshot.node_count, 'edges': snapshot.edge_count}, 200
+        elif file.filename.endswith(('.ndjson', '.jsonl')):
+            # Newline-delimited node/edge records, streamed line by line
+            upload_progress.clear()
+            upload_progress.update({'status': 'running', 'filename': file.filename,
+                                    'lines': 0, 'bytes': 0, 'nodes': 0, 'edges': 0})
+            try:
+                counts = ingest.load_ndjson(graph, file.stream, NODE_TYPES, RELATIONSHIP_TYPES,
+                                            batch_size=UPLOAD_NDJSON_BATCH, progress=upload_progress.update)
+            except ValueError as e:
+                upload_progress.update({'status': 'failed', 'error': str(e)})
+                logger.warning("NDJSON error: %s", e)
+                return {'error': str(e)}, 400
+            upload_progress.update(counts, status='done')
+            return {'message': 'Data uploaded successfully', 'nodes': counts['nodes'], 'edges': counts['edges']}, 200
         elif file.filename.endswith('.json'):
             try:
                 # Read the file content as string first
                 content = file.read().decode('utf-8')
-                print("Received content:", content[:200] + "..." if len(content) > 200 else content)  # Debug print
                 
                 # Parse the JSON content
                 data = json.loads(content)
-                print("Parsed data type:", type(data))  # Debug print
                 
                 if isinstance(data, dict) and 'nodes' in data and 'edges' in data:
-                    # Direct graph format
-                    print("Direct graph format detected")  # Debug print
-                    # Clear existing graph
-                    G.clear()
-                    
-                    # Add nodes
-                    for node in data['nodes']:
-                        G.add_node(node['id'], type=node['type'], name=node['name'])
-                    
-                    # Add edges
-                    for edge in data['edges']:
-                        G.add_edge(edge['source'], edge['target'], relationship=edge['relationship'])
-                    
-                    print(f"Graph updated: {len(G.nodes())} nodes, {len(G.edges())} edges")  # Debug print
-                    return jsonify({'message': 'Data uploaded successfully'})
+                    # Direct graph format, checked in full before anything is added
+                    try:
+                        nodes, edges = ingest.load_graph_json(graph, data, NODE_TYPES, RELATIONSHIP_TYPES)
+                    except ValueError as e:
+                        logger.warning("JSON graph validation error: %s", e)
+                        return {'error': str(e)}, 400
+                    logger.info("JSON graph loaded: %d nodes, %d edges", nodes, edges)
                 elif isinstance(data, list):
                     # List of objects format
-                    df = pd.DataFrame(data)
-                    print(f"JSON list loaded: {len(df)} rows")  # Debug print
+                    try:
+                        rows = ingest.load_records(graph, data, NODE_TYPES, RELATIONSHIP_TYPES, chunk_rows=UPLOAD_CHUNK_ROWS)
+                    except ValueError as e:
+                        logger.warning("JSON list validation error: %s", e)
+                        return {'error': str(e)}, 400
+                    logger.info("JSON list loaded: %d rows", rows)
                 else:
-                    return jsonify({'error': 'Invalid JSON format. Expected graph with nodes/edges or list of objects'}), 400
+                    return {'error': 'Invalid JSON format. Expected graph with nodes/edges or list of objects'}, 400
                     
             except json.JSONDecodeError as e:
-                print("JSON decode error:", str(e))  # Debug print
-                return jsonify({'error': f'Invalid JSON format: {str(e)}'}), 400
+                logger.warning("JSON decode error: %s", e)
+                return {'error': f'Invalid JSON format: {str(e)}'}, 400
         else:
-            return jsonify({'error': 'Unsupported file format. Please use .csv or .json'}), 400
-        
-        # Process DataFrame format (for CSV or JSON list)
-        if 'df' in locals():
-            # Clear existing graph
-            G.clear()
-            
-            # Process the data and add to graph
-            for _, row in df.iterrows():
-                try:
-                    # Add source node
-                    source_id = f"{row['source_type']}_{row['source'].replace(' ', '_')}"
-                    G.add_node(source_id, type=row['source_type'], name=row['source'])
-                    
-                    # Add target node
-                    target_id = f"{row['target_type']}_{row['target'].replace(' ', '_')}"
-                    G.add_node(target_id, type=row['target_type'], name=row['target'])
-                    
-                    # Add edge
-                    G.add_edge(source_id, target_id, relationship=row['relation'])
-                except KeyError as e:
-                    print("Key error:", str(e))  # Debug print
-                    return jsonify({'error': f'Missing required field: {str(e)}. Expected columns: source, source_type, target, target_type, relation'}), 400
-                except Exception as e:
-                    print("Row processing error:", str(e))  # Debug print
-                    return jsonify({'error': f'Error processing row: {str(e)}'}), 400
-            
-            print(f"Graph updated: {len(G.nodes())} nodes, {len(G.edges())} edges")  # Debug print
+            return {'error': 'Unsupported file format. Please use .csv, .json, .ndjson or .kgs'}, 400
         
-        return jsonify({'message': 'Data uploaded successfully'})
+        return {'message': 'Data uploaded successfully'}, 200
     
     except Exception as e:
-        print("General error:", str(e))  # Debug print
-        return jsonify({'error': str(e)}), 400
+        logger.exception("Error processing upload %s", file.filename)
+        return {'error': str(e)}, 400
+
+@app.route('/api/upload_progress', methods=['GET'])
+def get_upload_progress():
+    return jsonify(upload_progress)
+
+@app.route('/api/export_snapshot', methods=['GET'])
+@reads_graph
+def export_snapshot():
+    """Download the graph in the binary snapshot format (see binary_snapshot.py);
+    graphs the format cannot hold exactly are refused with 409"""
+    snapshot, error = _snapshot_csr()
+    if error:
+        return error
+    try:
+        if snapshot is None:
+            snapshot = csr_snapshot.current(force=True)
+            error = snapshot_error(G)
+        data = encode_csr(snapshot) if error is None else None
+    except ValueError as e:
+        error = str(e)
+    if error:
+        return jsonify({'error': f'The graph cannot be exported as a snapshot: {error}'}), 409
+    response = Response(data, mimetype='application/octet-stream')
+    response.headers['Content-Disposition'] = f'attachment; filename=graph-{snapshot.version}.kgs'
+    return response
 
 @app.route('/api/load_sample_data', methods=['POST'])
+@writes_graph
 def load_sample_data():
     try:
-        print("Loading sample data...")  # Debug print
-        
         # Read sample data from file
         with open('sample_data.json', 'r') as f:
             sample_data = json.load(f)
         
-        print(f"Sample data loaded: {len(sample_data['nodes'])} nodes, {len(sample_data['edges'])} edges")  # Debug print
-        
         # Clear existing graph
         G.clear()
         
@@ -280,25 +1357,226 @@ def load_sample_data():
         
         # Add edges
         for edge in sample_data['edges']:
-            G.add_edge(edge['source'], edge['target'], relationship=edge['relationship'])
+            G.add_edge(edge['source'], edge['target'], **ingest.edge_attrs(edge['relationship'], edge.get('weight')))
         
-        print(f"Graph updated: {len(G.nodes())} nodes, {len(G.edges())} edges")  # Debug print
+        logger.info("Graph updated: %d nodes, %d edges", len(G), G.number_of_edges())
         
         return jsonify({'message': 'Sample data loaded successfully'})
     
     except FileNotFoundError:
-        print("sample_data.json file not found")  # Debug print
+        logger.warning("sample_data.json file not found")
         return jsonify({'error': 'Sample data file not found'}), 404
     except json.JSONDecodeError as e:
-        print(f"JSON decode error: {str(e)}")  # Debug print
+        logger.warning("Invalid JSON in sample data: %s", e)
         return jsonify({'error': f'Invalid JSON in sample data: {str(e)}'}), 400
     except Exception as e:
-        print(f"Error loading sample data: {str(e)}")  # Debug print
+        logger.exception("Error loading sample data")
         return jsonify({'error': str(e)}), 400
 
 @app.route('/api/test', methods=['GET'])
+@reads_graph
 def test():
-    return jsonify({'message': 'API is working', 'nodes': len(G.nodes()), 'edges': len(G.edges())})
+    graph = _served_graph() or G
+    edges = graph.number_of_edges() if graph is G else graph.edge_count
+    return jsonify({'message': 'API is working', 'nodes': len(graph), 'edges': edges})
+
+@app.route('/api/cache_stats', methods=['GET'])
+@reads_graph
+def cache_stats():
+    shared = shared_publisher or shared_reader
+    return jsonify({
+        'graph_version': G.version,
+        'impact_cache': impact_cache.stats(),
+        'csr_snapshot': csr_snapshot.stats(),
+        'journal': journal.stats() if journal is not None else None,
+        'shared_snapshot': shared.stats() if shared is not None else None,
+        'jobs': job_manager.stats(),
+        'layout': layout_cache.stats()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request counts, latency histograms, traversal sizes and graph size in
+    the Prometheus text format"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+def _profiles_error():
+    """Error response if profiles cannot be read by this request, else None"""
+    if profile_store is None:
+        return jsonify({'error': 'Profiling is not enabled (set KG_PROFILING=1)'}), 400
+    if not _profile_authorized():
+        return jsonify({'error': 'A valid profiling token is required'}), 403
+    return None
+
+@app.route('/api/profiles', methods=['GET'])
+def list_profiles():
+    """Stored request profiles, newest first"""
+    error = _profiles_error()
+    if error:
+        return error
+    return jsonify({'profiles': profile_store.list()})
+
+@app.route('/api/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Download a profile: a pstats dump, or folded stacks for sampled
+    requests. ?format=text summarises a pstats dump as text instead"""
+    error = _profiles_error()
+    if error:
+        return error
+    meta = profile_store.get(profile_id)
+    if meta is None:
+        return jsonify({'error': f'Profile "{profile_id}" not found'}), 404
+    path = profile_store.data_path(meta)
+    if not os.path.exists(path):  # rotated out since the metadata was read
+        return jsonify({'error': f'Profile "{profile_id}" not found'}), 404
+    if request.args.get('format') == 'text' and meta['kind'] == profiling.CPROFILE:
+        return Response(profiling.stats_text(path), mimetype='text/plain')
+    mimetype = 'text/plain' if meta['kind'] == profiling.SAMPLED else 'application/octet-stream'
+    return send_file(path, mimetype=mimetype, as_attachment=True, download_name=os.path.basename(path))
+
+@app.route('/api/snapshot', methods=['POST'])
+def snapshot():
+    """Write a compacted snapshot of the graph and truncate the write-ahead log
+    (the journal takes the graph lock itself, for reading, while copying)"""
+    if journal is None:
+        return jsonify({'error': 'Persistence is not enabled (set KG_DATA_DIR)'}), 400
+    journal.snapshot()
+    return jsonify({'message': 'Snapshot written', 'version': journal.snapshot_version})
+
+def _submit_impacts_job(data):
+    """Queue a query_impacts analysis; returns (job, deduplicated) or an error response"""
+    with graph_lock.read():
+        csr, source_id, error = _impact_source(data.get('source'))
+        version = csr.version if csr is not None else G.version
+    if error:
+        return None, error
+    try:
+        max_depth = _optional_int(data.get('max_depth'), 'max_depth')
+        limit = _optional_int(data.get('limit'), 'limit')
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    
+    def run(job):
+        with graph_lock.read():
+            if csr is None and source_id not in G:
+                raise ValueError(f'Source node "{data["source"]}" was removed')
+            return _cached_impacts(csr, source_id, max_depth=max_depth, limit=limit, check=job.check)
+    
+    # Identical queries against the same graph version share one job and its result
+    key = ('query_impacts', version, source_id, max_depth, limit)
+    params = {'source': data['source'], 'max_depth': max_depth, 'limit': limit, 'graph_version': version}
+    return job_manager.submit('query_impacts', key, params, run), None
+
+def _submit_upload_job(file):
+    """Queue an upload; the file is spooled to disk so the request can return at once"""
+    if shared_reader is not None:
+        return None, (jsonify({'error': READ_ONLY_WORKER_ERROR}), 403)
+    if file.filename == '':
+        return None, (jsonify({'error': 'No file selected'}), 400)
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.stream.read(1024 * 1024), b''):
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    upload = FileStorage(stream=spool, filename=file.filename)
+    
+    def run(job):
+        try:
+            payload, status = _ingest_upload(upload)
+        finally:
+            spool.close()
+        if status >= 400:
+            raise ValueError(payload['error'])
+        return payload
+    
+    # Uploads change the graph, so only in-flight duplicates are merged, never cached
+    key = ('upload', file.filename, digest.hexdigest())
+    try:
+        job, deduplicated = job_manager.submit('upload', key, {'filename': file.filename}, run, cache=False)
+    except JobQueueFull:
+        spool.close()
+        raise
+    if deduplicated:
+        spool.close()
+    return (job, deduplicated), None
+
+def _job_wait_arg():
+    """Seconds a poll may block for the job to finish (?wait=), capped at JOB_MAX_WAIT"""
+    try:
+        wait = float(request.args.get('wait') or 0)
+    except ValueError:
+        raise ValueError('wait must be a number of seconds')
+    return min(max(wait, 0.0), JOB_MAX_WAIT)
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Run an analysis or upload in the background. Send a multipart form with
+    a file to upload it, or JSON like {"type": "query_impacts", "source": ...}."""
+    try:
+        if 'file' in request.files:
+            submitted, error = _submit_upload_job(request.files['file'])
+        else:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                return jsonify({'error': 'Expected a JSON object or a file upload'}), 400
+            if data.get('type', 'query_impacts') != 'query_impacts':
+                return jsonify({'error': f'Unknown job type. Must be one of: {JOB_TYPES}'}), 400
+            submitted, error = _submit_impacts_job(data)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 429
+    if error:
+        return error
+    job, deduplicated = submitted
+    logger.info("Job %s (%s) %s", job.id, job.kind, 'deduplicated' if deduplicated else 'submitted')
+    response = jsonify(dict(job.to_json(), deduplicated=deduplicated))
+    response.status_code = 202
+    response.headers['Location'] = f'/api/jobs/{job.id}'
+    return response
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    return jsonify({'jobs': [job.to_json() for job in job_manager.list()]})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Job status; ?wait=<seconds> blocks until the job finishes or the time is up"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job "{job_id}" not found'}), 404
+    try:
+        job.wait(_job_wait_arg())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(job.to_json())
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Result of a finished job, as JSON or streamed as NDJSON (?format=ndjson)"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Job "{job_id}" not found'}), 404
+    try:
+        job.wait(_job_wait_arg())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if job.status not in FINISHED:
+        return jsonify(job.to_json()), 202
+    if job.status != DONE:
+        return jsonify(dict(job.to_json(), error=job.error or f'Job was {job.status}')), 409
+    
+    if request.args.get('format') == 'ndjson':
+        items = job.result if isinstance(job.result, list) else [job.result]
+        return Response((dump_json(item) + b'\n' for item in items), mimetype='application/x-ndjson')
+    return jsonify(job.result)
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a job: queued jobs never start, running analyses stop at their next BFS level"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({'error': f'Job "{job_id}" not found'}), 404
+    return jsonify(job.to_json())
 
 if __name__ == '__main__':
     app.run(debug=True)
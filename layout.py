@@ -0,0 +1,247 @@
+"""Force-directed node positions computed on the server, once per graph version.
+
+The layout is Fruchterman-Reingold on the CSR arrays: every iteration
+moves all nodes at once by the sum of edge attraction (d^2 / k), node
+repulsion (c * k^2 / d) and a weak pull towards the origin, capped by a
+cooling temperature. The repulsion factor c is below FR's 1.0 because
+with every pair of nodes repelling, c = 1 stretches edges well past k. Up to
+EXACT_REPULSION_MAX nodes, repulsion is summed over every pair of nodes;
+above that each node is repelled by the centres of mass of the cells of
+a coarse grid instead, which costs O(V * cells) rather than O(V^2).
+
+When the graph changes, nodes that already had a position keep it, new
+nodes start at the average position of their placed neighbours, and only
+a short, cooler refinement pass is run.
+
+Layouts run on a background thread, never on the thread asking for
+positions: positions() answers from the newest finished layout at once
+and queues the snapshot it was given, and the worker always lays out the
+newest queued snapshot only.
+"""
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EXACT_REPULSION_MAX = 2000
+GRID_CELLS = 20           # grid is at most GRID_CELLS x GRID_CELLS
+CHUNK_ELEMENTS = 1 << 22  # bounds the (nodes x others) temporaries
+
+
+class LayoutCache:
+    """Node positions for the newest CSRGraph passed to positions().
+
+    ``edge_length`` is the ideal distance between linked nodes, in the
+    units of the returned coordinates. Graphs of more than ``max_nodes``
+    nodes are not laid out. All methods are thread-safe.
+    """
+
+    def __init__(self, edge_length=100.0, iterations=100, refine_iterations=20,
+                 max_nodes=2000, repulsion=0.1, gravity=0.5, seed=0):
+        self.edge_length = edge_length
+        self.repulsion = repulsion
+        self.iterations = iterations
+        self.refine_iterations = refine_iterations
+        self.max_nodes = max_nodes
+        self.gravity = gravity
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._version = None
+        self._index = {}
+        self._positions = np.zeros((0, 2))
+        self._pending = None   # newest snapshot waiting to be laid out
+        self._running = None   # version being laid out
+        self._thread = None
+        self.full_layouts = 0
+        self.refinements = 0
+        self.last_seconds = 0.0
+
+    @property
+    def version(self):
+        """Graph version of the newest finished layout"""
+        return self._version
+
+    def positions(self, csr):
+        """Return an ``(V, 2)`` array of coordinates in csr node order from the
+        newest finished layout, centred on the origin, with NaN rows for nodes
+        it does not cover yet; or None if the graph has more than
+        ``max_nodes`` nodes or nothing has been laid out. Unless it is already
+        laid out, ``csr`` is queued for the background worker."""
+        if len(csr) > self.max_nodes:
+            return None
+        with self._lock:
+            if csr.version is not None and csr.version == self._version:
+                return self._positions
+            if csr.version != self._running and (self._pending is None or self._pending.version != csr.version):
+                self._pending = csr
+                self._start_worker()
+                self._changed.notify_all()
+            if self._version is None:
+                return None
+            return self._carry_over(csr)
+
+    def wait(self, timeout=None):
+        """Block until no layout is queued or running; returns False on timeout"""
+        with self._lock:
+            return self._changed.wait_for(lambda: self._pending is None and self._running is None, timeout)
+
+    def _carry_over(self, csr):
+        """The finished layout's positions of csr's nodes, NaN for new nodes"""
+        previous = np.fromiter((self._index.get(n, -1) for n in csr.node_ids),
+                               dtype=np.int64, count=len(csr))
+        known = previous >= 0
+        positions = np.full((len(csr), 2), np.nan)
+        positions[known] = self._positions[previous[known]]
+        return positions
+
+    def _start_worker(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name='layout', daemon=True)
+            self._thread.start()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._changed.wait_for(lambda: self._pending is not None)
+                csr, self._pending = self._pending, None
+                self._running = csr.version
+                positions = self._carry_over(csr) if self._version is not None else np.full((len(csr), 2), np.nan)
+            start = time.perf_counter()
+            try:
+                positions, refined = self._layout(csr, positions)
+            except Exception:
+                logger.exception("Layout of version %s failed", csr.version)
+                with self._lock:
+                    self._running = None
+                    self._changed.notify_all()
+                continue
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self._version = csr.version
+                self._index = csr.index
+                self._positions = positions
+                self.last_seconds = seconds
+                if refined:
+                    self.refinements += 1
+                else:
+                    self.full_layouts += 1
+                self._running = None
+                self._changed.notify_all()
+
+    def _layout(self, csr, positions):
+        """Refine ``positions`` (NaN rows for new nodes) when at least half the
+        nodes are placed, else lay out from scratch. Returns ``(positions, refined)``."""
+        known = ~np.isnan(positions[:, 0])
+        if known.sum() * 2 >= len(csr):
+            positions = self._place_new(csr, positions, known)
+            return self._run(csr, positions, self.refine_iterations, self.edge_length), True
+        temperature = max(self.edge_length, self.edge_length * math.sqrt(len(csr)) / 10)
+        return self._run(csr, None, self.iterations, temperature), False
+
+    def _place_new(self, csr, positions, known):
+        """Start each new node at the mean position of its placed neighbours,
+        or at random inside the placed nodes' bounding box if it has none."""
+        new = ~known
+        if not new.any():
+            return positions
+        sources = np.repeat(np.arange(len(csr)), np.diff(csr.indptr))
+        targets = csr.indices
+        ends = np.concatenate([sources, targets])
+        others = np.concatenate([targets, sources])
+        usable = known[others]
+        ends, others = ends[usable], others[usable]
+        counts = np.bincount(ends, minlength=len(csr))
+        sums = np.stack([np.bincount(ends, weights=positions[others, axis], minlength=len(csr))
+                         for axis in (0, 1)], axis=1)
+
+        placed = positions[known]
+        low, high = placed.min(axis=0), placed.max(axis=0)
+        anchored = new & (counts > 0)
+        positions[anchored] = sums[anchored] / counts[anchored, None]
+        loose = new & (counts == 0)
+        positions[loose] = self._rng.uniform(low, high, size=(int(loose.sum()), 2))
+        # Jitter so new nodes sharing neighbours do not start on the same spot
+        positions[new] += self._rng.normal(scale=self.edge_length / 4, size=(int(new.sum()), 2))
+        return positions
+
+    def _run(self, csr, positions, iterations, temperature):
+        n = len(csr)
+        k = self.edge_length
+        if positions is None:
+            radius = k * math.sqrt(max(n, 1)) / 2
+            positions = self._rng.uniform(-radius, radius, size=(n, 2))
+        if n < 2:
+            return positions - positions.mean(axis=0) if n else positions
+
+        sources = np.repeat(np.arange(n), np.diff(csr.indptr))
+        targets = np.asarray(csr.indices, dtype=np.int64)
+        loops = sources == targets
+        sources, targets = sources[~loops], targets[~loops]
+
+        for step in range(iterations):
+            displacement = self._repulsion(positions) - self.gravity * positions
+            # Attraction along edges: d^2 / k, pulling the two ends together
+            delta = positions[targets] - positions[sources]
+            pull = delta * (np.sqrt((delta ** 2).sum(axis=1)) / k)[:, None]
+            for axis in (0, 1):
+                displacement[:, axis] += np.bincount(sources, weights=pull[:, axis], minlength=n)
+                displacement[:, axis] -= np.bincount(targets, weights=pull[:, axis], minlength=n)
+
+            # Move each node along its displacement, by at most the temperature
+            length = np.sqrt((displacement ** 2).sum(axis=1))
+            limit = temperature * (1 - step / iterations)
+            scale = np.minimum(length, limit) / np.maximum(length, 1e-9)
+            positions = positions + displacement * scale[:, None]
+        return positions - positions.mean(axis=0)
+
+    def _repulsion(self, positions):
+        """c * k^2 / d repulsion on every node, from every node or from grid cell masses."""
+        n = len(positions)
+        k2 = self.repulsion * self.edge_length ** 2
+        if n <= EXACT_REPULSION_MAX:
+            others, masses, softening = positions, None, 1e-2
+        else:
+            others, masses, softening = self._grid_masses(positions)
+        # |a - b|^2 and the weighted sums of (a - b) expanded into matrix products
+        squares = (others ** 2).sum(axis=1)
+        force = np.empty_like(positions)
+        rows = max(1, CHUNK_ELEMENTS // len(others))
+        for start in range(0, n, rows):
+            chunk = positions[start:start + rows]
+            distances = (chunk ** 2).sum(axis=1)[:, None] + squares[None, :] - 2 * (chunk @ others.T)
+            weight = k2 / (np.maximum(distances, 0) + softening)
+            if masses is not None:
+                weight *= masses
+            force[start:start + rows] = chunk * weight.sum(axis=1)[:, None] - weight @ others
+        return force
+
+    def _grid_masses(self, positions):
+        """Centres of mass and node counts of the non-empty cells of a grid over the nodes."""
+        cells = min(GRID_CELLS, max(2, int(math.sqrt(len(positions) / 4))))
+        low = positions.min(axis=0)
+        size = np.maximum(positions.max(axis=0) - low, 1e-9) / cells
+        cell = np.minimum(((positions - low) / size).astype(np.int64), cells - 1)
+        cell = cell[:, 0] * cells + cell[:, 1]
+        masses = np.bincount(cell, minlength=cells * cells).astype(float)
+        occupied = masses > 0
+        centres = np.stack([np.bincount(cell, weights=positions[:, axis], minlength=cells * cells)
+                            for axis in (0, 1)], axis=1)[occupied] / masses[occupied, None]
+        # Softening by half a cell keeps a node's own cell from pushing it arbitrarily hard
+        return centres, masses[occupied], float((size ** 2).sum()) / 4
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self._version,
+                'pending': self._pending is not None or self._running is not None,
+                'nodes': len(self._positions),
+                'full_layouts': self.full_layouts,
+                'refinements': self.refinements,
+                'last_seconds': round(self.last_seconds, 4),
+                'max_nodes': self.max_nodes
+            }
@@ -1,28 +1,65 @@
+import argparse
 import json
 import requests
 
-def load_sample_data():
+DEFAULT_URL = 'http://localhost:5000'
+DEFAULT_BATCH_SIZE = 1000
+
+def _batches(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield start, items[start:start + batch_size]
+
+def _json_body(response):
+    """The decoded JSON body of a response, or None if it has none (e.g. a proxy's error page)"""
+    if response.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+def _post_batches(session, url, key, items, batch_size, extra=None):
+    """POST items in batches, returning the number added and printing per-item errors"""
+    added = 0
+    for start, batch in _batches(items, batch_size):
+        payload = {key: batch}
+        if extra:
+            payload.update(extra)
+        response = session.post(url, json=payload)
+        body = _json_body(response)
+        if body is None:
+            print(f"Error adding {key} {start}-{start + len(batch) - 1}: "
+                  f"HTTP {response.status_code}: {response.text[:200]}")
+            continue
+        if response.ok:
+            added += body.get('added', len(batch))
+            continue
+        print(f"Error adding {key} {start}-{start + len(batch) - 1}: {body.get('error')}")
+        for item_error in body.get('errors', []):
+            print(f"  {key[:-1]} {start + item_error['index']}: {item_error['error']}")
+    return added
+
+def load_sample_data(path='sample_data.json', base_url=DEFAULT_URL, batch_size=DEFAULT_BATCH_SIZE):
     # Read the sample data
-    with open('sample_data.json', 'r') as f:
+    with open(path, 'r') as f:
         data = json.load(f)
     
-    # Add nodes
-    for node in data['nodes']:
-        response = requests.post(
-            'http://localhost:5000/api/add_node',
-            json=node
-        )
-        if response.status_code != 200:
-            print(f"Error adding node {node['name']}: {response.json().get('error')}")
+    # A Session keeps the connection alive across batches
+    with requests.Session() as session:
+        # Add nodes
+        nodes_added = _post_batches(session, f'{base_url}/api/add_nodes_bulk',
+                                    'nodes', data['nodes'], batch_size)
+        
+        # Add edges (the data file refers to nodes by ID)
+        edges_added = _post_batches(session, f'{base_url}/api/add_edges_bulk',
+                                    'edges', data['edges'], batch_size, extra={'match': 'id'})
     
-    # Add edges
-    for edge in data['edges']:
-        response = requests.post(
-            'http://localhost:5000/api/add_edge',
-            json=edge
-        )
-        if response.status_code != 200:
-            print(f"Error adding edge {edge['source']} -> {edge['target']}: {response.json().get('error')}")
+    print(f"Loaded {nodes_added} nodes and {edges_added} edges")
 
 if __name__ == '__main__':
-    load_sample_data() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Load a nodes/edges JSON file into a running server')
+    parser.add_argument('path', nargs='?', default='sample_data.json', help='data file to load')
+    parser.add_argument('--url', default=DEFAULT_URL, help='server base URL')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='items per request')
+    args = parser.parse_args()
+    load_sample_data(args.path, args.url, args.batch_size)
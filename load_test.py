@@ -0,0 +1,262 @@
+"""Open-loop load generator for a running server.
+
+Requests are sent at a fixed target rate regardless of how fast the
+server answers, the way independent clients behave: dashboards polling
+/api/get_graph, analysts calling /api/query_impacts and ingestion jobs
+posting to /api/add_edge and /api/upload_data, mixed by weight. Latency
+is measured from the moment a request was due, not from when a worker
+got to send it, so a server that falls behind shows up in the tail
+percentiles instead of silently lowering the offered load.
+
+The server is either started locally for the run (--start-server) or
+given by --url. It is first loaded with a seeded synthetic graph (see
+synthetic_graph.py), which the upload_data requests then upload again.
+
+    python load_test.py --start-server --nodes 10000 --rate 200 --duration 30 \\
+        --mix get_graph=50,query_impacts=30,add_edge=15,upload_data=5
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+import synthetic_graph
+
+DEFAULT_URL = 'http://127.0.0.1:5000'
+DEFAULT_MIX = 'get_graph=50,query_impacts=30,add_edge=15,upload_data=5'
+DEFAULT_RATE = 50.0       # requests per second
+DEFAULT_DURATION = 30.0   # seconds
+DEFAULT_WORKERS = 32      # requests in flight at most
+DEFAULT_NODES = 10000
+SERVER_START_TIMEOUT = 30.0
+REQUEST_TIMEOUT = 60.0
+
+PERCENTILES = (50, 95, 99)
+
+# Routes a mix can name; each is a LoadTest method sending one request
+ROUTES = ('get_graph', 'query_impacts', 'add_edge', 'upload_data')
+
+
+class LoadTest:
+    """Shared state of one run: the graph's names, the results and the HTTP sessions."""
+
+    def __init__(self, base_url, data, upload_body, seed=0):
+        self.base_url = base_url
+        self.upload_body = upload_body
+        self.activities = [node['name'] for node in data['nodes'] if node['type'] == 'activity']
+        self.factors = [node['name'] for node in data['nodes'] if node['type'] == 'factor']
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.etag = None  # newest get_graph ETag, sent back like a polling browser would
+        self.local = threading.local()
+        self.results = []  # (route, due time, latency, status or None, error text)
+        self.results_lock = threading.Lock()
+
+    def session(self):
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def choice(self, items):
+        with self.random_lock:
+            return self.random.choice(items)
+
+    # One method per route in the mix; each returns the response
+
+    def get_graph(self):
+        headers = {'Accept-Encoding': 'gzip'}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        response = self.session().get(f'{self.base_url}/api/get_graph', headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.headers.get('ETag'):
+            self.etag = response.headers['ETag']
+        return response
+
+    def query_impacts(self):
+        return self.session().get(f'{self.base_url}/api/query_impacts',
+                                  params={'source': self.choice(self.activities)}, timeout=REQUEST_TIMEOUT)
+
+    def add_edge(self):
+        return self.session().post(f'{self.base_url}/api/add_edge', timeout=REQUEST_TIMEOUT, json={
+            'source': self.choice(self.activities), 'target': self.choice(self.factors), 'relationship': 'causes'})
+
+    def upload_data(self):
+        return self.session().post(f'{self.base_url}/api/upload_data', timeout=REQUEST_TIMEOUT,
+                                   files={'file': ('graph.ndjson', self.upload_body)})
+
+    def call(self, route, due):
+        status, error = None, None
+        try:
+            response = getattr(self, route)()
+            status = response.status_code
+            if status >= 400:
+                error = response.text[:200]
+        except requests.RequestException as e:
+            error = str(e)
+        latency = time.perf_counter() - due
+        with self.results_lock:
+            self.results.append((route, due, latency, status, error))
+
+
+def parse_mix(text):
+    """'get_graph=50,add_edge=10' -> {'get_graph': 50.0, 'add_edge': 10.0}"""
+    mix = {}
+    for part in text.split(','):
+        route, _, weight = part.partition('=')
+        route = route.strip()
+        if route not in ROUTES:
+            raise ValueError(f'Unknown route "{route}" in the mix; expected one of {", ".join(ROUTES)}')
+        try:
+            mix[route] = float(weight)
+        except ValueError:
+            raise ValueError(f'Weight of "{route}" must be a number')
+        if mix[route] < 0:
+            raise ValueError(f'Weight of "{route}" must be non-negative')
+    if not sum(mix.values()):
+        raise ValueError('The mix needs at least one route with a positive weight')
+    return mix
+
+
+def run_load(test, mix, rate, duration, workers=DEFAULT_WORKERS, seed=0, poisson=True):
+    """Offer ``rate`` requests per second for ``duration`` seconds.
+
+    Arrivals are a Poisson process (exponential gaps) unless ``poisson``
+    is false, in which case they are evenly spaced. Returns the wall time
+    from the first arrival until the last response.
+    """
+    rng = random.Random(seed)
+    routes = list(mix)
+    weights = [mix[route] for route in routes]
+    start = time.perf_counter()
+    due = start
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while due - start < duration:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(test.call, rng.choices(routes, weights)[0], due)
+            due += rng.expovariate(rate) if poisson else 1.0 / rate
+    return time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    """Per-route and overall counts, error rates, throughput and latency percentiles (ms)"""
+    by_route = {}
+    for route, _, latency, status, error in results:
+        by_route.setdefault(route, []).append((latency, error))
+    by_route['all'] = [(latency, error) for _, _, latency, _, error in results]
+    summary = {}
+    for route, samples in by_route.items():
+        latencies = np.array([latency for latency, _ in samples]) * 1000
+        errors = sum(1 for _, error in samples if error is not None)
+        row = {
+            'requests': len(samples),
+            'errors': errors,
+            'error_rate': errors / len(samples) if samples else 0.0,
+            'throughput': len(samples) / elapsed if elapsed > 0 else 0.0,
+        }
+        for percentile in PERCENTILES:
+            row[f'p{percentile}_ms'] = float(np.percentile(latencies, percentile)) if len(samples) else None
+        row['max_ms'] = float(latencies.max()) if len(samples) else None
+        summary[route] = row
+    return summary
+
+
+def _milliseconds(value):
+    """A latency column; '-' for routes without samples"""
+    return f'{value:>9.1f}' if value is not None else f"{'-':>9}"
+
+
+def print_summary(summary):
+    print(f"{'route':<16} {'requests':>9} {'req/s':>8} {'errors':>8} "
+          + ' '.join(f"{f'p{p} ms':>9}" for p in PERCENTILES) + f" {'max ms':>9}")
+    for route, row in summary.items():
+        percentiles = ' '.join(_milliseconds(row[f'p{p}_ms']) for p in PERCENTILES)
+        print(f"{route:<16} {row['requests']:>9} {row['throughput']:>8.1f} {row['error_rate']:>8.1%} "
+              f"{percentiles} {_milliseconds(row['max_ms'])}")
+
+
+def start_server(port, log_path=None):
+    """Start the app in a child process with Flask's threaded server and wait
+    until it answers. Its output, including the access log, goes to
+    ``log_path`` or is discarded."""
+    env = dict(os.environ, KG_LOG_LEVEL=os.environ.get('KG_LOG_LEVEL', 'WARNING'))
+    with open(log_path or os.devnull, 'ab') as log:
+        process = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'knowledge_graph_app', 'run',
+                                    '--port', str(port), '--with-threads', '--no-reload'],
+                                   cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with status {process.returncode}')
+        try:
+            requests.get(f'{url}/api/test', timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'Server did not answer within {SERVER_START_TIMEOUT} seconds')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offer a mixed read/write load to the server and report latencies')
+    parser.add_argument('--url', default=DEFAULT_URL, help='server base URL')
+    parser.add_argument('--start-server', action='store_true', help='start the app locally for the run')
+    parser.add_argument('--port', type=int, default=5001, help='port for --start-server')
+    parser.add_argument('--server-log', help='file for the output of the --start-server server')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'route=weight list (routes: {", ".join(ROUTES)})')
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help='requests per second to offer')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION, help='seconds to send requests for')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='most requests in flight at once')
+    parser.add_argument('--uniform', action='store_true', help='evenly spaced instead of Poisson arrivals')
+    parser.add_argument('--nodes', type=int, default=DEFAULT_NODES, help='size of the synthetic graph')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the graph and the request sequence')
+    parser.add_argument('--output', help='also write the summary as JSON to this file')
+    args = parser.parse_args(argv)
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    process = None
+    url = args.url
+    if args.start_server:
+        process, url = start_server(args.port, args.server_log)
+    try:
+        data = synthetic_graph.generate_graph(args.nodes, seed=args.seed)
+        upload_body = b''.join(synthetic_graph.ndjson_lines(data))
+        response = requests.post(f'{url}/api/upload_data', files={'file': ('graph.ndjson', upload_body)},
+                                 timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        print(f"Loaded {len(data['nodes'])} nodes, {len(data['edges'])} edges; offering {args.rate:g} req/s "
+              f"for {args.duration:g} s", flush=True)
+
+        test = LoadTest(url, data, upload_body, seed=args.seed)
+        elapsed = run_load(test, mix, args.rate, args.duration, workers=args.workers, seed=args.seed,
+                           poisson=not args.uniform)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    summary = summarize(test.results, elapsed)
+    print_summary(summary)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'url': url, 'mix': mix, 'rate': args.rate, 'duration': args.duration,
+                       'nodes': args.nodes, 'seed': args.seed, 'elapsed': elapsed, 'routes': summary}, f, indent=2)
+    return 1 if summary['all']['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
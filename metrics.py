@@ -0,0 +1,131 @@
+"""Request metrics kept in memory and rendered in the Prometheus text format.
+
+Counters and histograms are keyed by a tuple of label values and updated
+under one lock; each update is a couple of dict operations plus a bisect
+into the histogram buckets, cheap enough to run on every request. Gauges
+are callables read when the metrics are scraped, so values such as the
+graph size are never stale and cost nothing between scrapes.
+"""
+import bisect
+import math
+import threading
+
+# Request latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Traversal size buckets, in nodes
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, as Prometheus expects it."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self, name, label_names):
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                cumulative += count
+                yield f'{name}_bucket', label_names + ('le',), labels + (_format_value(bound),), cumulative
+            yield f'{name}_sum', label_names, labels, series[-1]
+            yield f'{name}_count', label_names, labels, cumulative
+
+
+class MetricsRegistry:
+    """Counters, histograms and gauges, each with a fixed list of label names.
+
+    Metrics are declared once with counter() / histogram() / gauge() and
+    then updated by name; render() returns the text exposition format.
+    All methods are thread-safe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}  # name -> (kind, help, label names, store)
+
+    def counter(self, name, help_text, labels=()):
+        self._declare(name, 'counter', help_text, labels, {})
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self._declare(name, 'histogram', help_text, labels, Histogram(buckets))
+
+    def gauge(self, name, help_text, read):
+        """Declare a gauge whose value is ``read()`` at scrape time."""
+        self._declare(name, 'gauge', help_text, (), read)
+
+    def _declare(self, name, kind, help_text, labels, store):
+        with self._lock:
+            if name in self._metrics:
+                raise ValueError(f'Metric "{name}" is already declared')
+            self._metrics[name] = (kind, help_text, tuple(labels), store)
+
+    def inc(self, name, *labels, amount=1):
+        with self._lock:
+            counts = self._metrics[name][3]
+            counts[labels] = counts.get(labels, 0) + amount
+
+    def observe(self, name, value, *labels):
+        with self._lock:
+            self._metrics[name][3].observe(labels, value)
+
+    def value(self, name, *labels):
+        """Current value of a counter, or the observation count of a histogram"""
+        with self._lock:
+            kind, _, _, store = self._metrics[name]
+            if kind == 'counter':
+                return store.get(labels, 0)
+            if kind == 'histogram':
+                series = store.series.get(labels)
+                return sum(series[:-1]) if series else 0
+            raise ValueError(f'Metric "{name}" is a gauge')
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+            lines = []
+            for name, (kind, help_text, label_names, store) in metrics:
+                if kind == 'gauge':
+                    continue
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                if kind == 'counter':
+                    samples = ((name, label_names, labels, count) for labels, count in sorted(store.items()))
+                else:
+                    samples = store.samples(name, label_names)
+                lines.extend(_sample_line(*sample) for sample in samples)
+        # Gauges are read outside the lock, so reading one may take other locks
+        for name, (kind, help_text, _, read) in metrics:
+            if kind == 'gauge':
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(_sample_line(name, (), (), read()))
+        return '\n'.join(lines) + '\n'
+
+
+def _sample_line(name, label_names, labels, value):
+    if label_names:
+        pairs = ','.join(f'{key}="{_escape(label)}"' for key, label in zip(label_names, labels))
+        name = f'{name}{{{pairs}}}'
+    return f'{name} {_format_value(value)}'
+
+
+def _escape(label):
+    return str(label).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
@@ -0,0 +1,114 @@
+"""Bounded enumeration of the k shortest causal paths from one source.
+
+Paths are ranked by hop count, ties by the product of their edge weights
+(strongest first), and grown breadth-first one hop per level, so every
+level yields paths no shorter than the ones before it. Three things keep
+the search from exploding:
+
+* Reverse reachability: a BFS backwards from the target nodes gives each
+  node its distance to the nearest target, and a partial path is only
+  extended to a node that can still reach a target within the remaining
+  depth, so no branch that cannot end in a target is ever explored.
+* At most ``k`` partial paths are extended through any node, the best
+  ones of the level they arrive in. On an acyclic graph this is exact:
+  a path that used a node's (k+1)-th best prefix would be beaten by the k
+  paths built on the better prefixes. On graphs with cycles a prefix
+  can be dropped in favour of one that later cannot continue without
+  revisiting a node, so fewer than k paths may be found to some targets.
+* Hard caps on depth, on the number of paths returned and on wall time;
+  when a cap is hit the paths found so far are returned, with the reason
+  in ``truncated``.
+"""
+import time
+
+import numpy as np
+
+from csr_graph import _row_positions
+
+MAX_PATHS = 'max_paths'
+TIME_BUDGET = 'time_budget'
+
+CHECK_EVERY = 1024  # expansions between time budget / cancellation checks
+
+
+def k_shortest_paths(csr, source_id, k=3, max_depth=6, max_paths=1000, time_budget=None,
+                     target_ids=None, target_type='consequence', check=None):
+    """Return ``(results, truncated)`` for the paths from ``source_id``.
+
+    Targets are ``target_ids``, or every node of ``target_type`` if None.
+    ``results`` maps each reached target's node index to its paths, best
+    first, as ``(nodes, edge_positions, weight)`` tuples of node indices,
+    forward-array edge positions and the product of the edge weights.
+    ``truncated`` is None, or MAX_PATHS / TIME_BUDGET when the search
+    stopped at ``max_paths`` paths or after ``time_budget`` seconds (None
+    for no limit). ``check``, if given, is called now and then and may
+    raise to abort.
+    """
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    source = csr.index[source_id]
+    if target_ids is None:
+        targets = np.flatnonzero(csr.node_types == csr.type_codes.get(target_type, -1))
+    else:
+        targets = np.array([csr.index[t] for t in target_ids], dtype=np.int64)
+    target_set = set(targets.tolist())
+    # Plain lists: the loops below index them one element at a time
+    distance = _distance_to_targets(csr, targets, max_depth).tolist()
+
+    results = {}
+    found = 0
+    visits = {}  # node index -> partial paths extended through it
+    indptr, indices, weights = csr.indptr, csr.indices, csr.weights
+    level = [((source,), (), 1.0)] if distance[source] <= max_depth else []
+    expansions = 0
+    for depth in range(1, max_depth + 1):
+        if not level:
+            break
+        remaining = max_depth - depth
+        candidates = []
+        for nodes, positions, weight in level:
+            start, end = int(indptr[nodes[-1]]), int(indptr[nodes[-1] + 1])
+            for offset, (target, edge_weight) in enumerate(zip(indices[start:end].tolist(),
+                                                               weights[start:end].tolist())):
+                if distance[target] > remaining or target in nodes:
+                    continue
+                candidates.append((target, nodes + (target,), positions + (start + offset,),
+                                   weight * edge_weight))
+            expansions += end - start
+            if expansions >= CHECK_EVERY:
+                expansions = 0
+                if check is not None:
+                    check()
+                if deadline is not None and time.monotonic() > deadline:
+                    return results, TIME_BUDGET
+
+        # The strongest prefixes of this length get each node's k slots
+        candidates.sort(key=lambda candidate: -candidate[3])
+        level = []
+        for target, nodes, positions, weight in candidates:
+            if visits.get(target, 0) >= k:
+                continue
+            visits[target] = visits.get(target, 0) + 1
+            if target in target_set:
+                results.setdefault(target, []).append((nodes, positions, weight))
+                found += 1
+                if found >= max_paths:
+                    return results, MAX_PATHS
+            level.append((nodes, positions, weight))
+    return results, None
+
+
+def _distance_to_targets(csr, targets, max_depth):
+    """Hops from every node to the nearest target, or max_depth + 1 if it is further"""
+    unreachable = max_depth + 1
+    distance = np.full(len(csr), unreachable, dtype=np.int64)
+    distance[targets] = 0
+    rev_indptr, rev_indices, _ = csr.predecessors_csr()
+    frontier = np.unique(targets)
+    for depth in range(1, max_depth + 1):
+        if not len(frontier):
+            break
+        _, positions = _row_positions(rev_indptr, frontier)
+        sources = rev_indices[positions]
+        frontier = np.unique(sources[distance[sources] == unreachable]).astype(np.int64)
+        distance[frontier] = depth
+    return distance
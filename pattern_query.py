@@ -0,0 +1,372 @@
+"""Typed pattern queries over the CSR snapshot.
+
+A pattern is one or more chains of typed steps joined by relationships,
+with optional name conditions::
+
+    activity -causes-> factor -affects-> consequence
+    a:activity -causes-> factor, a -occurs_in-> location where location = Amazon Rainforest
+    consequence <-*- factor where factor = "Water Pollution"
+
+A step is a node type, ``*`` for any type, or ``alias:type``. Chains
+that name the same alias share that step, so a pattern can branch. The
+``where`` terms compare a step's node name to a value; a step is
+referred to by its alias, or by its type if no other step has that type.
+Arrows are ``-relationship->`` or ``<-relationship-``, with ``*`` for
+any relationship. A match binds every step to a node (two steps may bind
+the same node) such that every edge of the pattern is in the graph.
+
+Matching runs on CSRGraph.relation_partitions(), which keeps the edges
+of each (relationship, source type, target type) together and sorted by
+node. The planner starts from the step or edge with the fewest
+candidates: a step with a name condition, or the smallest partition an
+edge of the pattern draws from. It then adds one edge at a time, the one
+expected to grow the partial matches least, so every step looks up only
+the partitions it needs for the nodes already bound.
+"""
+import re
+
+import numpy as np
+
+MAX_ROWS = 1000000  # partial matches held at once
+
+# Kinds of plan start, in tie-break order
+STEP = 0
+EDGE = 1
+
+_TOKEN = re.compile(r'\s*(?:(?P<edge><-(?P<back>\w+|\*)-|-(?P<forward>\w+|\*)->)'
+                    r'|(?P<step>(?:(?P<alias>\w+)\s*:\s*)?(?P<type>\w+|\*))|(?P<comma>,))')
+_WHERE = re.compile(r'\s+where\s+', re.IGNORECASE)
+_CONDITION = re.compile(r'\s*(?P<ref>\w+)\s*=\s*(?:"(?P<double>(?:[^"\\]|\\.)*)"|\'(?P<single>[^\']*)\''
+                        r'|(?P<bare>.+?))\s*(?:\s+and\s+|$)', re.IGNORECASE)
+
+
+class Pattern:
+    """A parsed pattern: ``steps`` as (label, type or None) pairs, ``edges``
+    as (source step, target step, relationship or None) and ``names``
+    mapping step numbers to the node name they must have."""
+
+    def __init__(self, steps, edges, names):
+        self.steps = steps
+        self.edges = edges
+        self.names = names
+
+    @property
+    def labels(self):
+        return [label for label, _ in self.steps]
+
+
+def parse_pattern(text, node_types, relationship_types):
+    """Parse ``text`` into a Pattern; raises ValueError describing the problem"""
+    if not text or not text.strip():
+        raise ValueError('Pattern required')
+    parts = _WHERE.split(text, maxsplit=1)
+    body, where = parts[0], parts[1] if len(parts) > 1 else None
+
+    steps, edges = [], []
+    aliases = {}
+    previous, arrow = None, None
+    position = 0
+    while position < len(body.rstrip()):
+        match = _TOKEN.match(body, position)
+        if match is None or match.end() == position:
+            raise ValueError(f'Cannot parse the pattern at "{body[position:].strip()}"')
+        position = match.end()
+        if match.group('comma'):
+            if arrow is not None or previous is None:
+                raise ValueError('Each chain must start and end with a step')
+            previous = None
+            continue
+        if match.group('edge'):
+            if previous is None or arrow is not None:
+                raise ValueError('A relationship must stand between two steps')
+            relationship = match.group('forward') or match.group('back')
+            if relationship != '*' and relationship not in relationship_types:
+                raise ValueError(f'Unknown relationship "{relationship}". Must be one of: {relationship_types}')
+            arrow = (relationship if relationship != '*' else None, match.group('back') is not None)
+            continue
+        if previous is not None and arrow is None:
+            raise ValueError('Steps must be joined by a relationship such as -causes->')
+        step = _step(match.group('alias'), match.group('type'), steps, aliases, node_types)
+        if arrow is not None:
+            relationship, back = arrow
+            edges.append((step, previous, relationship) if back else (previous, step, relationship))
+        previous, arrow = step, None
+    if previous is None or arrow is not None:
+        raise ValueError('Each chain must start and end with a step')
+    if not _connected(len(steps), edges):
+        raise ValueError('The chains of a pattern must share a step')
+    names = _conditions(where, steps, aliases) if where is not None else {}
+    return Pattern(steps, edges, names)
+
+
+def _step(alias, node_type, steps, aliases, node_types):
+    """Step number of a pattern term, adding a step unless it names an alias"""
+    if alias is None and node_type in aliases:
+        return aliases[node_type]
+    if node_type != '*' and node_type not in node_types:
+        raise ValueError(f'Unknown node type "{node_type}". Must be one of: {list(node_types)}')
+    node_type = node_type if node_type != '*' else None
+    if alias is None:
+        steps.append((node_type or '*', node_type))
+        return len(steps) - 1
+    if alias in node_types:
+        raise ValueError(f'Alias "{alias}" is a node type')
+    if alias in aliases:
+        step = aliases[alias]
+        if steps[step][1] != node_type:
+            raise ValueError(f'Alias "{alias}" is used with two types')
+        return step
+    steps.append((alias, node_type))
+    aliases[alias] = len(steps) - 1
+    return aliases[alias]
+
+
+def _connected(count, edges):
+    reached = {0}
+    added = True
+    while added:
+        added = False
+        for source, target, _ in edges:
+            if (source in reached) != (target in reached):
+                reached.update((source, target))
+                added = True
+    return len(reached) == count
+
+
+def _conditions(where, steps, aliases):
+    """Map step numbers to names from 'ref = value and ...'"""
+    names = {}
+    position = 0
+    while position < len(where):
+        match = _CONDITION.match(where, position)
+        if match is None or match.end() == position:
+            raise ValueError(f'Cannot parse the condition "{where[position:].strip()}"; expected step = name')
+        position = match.end()
+        ref = match.group('ref')
+        if ref in aliases:
+            step = aliases[ref]
+        else:
+            typed = [i for i, (label, _) in enumerate(steps) if label == ref]
+            if len(typed) != 1:
+                raise ValueError(f'"{ref}" does not name one step of the pattern; give the step an alias')
+            step = typed[0]
+        value = match.group('bare')
+        if value is None:
+            value = match.group('single') if match.group('double') is None else \
+                re.sub(r'\\(.)', r'\1', match.group('double'))
+        if step in names and names[step] != value:
+            raise ValueError(f'"{ref}" cannot have two names')
+        names[step] = value
+    return names
+
+
+def match_pattern(csr, pattern, limit=None, max_rows=MAX_ROWS, check=None):
+    """Find the matches of ``pattern`` in ``csr``.
+
+    Returns ``(nodes, positions, truncated, plan)``: an array with one row
+    per match and one column of node indices per step, sorted by step
+    order; an array of the matched edges' forward-array positions, one
+    column per pattern edge; None, 'limit' or 'max_rows' for whether
+    matches were dropped (past ``limit``, or because a step would have
+    held more than ``max_rows`` partial matches, in which case the
+    matches returned are a subset of the full answer); and the order the
+    steps were joined in, for display. ``check``, if given, is called
+    before each step and may raise to abort.
+    """
+    steps, edges = pattern.steps, pattern.edges
+    type_counts = np.bincount(csr.node_types, minlength=len(csr.type_names))
+    type_sizes = [len(csr) if step_type is None else _type_count(csr, type_counts, step_type)
+                  for _, step_type in steps]
+    candidates = [_candidates(csr, step_type, pattern.names.get(i)) for i, (_, step_type) in enumerate(steps)]
+    sizes = [type_sizes[i] if mask is None else int(mask.sum()) for i, mask in enumerate(candidates)]
+    forward_slices = csr.relation_partitions()[3]
+    edge_sizes = [sum(end - start for start, end in _slices(csr, forward_slices, edge, steps)) for edge in edges]
+
+    # Start from the smallest named step or edge partition, named steps first on ties
+    starts = [(sizes[i], STEP, i) for i in pattern.names] + [(size, EDGE, e) for e, size in enumerate(edge_sizes)]
+    if not edges:
+        starts.append((sizes[0], STEP, 0))
+    _, kind, first = min(starts)
+    bound, done = set(), set()
+    plan = []
+    if check is not None:
+        check()
+    truncated = None
+    if kind == STEP:
+        rows = np.flatnonzero(candidates[first]) if candidates[first] is not None else _typed_nodes(csr, steps[first][1])
+        if len(rows) > max_rows:
+            rows, truncated = rows[:max_rows], 'max_rows'
+        nodes = np.full((len(rows), len(steps)), -1, dtype=np.int64)
+        nodes[:, first] = rows
+        positions = np.full((len(rows), len(edges)), -1, dtype=np.int64)
+        bound.add(first)
+        plan.append(_describe(pattern, first))
+    else:
+        source, target, _ = edges[first]
+        found_sources, found_targets, found_positions, more = _scan(csr, edges[first], steps, candidates, max_rows)
+        if more:
+            truncated = 'max_rows'
+        nodes = np.full((len(found_sources), len(steps)), -1, dtype=np.int64)
+        nodes[:, source] = found_sources
+        nodes[:, target] = found_targets
+        positions = np.full((len(nodes), len(edges)), -1, dtype=np.int64)
+        positions[:, first] = found_positions
+        bound.update((source, target))
+        done.add(first)
+        plan.append(_describe(pattern, first, edge=True))
+
+    while len(done) < len(edges):
+        if check is not None:
+            check()
+        # Edges closing a cycle only filter; otherwise take the edge with
+        # the fewest expected matches per bound node: its partitions' mean
+        # fan-out, scaled by the share of the far step's type it may bind
+        best = None
+        for e, (source, target, _) in enumerate(edges):
+            if e in done or (source not in bound and target not in bound):
+                continue
+            if source in bound and target in bound:
+                growth = 0.0
+            else:
+                near, far = (source, target) if source in bound else (target, source)
+                growth = edge_sizes[e] / max(type_sizes[near], 1) * sizes[far] / max(type_sizes[far], 1)
+            if best is None or growth < best[0]:
+                best = (growth, e)
+        e = best[1]
+        nodes, positions, more = _extend(csr, pattern, candidates, nodes, positions, e, bound, max_rows)
+        if more:
+            truncated = 'max_rows'
+        bound.update(edges[e][:2])
+        done.add(e)
+        plan.append(_describe(pattern, e, edge=True))
+
+    order = np.lexsort(nodes.T[::-1]) if len(nodes) else np.empty(0, dtype=np.int64)
+    nodes, positions = nodes[order], positions[order]
+    if limit is not None and len(nodes) > limit:
+        nodes, positions, truncated = nodes[:limit], positions[:limit], truncated or 'limit'
+    return nodes, positions, truncated, plan
+
+
+def _candidates(csr, step_type, name):
+    """Boolean mask of the nodes a named step may bind, or None if unrestricted"""
+    if name is None:
+        return None
+    mask = csr._name_array == name
+    if step_type is not None:
+        mask &= csr.node_types == csr.type_codes.get(step_type, -1)
+    return mask
+
+
+def _typed_nodes(csr, step_type):
+    if step_type is None:
+        return np.arange(len(csr), dtype=np.int64)
+    return np.flatnonzero(csr.node_types == csr.type_codes.get(step_type, -1))
+
+
+def _type_count(csr, type_counts, step_type):
+    code = csr.type_codes.get(step_type)
+    return int(type_counts[code]) if code is not None else 0
+
+
+def _allowed(mask, rows):
+    return np.ones(len(rows), dtype=bool) if mask is None else mask[rows]
+
+
+def _slices(csr, slices, edge, steps, reverse=False):
+    """(start, end) ranges of the partitions an edge draws from"""
+    source, target, relationship = edge
+    node_step, other_step = (target, source) if reverse else (source, target)
+    wanted = (csr.relationship_codes.get(relationship, -1) if relationship is not None else None,
+              _type_code(csr, steps[node_step][1]), _type_code(csr, steps[other_step][1]))
+    return [bounds for key, bounds in slices.items()
+            if all(want is None or want == have for want, have in zip(wanted, key))]
+
+
+def _type_code(csr, step_type):
+    return None if step_type is None else csr.type_codes.get(step_type, -1)
+
+
+def _scan(csr, edge, steps, candidates, max_rows):
+    """The edges of the partitions ``edge`` draws from whose ends its steps
+    may bind, as (sources, targets, positions, truncated): at most
+    ``max_rows`` of them, and whether there were more. Partitions are read
+    ``max_rows`` edges at a time, so no array grows past that."""
+    source, target, _ = edge
+    sources, targets, positions, slices = csr.relation_partitions()
+    window = max(max_rows, 1)
+    found, kept = [], 0
+    for start, end in _slices(csr, slices, edge, steps):
+        for first in range(start, end, window):
+            block = slice(first, min(first + window, end))
+            block_sources, block_targets = sources[block].astype(np.int64), targets[block].astype(np.int64)
+            keep = np.flatnonzero(_allowed(candidates[source], block_sources)
+                                  & _allowed(candidates[target], block_targets))[:max_rows + 1 - kept]
+            found.append((block_sources[keep], block_targets[keep], positions[block][keep]))
+            kept += len(keep)
+            if kept > max_rows:
+                break
+        if kept > max_rows:
+            break
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), positions[:0], False
+    found_sources, found_targets, found_positions = (np.concatenate(column)[:max_rows] for column in zip(*found))
+    return found_sources, found_targets, found_positions, kept > max_rows
+
+
+def _extend(csr, pattern, candidates, nodes, positions, e, bound, max_rows):
+    """Join the partial matches with pattern edge ``e``, one endpoint of which is bound.
+
+    Returns the joined (nodes, positions), at most ``max_rows`` rows, and
+    whether there were more. Each partition's join is counted per key
+    first and then expanded ``max_rows`` candidate rows at a time, so no
+    array grows past that however many rows the full join would have.
+    """
+    source, target, _ = pattern.edges[e]
+    reverse = source not in bound
+    near, far = (target, source) if reverse else (source, target)
+    partition_nodes, partition_others, partition_positions, slices = csr.relation_partitions(reverse)
+    keys = nodes[:, near]
+    window = max(max_rows, 1)
+    rows, others, found = [], [], []
+    kept = 0
+    for start, end in _slices(csr, slices, pattern.edges[e], pattern.steps, reverse):
+        block = partition_nodes[start:end]
+        lo = np.searchsorted(block, keys, side='left')
+        counts = np.searchsorted(block, keys, side='right') - lo
+        ends = np.cumsum(counts)
+        total = int(ends[-1]) if len(ends) else 0
+        for first in range(0, total, window):
+            # Candidate rows first..first+window of this partition's join, in key order
+            flat = np.arange(first, min(first + window, total))
+            row = np.searchsorted(ends, flat, side='right')
+            at = start + lo[row] + flat - (ends[row] - counts[row])
+            other = partition_others[at].astype(np.int64)
+            if far in bound:
+                keep = other == nodes[row, far]
+            else:
+                keep = _allowed(candidates[far], other)
+            keep = np.flatnonzero(keep)[:max_rows + 1 - kept]
+            rows.append(row[keep])
+            others.append(other[keep])
+            found.append(partition_positions[at[keep]])
+            kept += len(keep)
+            if kept > max_rows:
+                break
+        if kept > max_rows:
+            break
+    if not rows:
+        return nodes[:0], positions[:0], False
+    rows, others, found = (np.concatenate(column)[:max_rows] for column in (rows, others, found))
+    nodes, positions = nodes[rows], positions[rows]
+    nodes[:, far] = others
+    positions[:, e] = found
+    return nodes, positions, kept > max_rows
+
+
+def _describe(pattern, index, edge=False):
+    if not edge:
+        label = pattern.labels[index]
+        name = pattern.names.get(index)
+        return label if name is None else f'{label} = {name}'
+    source, target, relationship = pattern.edges[index]
+    return f'{pattern.labels[source]} -{relationship or "*"}-> {pattern.labels[target]}'
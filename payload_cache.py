@@ -0,0 +1,71 @@
+import gzip
+import json
+import threading
+import uuid
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder is used without it
+    orjson = None
+
+
+def dump_json(data):
+    """Serialize data to compact JSON bytes, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class GraphPayloadCache:
+    """Serialized (and lazily gzip-compressed) response body per graph version.
+
+    ``build`` is called to produce the payload dict only when the graph
+    version differs from the cached one, so repeated reads of an unchanged
+    graph cost neither dict building nor JSON encoding. Each version gets an
+    ETag that also carries a per-process token, so tags issued before a
+    restart never match the new process's graph. get() is thread-safe; a
+    rebuild happens once while concurrent callers wait for it.
+
+    A ``variant`` (e.g. the version of the layout whose positions the
+    payload carries) is part of the cache key and of the ETag, so the
+    payload is also rebuilt when it changes.
+    """
+
+    def __init__(self, build, compress_level=6):
+        self._build = build
+        self.compress_level = compress_level
+        self._instance = uuid.uuid4().hex[:12]
+        self._version = None
+        self._variant = None
+        self._body = None
+        self._gzip_body = None
+        self.etag = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, version, accept_gzip=False, build=None, variant=None):
+        """Return ``(body, etag, content_encoding)`` for the given version.
+
+        ``build`` overrides the payload builder for this call, for callers
+        that hold the exact data of ``version`` themselves.
+        """
+        with self._lock:
+            return self._get(version, variant, accept_gzip, build or self._build)
+
+    def _get(self, version, variant, accept_gzip, build):
+        if version != self._version or variant != self._variant:
+            self.misses += 1
+            self._body = dump_json(build())
+            self._gzip_body = None
+            self._version = version
+            self._variant = variant
+            self.etag = f'{self._instance}-{version}' if variant is None else f'{self._instance}-{version}.{variant}'
+        else:
+            self.hits += 1
+        if accept_gzip:
+            if self._gzip_body is None:
+                self._gzip_body = gzip.compress(self._body, compresslevel=self.compress_level)
+            # Each encoding is a distinct representation, so it gets its own tag
+            return self._gzip_body, f'{self.etag}-gzip', 'gzip'
+        return self._body, self.etag, None
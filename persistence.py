@@ -0,0 +1,309 @@
+import json
+import logging
+import os
+import threading
+
+SNAPSHOT_PREFIX = 'snapshot-'
+WAL_PREFIX = 'wal-'
+
+logger = logging.getLogger(__name__)
+
+
+def _versioned_files(directory, prefix, suffix):
+    """Return ``[(version, path)]`` for files named <prefix><version><suffix>, oldest first."""
+    files = []
+    for filename in os.listdir(directory):
+        if filename.startswith(prefix) and filename.endswith(suffix):
+            try:
+                version = int(filename[len(prefix):-len(suffix)])
+            except ValueError:
+                continue
+            files.append((version, os.path.join(directory, filename)))
+    return sorted(files)
+
+
+def _fsync_directory(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:  # not supported on every platform
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class GraphJournal:
+    """Write-ahead log plus periodic snapshots for a KnowledgeGraph.
+
+    Once started, every change notification from the graph is appended to
+    the current log segment as one JSON line carrying the graph version and
+    the affected nodes or edges with their attributes. Lines are buffered
+    and a background thread writes and fsyncs them every ``flush_interval``
+    seconds, so many writes share one fsync (group commit); commit() blocks
+    until everything recorded so far is durable.
+
+    After ``snapshot_every`` logged items a second background thread
+    writes the whole graph to a snapshot file and a new log segment is
+    started, and older snapshots and segments are deleted. The change that
+    crosses the threshold only marks a snapshot as due; the thread then
+    copies the graph holding ``lock`` (the graph's ReadWriteLock) for
+    reading, so the copy waits for the write in progress to finish and
+    shows a whole number of writes, and encodes and fsyncs the copy after
+    letting go of the lock. A large upload therefore leads to one snapshot
+    after it, not one per ``snapshot_every`` items while it holds the
+    lock. Without ``lock`` no automatic snapshots are taken and snapshot()
+    has to be called while the graph is not changing. recover() rebuilds
+    the graph from the newest snapshot plus the log records after it.
+    """
+
+    def __init__(self, graph, directory, flush_interval=0.01, snapshot_every=100000, lock=None):
+        self.graph = graph
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self.lock = lock
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()            # guards the buffer and counters
+        self._write_lock = threading.Lock()      # serializes writes to the segment file
+        self._snapshot_lock = threading.Lock()   # one snapshot at a time
+        self._flushed = threading.Condition(self._lock)
+        self._snapshot_wanted = threading.Condition(self._lock)
+        self._buffer = []
+        self._recorded_seq = 0       # lines handed to record()
+        self._durable_seq = 0        # lines written and fsynced
+        self._items_since_snapshot = 0
+        self._snapshot_due = False
+        self._segment = None
+        self._thread = None
+        self._snapshot_thread = None
+        self._closing = False
+        self.snapshot_version = None
+        self.snapshots = 0
+        self.fsyncs = 0
+
+    # Recovery
+
+    def recover(self):
+        """Load the newest snapshot and replay the log after it.
+
+        Must be called before start(). Returns the number of log records
+        replayed. A torn last line from a crash mid-write is ignored.
+        """
+        graph = self.graph
+        snapshots = _versioned_files(self.directory, SNAPSHOT_PREFIX, '.json')
+        base_version = 0
+        if snapshots:
+            base_version, path = snapshots[-1]
+            with open(path, 'r') as f:
+                data = json.load(f)
+            graph.clear()
+            graph.add_nodes_from((node_id, attrs) for node_id, attrs in data['nodes'])
+            graph.add_edges_from((u, v, attrs) for u, v, attrs in data['edges'])
+            self.snapshot_version = base_version
+
+        version = base_version
+        replayed = 0
+        for _, path in _versioned_files(self.directory, WAL_PREFIX, '.log'):
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if record['v'] <= base_version:
+                        continue
+                    self._apply(record)
+                    version = record['v']
+                    replayed += 1
+
+        graph.version = max(graph.version, version)
+        return replayed
+
+    def _apply(self, record):
+        graph = self.graph
+        op = record['op']
+        items = record['items']
+        if op == 'add_nodes':
+            graph.add_nodes_from((node_id, attrs) for node_id, attrs in items)
+        elif op == 'add_edges':
+            graph.add_edges_from((u, v, attrs) for u, v, attrs in items)
+        elif op == 'remove_nodes':
+            graph.remove_nodes_from(items)
+        elif op == 'remove_edges':
+            graph.remove_edges_from(items)
+        elif op == 'clear':
+            graph.clear()
+
+    # Logging
+
+    def start(self):
+        """Open a log segment, start the background threads and begin recording changes."""
+        self._open_segment(self.graph.version)
+        self._thread = threading.Thread(target=self._flush_loop, name='graph-journal', daemon=True)
+        self._thread.start()
+        if self.lock is not None:
+            self._snapshot_thread = threading.Thread(target=self._snapshot_loop, name='graph-journal-snapshots',
+                                                     daemon=True)
+            self._snapshot_thread.start()
+        self.graph.add_listener(self.record)
+
+    def _open_segment(self, version):
+        if self._segment is not None:
+            self._segment.close()
+        path = os.path.join(self.directory, f'{WAL_PREFIX}{version:012d}.log')
+        self._segment = open(path, 'a', encoding='utf-8')
+        _fsync_directory(self.directory)
+
+    def record(self, event, items):
+        """KnowledgeGraph listener that queues one log line per change."""
+        graph = self.graph
+        if event == 'add_nodes':
+            items = [(n, graph._node[n]) for n in items]
+        elif event == 'add_edges':
+            items = [(u, v, graph._succ[u][v]) for u, v in items]
+        line = json.dumps({'v': graph.version, 'op': event, 'items': items}, separators=(',', ':'))
+        with self._lock:
+            self._buffer.append(line + '\n')
+            self._recorded_seq += 1
+            self._items_since_snapshot += max(len(items), 1)
+            if self._items_since_snapshot >= self.snapshot_every and not self._snapshot_due:
+                self._snapshot_due = True
+                self._snapshot_wanted.notify()
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                if self._closing:
+                    return
+            self.flush()
+            with self._lock:
+                if not self._closing:
+                    self._flushed.wait(self.flush_interval)
+
+    def flush(self):
+        """Write and fsync every buffered line."""
+        with self._write_lock:
+            with self._lock:
+                if not self._buffer:
+                    return
+                lines = self._buffer
+                self._buffer = []
+                seq = self._recorded_seq
+            # Writers keep appending to the new buffer while this batch syncs
+            self._segment.write(''.join(lines))
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            with self._lock:
+                self.fsyncs += 1
+                self._durable_seq = seq
+                self._flushed.notify_all()
+
+    def commit(self, timeout=None):
+        """Block until every change recorded so far has been fsynced.
+
+        Returns False if ``timeout`` expired first.
+        """
+        with self._lock:
+            target = self._recorded_seq
+            if self._thread is None:
+                return self._durable_seq >= target
+            self._flushed.notify_all()  # wake the flusher rather than waiting out its interval
+            return self._flushed.wait_for(lambda: self._durable_seq >= target, timeout)
+
+    # Compaction
+
+    def _snapshot_loop(self):
+        while True:
+            with self._lock:
+                self._snapshot_wanted.wait_for(lambda: self._snapshot_due or self._closing)
+                if self._closing:
+                    return
+            try:
+                self.snapshot()
+            except Exception:
+                logger.exception("Error writing a graph snapshot to %s", self.directory)
+
+    def snapshot(self):
+        """Write the whole graph to a snapshot and start a fresh log segment.
+
+        The graph is copied while holding ``lock`` for reading (without a
+        lock, the graph must not change while this runs) and written out
+        after releasing it. Older snapshots and log segments are removed
+        once the new snapshot is safely on disk.
+        """
+        with self._snapshot_lock:
+            if self.lock is not None:
+                with self.lock.read():
+                    version, nodes, edges = self._capture()
+            else:
+                version, nodes, edges = self._capture()
+            self._write_snapshot(version, nodes, edges)
+
+    def _capture(self):
+        """Copy the graph and start the log segment that follows the copy.
+
+        Returns ``(version, nodes, edges)``; attribute dicts are copied
+        because updates change them in place.
+        """
+        graph = self.graph
+        version = graph.version
+        # Records up to the copy end the old segment, later ones go to the new one
+        self.flush()
+        with self._write_lock:
+            self._open_segment(version)
+        with self._lock:
+            self._items_since_snapshot = 0
+            self._snapshot_due = False
+        nodes = [[n, dict(attrs)] for n, attrs in graph._node.items()]
+        edges = [[u, v, dict(attrs)] for u, neighbors in graph._succ.items() for v, attrs in neighbors.items()]
+        return version, nodes, edges
+
+    def _write_snapshot(self, version, nodes, edges):
+        path = os.path.join(self.directory, f'{SNAPSHOT_PREFIX}{version:012d}.json')
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': version, 'nodes': nodes, 'edges': edges}, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+
+        for old_version, old_path in _versioned_files(self.directory, SNAPSHOT_PREFIX, '.json'):
+            if old_version < version:
+                os.remove(old_path)
+        for old_version, old_path in _versioned_files(self.directory, WAL_PREFIX, '.log'):
+            if old_version < version:
+                os.remove(old_path)
+        self.snapshot_version = version
+        self.snapshots += 1
+
+    def close(self):
+        """Flush outstanding records and stop recording."""
+        self.graph.remove_listener(self.record)
+        with self._lock:
+            self._closing = True
+            self._flushed.notify_all()
+            self._snapshot_wanted.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+        self.flush()
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'snapshot_version': self.snapshot_version,
+                'snapshots': self.snapshots,
+                'pending_records': len(self._buffer),
+                'items_since_snapshot': self._items_since_snapshot,
+                'snapshot_due': self._snapshot_due,
+                'fsyncs': self.fsyncs
+            }
@@ -0,0 +1,206 @@
+"""Per-request profiles kept in a bounded directory on disk.
+
+Two kinds of profile are captured:
+
+* ``cprofile``: a request that asked for it runs under cProfile from
+  before the view until the response is produced; the file is a pstats
+  dump (load it with ``pstats.Stats(path)`` or snakeviz).
+* ``sampled``: a SlowRequestSampler thread watches every request and,
+  once one has run longer than a threshold, samples the stack of the
+  thread serving it at a fixed interval. Nothing runs in the request's
+  own thread, so requests that finish in time cost only a dict insert
+  and delete. The file holds the samples as folded stacks
+  (``frame;frame;frame count`` lines), the input format of flamegraph.pl
+  and speedscope.
+
+ProfileStore keeps the newest ``max_profiles`` profiles, deleting the
+oldest as new ones are written, with a JSON metadata file next to each.
+"""
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+CPROFILE = 'cprofile'
+SAMPLED = 'sampled'
+EXTENSIONS = {CPROFILE: '.prof', SAMPLED: '.folded'}
+
+MAX_STACK_DEPTH = 100
+
+_ID_PATTERN = re.compile(r'^\d{8}-[0-9a-f]{6}$')
+
+
+class ProfileStore:
+    """Ring buffer of profile files in ``directory``.
+
+    Profile ids sort by age and survive restarts: existing profiles are
+    picked up when the store is created. All methods are thread-safe.
+    """
+
+    def __init__(self, directory, max_profiles=50):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._ids = sorted(name[:-len('.json')] for name in os.listdir(directory)
+                           if name.endswith('.json') and _ID_PATTERN.match(name[:-len('.json')]))
+        start = int(self._ids[-1].split('-')[0]) + 1 if self._ids else 0
+        self._sequence = itertools.count(start)
+
+    def save(self, kind, meta, write):
+        """Store a profile; ``write(path)`` writes its data file. Returns the id."""
+        with self._lock:
+            profile_id = f'{next(self._sequence):08d}-{os.urandom(3).hex()}'
+        path = self._data_path(profile_id, kind)
+        write(path)
+        meta = dict(meta, id=profile_id, kind=kind, size=os.path.getsize(path),
+                    created=datetime.now(timezone.utc).isoformat(timespec='seconds'))
+        with open(self._meta_path(profile_id), 'w') as f:
+            json.dump(meta, f)
+        with self._lock:
+            self._ids.append(profile_id)
+            expired, self._ids = self._ids[:-self.max_profiles], self._ids[-self.max_profiles:]
+        for old_id in expired:
+            self._delete(old_id)
+        return profile_id
+
+    def list(self):
+        """Metadata of the stored profiles, newest first"""
+        with self._lock:
+            ids = list(reversed(self._ids))
+        profiles = []
+        for profile_id in ids:
+            meta = self.get(profile_id)
+            if meta is not None:  # deleted meanwhile
+                profiles.append(meta)
+        return profiles
+
+    def get(self, profile_id):
+        """Metadata of a profile, or None if there is no such profile"""
+        if not _ID_PATTERN.match(profile_id):
+            return None
+        try:
+            with open(self._meta_path(profile_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def data_path(self, meta):
+        return self._data_path(meta['id'], meta['kind'])
+
+    def _data_path(self, profile_id, kind):
+        return os.path.join(self.directory, profile_id + EXTENSIONS[kind])
+
+    def _meta_path(self, profile_id):
+        return os.path.join(self.directory, profile_id + '.json')
+
+    def _delete(self, profile_id):
+        meta = self.get(profile_id)
+        paths = [self._meta_path(profile_id)]
+        if meta is not None:
+            paths.insert(0, self.data_path(meta))
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def start_profiler():
+    """Start cProfile on the calling thread; pass the result to save_profiler()"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def save_profiler(store, profiler, meta):
+    profiler.disable()
+    return store.save(CPROFILE, meta, profiler.dump_stats)
+
+
+def stats_text(path, sort='cumulative', limit=50):
+    """Human-readable summary of a pstats dump"""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+class SlowRequestSampler:
+    """Samples the stacks of requests running longer than ``threshold`` seconds.
+
+    Call begin() when a request starts and end() when it finishes, on the
+    thread serving it; end() stores the samples of a slow request in
+    ``store`` and returns the profile id (None for requests that were
+    never sampled).
+    """
+
+    def __init__(self, store, threshold, interval=0.005):
+        self.store = store
+        self.threshold = threshold
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = {}  # thread id -> [start, samples Counter]
+        self._thread = threading.Thread(target=self._run, name='slow-request-sampler', daemon=True)
+        self._stopped = threading.Event()
+        self._thread.start()
+
+    def begin(self):
+        with self._lock:
+            self._active[threading.get_ident()] = [time.perf_counter(), None]
+
+    def end(self, meta):
+        with self._lock:
+            _, samples = self._active.pop(threading.get_ident(), (None, None))
+        if not samples:
+            return None
+        meta = dict(meta, samples=sum(samples.values()), interval=self.interval, threshold=self.threshold)
+
+        def write(path):
+            with open(path, 'w') as f:
+                f.writelines(f'{stack} {count}\n' for stack, count in samples.most_common())
+        return self.store.save(SAMPLED, meta, write)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        # Poll at the sampling interval only while requests are running
+        while not self._stopped.wait(self.interval if self._active else self.threshold):
+            now = time.perf_counter()
+            with self._lock:
+                slow = [(thread_id, entry) for thread_id, entry in self._active.items()
+                        if now - entry[0] >= self.threshold and thread_id != own]
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for thread_id, entry in slow:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = _folded(frame)
+                with self._lock:
+                    # The request may have ended since the list was taken
+                    if self._active.get(thread_id) is entry:
+                        if entry[1] is None:
+                            entry[1] = Counter()
+                        entry[1][stack] += 1
+
+
+def _folded(frame):
+    """The stack of ``frame`` as 'outermost;...;innermost' file:function names"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
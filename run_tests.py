@@ -24,12 +24,22 @@ def run_test_category(category):
         'basic': [
             'test_index_page',
             'test_api_test_endpoint',
-            'test_get_empty_graph'
+            'test_get_empty_graph',
+            'test_get_graph_delta',
+            'test_get_graph_delta_falls_back_to_snapshot',
+            'test_get_graph_etag_and_gzip',
+            'test_graph_payload_cache',
+            'test_graph_layout',
+            'test_metrics',
+            'test_request_profiling'
         ],
         'nodes': [
             'test_add_node_success',
             'test_add_node_missing_fields',
-            'test_add_node_invalid_type'
+            'test_add_node_invalid_type',
+            'test_add_node_duplicate_name',
+            'test_name_index_lookup',
+            'test_duplicate_names_from_upload'
         ],
         'edges': [
             'test_add_edge_success',
@@ -39,19 +49,60 @@ def run_test_category(category):
         'data': [
             'test_load_sample_data',
             'test_upload_json_data',
-            'test_upload_csv_data'
+            'test_upload_csv_data',
+            'test_add_nodes_and_edges_bulk',
+            'test_add_bulk_is_atomic',
+            'test_upload_csv_in_chunks',
+            'test_upload_tabular_validation',
+            'test_upload_invalid_chunk_keeps_graph',
+            'test_upload_ndjson_data',
+            'test_upload_ndjson_invalid_line',
+            'test_upload_ndjson_keeps_graph',
+            'test_journal_recovery',
+            'test_journal_snapshot_compaction',
+            'test_binary_snapshot_round_trip',
+            'test_binary_snapshot_checksum',
+            'test_load_snapshot_file',
+            'test_binary_snapshot_exact_round_trip',
+            'test_edge_weights',
+            'test_synthetic_graph'
         ],
         'query': [
             'test_query_impacts_success',
             'test_query_impacts_no_source',
-            'test_query_impacts_invalid_source'
+            'test_query_impacts_invalid_source',
+            'test_query_impacts_matches_shortest_paths',
+            'test_query_impacts_depth_and_limit',
+            'test_impact_cache_hits_and_invalidation',
+            'test_impact_cache_eviction',
+            'test_csr_snapshot_matches_graph',
+            'test_csr_snapshot_rebuild',
+            'test_csr_search_buffers',
+            'test_multi_source_impacts',
+            'test_query_impacts_batch',
+            'test_impact_scores',
+            'test_impact_paths',
+            'test_pattern_query',
+            'test_subgraph'
         ],
         'workflow': [
             'test_complete_workflow',
-            'test_graph_consistency'
+            'test_graph_consistency',
+            'test_load_test_mix_and_summary'
         ],
         'errors': [
             'test_error_handling'
+        ],
+        'concurrency': [
+            'test_read_write_lock',
+            'test_concurrent_reads_and_writes',
+            'test_upload_loads_outside_write_lock',
+            'test_shared_snapshot_publish_and_swap',
+            'test_shared_snapshot_reader_follows_in_background',
+            'test_shared_snapshot_reader_worker',
+            'test_jobs_query_impacts',
+            'test_jobs_upload',
+            'test_job_manager_cancel_and_limits'
         ]
     }
     
@@ -65,7 +116,7 @@ def run_test_category(category):
 def main():
     """Main test runner"""
     if len(sys.argv) < 2:
-        print("Usage: python run_tests.py [all|basic|nodes|edges|data|query|workflow|errors|specific_test_name]")
+        print("Usage: python run_tests.py [all|basic|nodes|edges|data|query|workflow|errors|concurrency|specific_test_name]")
         print("\nCategories:")
         print("  all        - Run all tests")
         print("  basic      - Basic functionality tests")
@@ -75,6 +126,7 @@ def main():
         print("  query      - Impact querying tests")
         print("  workflow   - Complete workflow tests")
         print("  errors     - Error handling tests")
+        print("  concurrency - Concurrent reader/writer tests")
         print("  specific   - Run a specific test (e.g., test_add_node_success)")
         return
     
@@ -83,7 +135,7 @@ def main():
     if test_type == 'all':
         # Run all tests
         suite = unittest.TestLoader().loadTestsFromTestCase(TestKnowledgeGraphApp)
-    elif test_type in ['basic', 'nodes', 'edges', 'data', 'query', 'workflow', 'errors']:
+    elif test_type in ['basic', 'nodes', 'edges', 'data', 'query', 'workflow', 'errors', 'concurrency']:
         # Run category tests
         suite = run_test_category(test_type)
         if suite is None:
@@ -0,0 +1,277 @@
+"""Graph snapshots published in POSIX shared memory for other processes.
+
+One writer process owns the graph. A SnapshotPublisher encodes it in the
+binary snapshot format (see binary_snapshot.py) into a fresh shared memory
+segment whenever it has changed, then points a small control block at that
+segment. Reader processes attach a SnapshotReader to the control block;
+once started, a thread checks the published version and, when it has
+moved on, maps the new segment and wraps it as a CSRGraph whose arrays are
+views of the shared pages, so current() only returns the newest one. Node
+id and name strings are decoded from the shared pages as they are used;
+the id and name lookups are built on that thread before the swap.
+
+The control block is a seqlock: the sequence number is odd while the
+publisher is rewriting it, so a reader that sees the same even number
+before and after reading the other fields has read a consistent version.
+"""
+import logging
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from binary_snapshot import BinarySnapshot, encode_csr
+from csr_graph import CSRGraph
+
+logger = logging.getLogger(__name__)
+
+CONTROL_MAGIC = b'KGSHM001'
+# magic, sequence, graph version, snapshot size, segment name
+CONTROL = struct.Struct('<8sQQQ64s')
+ATTACH_RETRIES = 10
+
+
+_attach_lock = threading.Lock()
+
+
+def _attach(name):
+    """Open an existing segment without registering it with this process's
+    resource tracker, which would unlink it at exit (it belongs to the
+    publisher)."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 always registers
+        pass
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class SnapshotPublisher:
+    """Publishes snapshots of ``graph`` under the control block ``name``.
+
+    publish() writes the current graph right away; start() runs a thread
+    that republishes at most every ``interval`` seconds while the graph
+    keeps changing. ``lock`` (a ReadWriteLock) is held for reading while
+    the graph is copied into arrays. The ``keep`` newest segments stay
+    linked so readers that just read the control block can still open
+    them; older ones are unlinked, and readers that already mapped them
+    keep their mapping until they let go. ``source``, if given, is called
+    instead of ``CSRGraph(graph)`` to get the arrays to publish.
+    """
+
+    def __init__(self, graph, name, lock=None, interval=0.5, keep=2, source=None):
+        self.graph = graph
+        self.source = source or (lambda: CSRGraph(graph))
+        self.name = name
+        self.lock = lock
+        self.interval = interval
+        self.keep = keep
+        try:
+            self._control = shared_memory.SharedMemory(name=name, create=True, size=CONTROL.size)
+        except FileExistsError:
+            # Left behind by a publisher that died; reuse it so attached readers follow along
+            self._control = _attach(name)
+        self._sequence = 0
+        self._segments = []
+        self._generation = 0
+        self._publish_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.version = None
+        self.publishes = 0
+
+    def publish(self):
+        """Publish the graph now; returns the published version."""
+        with self._publish_lock:
+            if self.lock is not None:
+                with self.lock.read():
+                    csr = self.source()
+            else:
+                csr = self.source()
+            data = encode_csr(csr)
+
+            self._generation += 1
+            segment = shared_memory.SharedMemory(
+                name=f'{self.name}-{self._generation}', create=True, size=len(data))
+            segment.buf[:len(data)] = data
+            self._write_control(csr.version or 0, len(data), segment.name)
+
+            self._segments.append(segment)
+            while len(self._segments) > self.keep:
+                old = self._segments.pop(0)
+                old.close()
+                old.unlink()
+            self.version = csr.version
+            self.publishes += 1
+            return self.version
+
+    def _write_control(self, version, size, segment_name):
+        buf = self._control.buf
+        name = segment_name.lstrip('/').encode('utf-8')
+        self._sequence += 1  # odd: readers retry until the write is finished
+        CONTROL.pack_into(buf, 0, CONTROL_MAGIC, self._sequence, version, size, name)
+        self._sequence += 1
+        CONTROL.pack_into(buf, 0, CONTROL_MAGIC, self._sequence, version, size, name)
+
+    def start(self):
+        self.publish()
+        self._thread = threading.Thread(target=self._publish_loop, name='snapshot-publisher', daemon=True)
+        self._thread.start()
+
+    def _publish_loop(self):
+        while not self._stop.wait(self.interval):
+            if self.graph.version != self.version:
+                self.publish()
+
+    def close(self):
+        """Stop publishing and unlink every segment, including the control block."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._publish_lock:
+            for segment in self._segments + [self._control]:
+                segment.close()
+                try:
+                    segment.unlink()
+                except FileNotFoundError:
+                    pass
+            self._segments = []
+
+    def stats(self):
+        return {
+            'role': 'writer',
+            'name': self.name,
+            'version': self.version,
+            'publishes': self.publishes,
+            'bytes': sum(segment.size for segment in self._segments)
+        }
+
+
+class SnapshotReader:
+    """Follows the snapshots published under the control block ``name``.
+
+    The publisher may start after the reader; until it has published,
+    current() returns None. After start(), a thread checks for a newer
+    snapshot every ``interval`` seconds and current() returns the newest
+    one it has attached without doing any work itself; before that,
+    current() checks and attaches on the caller's thread.
+    """
+
+    def __init__(self, name, interval=0.05):
+        self.name = name
+        self.interval = interval
+        self._control = None
+        self._lock = threading.Lock()
+        self._segment = None
+        self._snapshot = None
+        self._csr = None
+        self._retired = []
+        self._stop = threading.Event()
+        self._thread = None
+        self.swaps = 0
+
+    def _read_control(self):
+        if self._control is None:
+            try:
+                self._control = _attach(self.name)
+            except FileNotFoundError:
+                return None
+        buf = self._control.buf
+        while True:
+            magic, sequence, version, size, name = CONTROL.unpack_from(buf)
+            if magic != CONTROL_MAGIC:
+                return None  # nothing published yet
+            if sequence % 2 == 0 and CONTROL.unpack_from(buf)[1] == sequence:
+                return version, size, name.rstrip(b'\0').decode('utf-8')
+            time.sleep(0)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._follow_loop, name='snapshot-reader', daemon=True)
+        self._thread.start()
+
+    def _follow_loop(self):
+        while True:
+            try:
+                self._refresh()
+            except Exception:
+                logger.exception("Could not attach the snapshot published under %s", self.name)
+            if self._stop.wait(self.interval):
+                return
+
+    def current(self):
+        """Return a CSRGraph of the newest published snapshot, or None."""
+        if self._thread is not None:
+            return self._csr
+        return self._refresh()
+
+    def _refresh(self):
+        """Attach the newest published snapshot if it is not current yet."""
+        control = self._read_control()
+        if control is None:
+            return None
+        csr = self._csr
+        if csr is not None and csr.version == control[0]:
+            return csr
+        with self._lock:
+            for _ in range(ATTACH_RETRIES):
+                if self._csr is not None and self._csr.version == control[0]:
+                    return self._csr
+                version, size, segment_name = control
+                try:
+                    segment = _attach(segment_name)
+                except FileNotFoundError:
+                    # Unlinked by a newer publish between reading the control block and opening it
+                    control = self._read_control()
+                    continue
+                snapshot = BinarySnapshot(segment.buf[:size])
+                csr = snapshot.to_csr()
+                csr.build_indexes()
+                if self._segment is not None:
+                    self._retired.append((self._segment, self._snapshot))
+                self._segment, self._snapshot = segment, snapshot
+                self._csr = csr
+                self.swaps += 1
+                self._reap()
+                return self._csr
+            raise RuntimeError(f'Could not attach a snapshot published under {self.name}')
+
+    def _reap(self):
+        """Unmap retired segments that no request is using any more."""
+        still_used = []
+        for segment, snapshot in self._retired:
+            try:
+                snapshot.release()
+                segment.close()
+            except BufferError:  # a request still holds arrays from it
+                still_used.append((segment, snapshot))
+        self._retired = still_used
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._segment is not None:
+                self._retired.append((self._segment, self._snapshot))
+            self._segment = self._snapshot = self._csr = None
+            self._reap()
+            if self._control is not None:
+                self._control.close()
+                self._control = None
+
+    def stats(self):
+        csr = self._csr
+        return {
+            'role': 'reader',
+            'name': self.name,
+            'version': csr.version if csr is not None else None,
+            'swaps': self.swaps,
+            'retired_segments': len(self._retired)
+        }
@@ -1,7 +1,30 @@
 let graphData = { nodes: [], edges: [] };
+let graphVersion = null;  // server graph version graphData reflects
 let simulation;
-let svg, g;
+
+// Graphs with more nodes than this are not downloaded whole: the client
+// shows the highest-degree nodes and loads neighborhoods from /api/subgraph
+// as nodes are expanded (double-click)
+const FULL_GRAPH_MAX_NODES = 2000;
+const EXPAND_NODE_BUDGET = 200;  // nodes added by one expansion at most
+let neighborhoodMode = false;
+let expandedIds = new Set();  // nodes expanded so far, reloaded on refresh
+
+// Alpha of the refinement pass run when every node already has a position
+// (from the server layout or an earlier simulation); a fresh layout uses 1
+const REFINE_ALPHA = 0.1;
+let svg, g, linkLayer, nodeLayer;
+let link = d3.select(null), node = d3.select(null);  // SVG elements of the current join
+let canvas, context;
 let zoom;
+let transform = d3.zoomIdentity;
+
+// Above this many nodes the graph is drawn on a canvas instead of as SVG
+// elements, which keeps ticks cheap for large graphs
+const CANVAS_NODE_THRESHOLD = 1000;
+const CANVAS_LABEL_SCALE = 1.5;  // zoom level from which canvas nodes are labelled
+const NODE_RADIUS = 8;
+let renderer = 'svg';
 
 // Initialize the graph
 function initGraph() {
@@ -9,8 +32,9 @@ function initGraph() {
     const width = graphContainer.clientWidth;
     const height = graphContainer.clientHeight;
 
-    // Clear existing SVG
+    // Clear existing SVG and canvas
     d3.select('#graph svg').remove();
+    d3.select('#graph canvas').remove();
 
     // Create SVG with zoom behavior
     svg = d3.select('#graph')
@@ -19,148 +43,546 @@ function initGraph() {
         .attr('height', height)
         .style('background-color', '#f8f9fa');
 
-    // Add zoom behavior
+    // Create arrow marker, shared by every link
+    svg.append('defs').append('marker')
+        .attr('id', 'arrowhead')
+        .attr('viewBox', '-0 -5 10 10')
+        .attr('refX', 20)
+        .attr('refY', 0)
+        .attr('orient', 'auto')
+        .attr('markerWidth', 6)
+        .attr('markerHeight', 6)
+        .attr('xoverflow', 'visible')
+        .append('svg:path')
+        .attr('d', 'M 0,-5 L 10 ,0 L 0,5')
+        .attr('fill', '#999')
+        .style('stroke', 'none');
+
+    // Create main group for graph elements, links below nodes
+    g = svg.append('g');
+    linkLayer = g.append('g');
+    nodeLayer = g.append('g');
+
+    // Canvas used instead of the SVG elements for large graphs
+    canvas = d3.select('#graph')
+        .append('canvas')
+        .attr('class', 'graph-canvas')
+        .style('display', 'none');
+    context = canvas.node().getContext('2d');
+    resizeCanvas(width, height);
+
+    // Add zoom behavior to both surfaces; the transform is shared
     zoom = d3.zoom()
         .scaleExtent([0.1, 4])
         .on('zoom', (event) => {
-            g.attr('transform', event.transform);
+            transform = event.transform;
+            g.attr('transform', transform);
+            if (renderer === 'canvas') {
+                drawCanvas();
+            }
         });
 
-    svg.call(zoom);
+    svg.call(zoom)
+        .on('dblclick.zoom', null);  // double-click expands nodes instead
 
-    // Create main group for graph elements
-    g = svg.append('g');
+    // Canvas nodes are found by position; the drag behavior is added first
+    // so grabbing a node does not also pan the view
+    canvas.call(d3.drag()
+            .subject(event => canvasNodeAt(event.x, event.y))
+            .on('start', dragstarted)
+            .on('drag', canvasDragged)
+            .on('end', dragended))
+        .call(zoom)
+        .on('dblclick.zoom', null)
+        .on('dblclick', event => {
+            const d = canvasNodeAt(...d3.pointer(event));
+            if (d) expandNode(d);
+        })
+        .on('mousemove', event => {
+            const d = canvasNodeAt(...d3.pointer(event));
+            canvas.attr('title', d ? nodeTitle(d) : null);
+        });
 
     // Add zoom controls
     window.zoomIn = () => {
-        svg.transition().duration(300).call(zoom.scaleBy, 1.3);
+        surface().transition().duration(300).call(zoom.scaleBy, 1.3);
     };
 
     window.zoomOut = () => {
-        svg.transition().duration(300).call(zoom.scaleBy, 1 / 1.3);
+        surface().transition().duration(300).call(zoom.scaleBy, 1 / 1.3);
     };
 
     window.resetZoom = () => {
-        svg.transition().duration(300).call(zoom.transform, d3.zoomIdentity);
+        surface().transition().duration(300).call(zoom.transform, d3.zoomIdentity);
     };
 
     // Load initial graph data
     loadGraphData();
 }
 
-// Load graph data from server
+// The element that currently receives zoom and pointer events
+function surface() {
+    return renderer === 'canvas' ? canvas : svg;
+}
+
+// Size the canvas backing store for the device pixel ratio
+function resizeCanvas(width, height) {
+    const ratio = window.devicePixelRatio || 1;
+    canvas.attr('width', width * ratio)
+        .attr('height', height * ratio)
+        .style('width', `${width}px`)
+        .style('height', `${height}px`);
+}
+
+// Load graph data from server. The first load asks /api/subgraph for up to
+// FULL_GRAPH_MAX_NODES nodes; if that is the whole graph, later loads only
+// request the changes since graphVersion (the server falls back to a full
+// snapshot when it no longer has them). Larger graphs are shown a
+// neighborhood at a time instead.
 function loadGraphData() {
-    fetch('/api/get_graph')
+    if (graphVersion === null || neighborhoodMode) {
+        loadOverview();
+        return;
+    }
+    fetch(`/api/get_graph?since=${graphVersion}`)
         .then(response => response.json())
         .then(data => {
-            graphData = data;
-            updateGraph();
+            let changed = true;
+            if (data.full) {
+                if (data.nodes.length > FULL_GRAPH_MAX_NODES) {
+                    loadOverview();
+                    return;
+                }
+                const previous = graphData.nodes;
+                placeNodes(data.nodes);
+                graphData = { nodes: data.nodes, edges: data.edges };
+                keepPositions(previous);
+            } else {
+                changed = applyGraphDelta(data);
+            }
+            graphVersion = data.version;
+            if (changed) {
+                updateGraph();
+            }
         })
         .catch(error => {
             console.error('Error loading graph data:', error);
         });
 }
 
-// Update the graph visualization
-function updateGraph() {
-    if (!svg) return;
+// Load the highest-degree nodes, then the neighborhoods expanded so far
+function loadOverview() {
+    fetch(`/api/subgraph?max_nodes=${FULL_GRAPH_MAX_NODES}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                console.error('Error loading graph data:', data.error);
+                return;
+            }
+            const previous = graphData.nodes;
+            neighborhoodMode = data.truncated;
+            graphData = { nodes: [], edges: [] };
+            graphVersion = data.version;
+            if (!neighborhoodMode) {
+                expandedIds.clear();
+                placeNodes(data.nodes);
+                graphData = { nodes: data.nodes, edges: data.edges };
+                keepPositions(previous);
+                setGraphStatus('');
+                updateGraph();
+                return;
+            }
+            mergeSubgraph(data);
+            keepPositions(previous);
+            if (!expandedIds.size) {
+                updateGraph();
+                return;
+            }
+            const ids = [...expandedIds].map(id => `id=${encodeURIComponent(id)}`).join('&');
+            fetch(`/api/subgraph?hops=1&max_nodes=${EXPAND_NODE_BUDGET * expandedIds.size}&${ids}`)
+                .then(response => response.json())
+                .then(expanded => {
+                    if (!expanded.error) {
+                        mergeSubgraph(expanded);
+                        keepPositions(previous);
+                    }
+                    updateGraph();
+                });
+        })
+        .catch(error => {
+            console.error('Error loading graph data:', error);
+        });
+}
 
-    // Clear existing elements
-    g.selectAll('*').remove();
+// Load the neighbors of a node and add them to the view
+function expandNode(node) {
+    if (!neighborhoodMode || !node.hidden) return;
+    fetch(`/api/subgraph?id=${encodeURIComponent(node.id)}&hops=1&max_nodes=${EXPAND_NODE_BUDGET}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) {
+                alert('Error: ' + data.error);
+                return;
+            }
+            expandedIds.add(node.id);
+            mergeSubgraph(data);
+            updateGraph();
+        })
+        .catch(error => {
+            console.error('Error expanding node:', error);
+        });
+}
 
-    // Create arrow marker
-    svg.append('defs').append('marker')
-        .attr('id', 'arrowhead')
-        .attr('viewBox', '-0 -5 10 10')
-        .attr('refX', 20)
-        .attr('refY', 0)
-        .attr('orient', 'auto')
-        .attr('markerWidth', 6)
-        .attr('markerHeight', 6)
-        .attr('xoverflow', 'visible')
-        .append('svg:path')
-        .attr('d', 'M 0,-5 L 10 ,0 L 0,5')
-        .attr('fill', '#999')
-        .style('stroke', 'none');
+// Add the nodes and edges of a /api/subgraph response to graphData, keeping
+// existing node objects (and their positions), then recount for every node
+// how many of its edges are still not loaded
+function mergeSubgraph(data) {
+    const nodesById = new Map(graphData.nodes.map(node => [node.id, node]));
+    placeNodes(data.nodes);
+    data.nodes.forEach(node => {
+        const existing = nodesById.get(node.id);
+        if (existing) {
+            Object.assign(existing, withoutPosition(node));
+        } else {
+            graphData.nodes.push(node);
+            nodesById.set(node.id, node);
+        }
+    });
 
-    // Create links
-    const link = g.append('g')
-        .selectAll('line')
-        .data(graphData.edges)
-        .enter().append('line')
-        .attr('class', 'link')
-        .attr('stroke', '#999')
-        .attr('stroke-width', 2)
-        .attr('marker-end', 'url(#arrowhead)');
-
-    // Create nodes
-    const node = g.append('g')
-        .selectAll('g')
-        .data(graphData.nodes)
-        .enter().append('g')
-        .attr('class', 'node')
-        .call(d3.drag()
-            .on('start', dragstarted)
-            .on('drag', dragged)
-            .on('end', dragended));
-
-    // Add circles to nodes
-    node.append('circle')
-        .attr('r', 8)
-        .attr('fill', d => getNodeColor(d.type));
-
-    // Add labels to nodes
-    node.append('text')
-        .attr('dx', 12)
-        .attr('dy', '.35em')
-        .text(d => d.name)
-        .style('font-size', '12px')
-        .style('fill', '#333');
-
-    // Add tooltips
-    node.append('title')
-        .text(d => `${d.name} (${d.type})`);
-
-    // Create force simulation
-    simulation = d3.forceSimulation(graphData.nodes)
-        .force('link', d3.forceLink(graphData.edges).id(d => d.id).distance(100))
-        .force('charge', d3.forceManyBody().strength(-300))
-        .force('center', d3.forceCenter(svg.node().clientWidth / 2, svg.node().clientHeight / 2))
-        .force('collision', d3.forceCollide().radius(30));
-
-    // Update positions on tick
-    simulation.on('tick', () => {
-        link
-            .attr('x1', d => d.source.x)
-            .attr('y1', d => d.source.y)
-            .attr('x2', d => d.target.x)
-            .attr('y2', d => d.target.y);
-
-        node
-            .attr('transform', d => `translate(${d.x},${d.y})`);
+    const edgeKeys = new Set(graphData.edges.map(edgeKey));
+    data.edges.forEach(edge => {
+        if (!edgeKeys.has(edgeKey(edge))) {
+            graphData.edges.push(edge);
+            edgeKeys.add(edgeKey(edge));
+        }
+    });
+
+    const loaded = new Map();
+    graphData.edges.forEach(edge => {
+        edgeEnds(edge).forEach(id => loaded.set(id, (loaded.get(id) || 0) + 1));
     });
+    graphData.nodes.forEach(node => {
+        node.hidden = Math.max(0, node.degree - (loaded.get(node.id) || 0));
+    });
+    setGraphStatus(`Showing ${graphData.nodes.length} nodes of a larger graph. ` +
+                   'Double-click a node with a dashed outline to load its neighbors.');
+}
+
+// Server layout coordinates are centred on the origin; shift them to the
+// middle of the view. Nodes without them are placed by the simulation.
+function placeNodes(nodes) {
+    if (!svg) return;
+    const cx = svg.node().clientWidth / 2;
+    const cy = svg.node().clientHeight / 2;
+    nodes.forEach(node => {
+        if (node.x !== undefined) {
+            node.x += cx;
+            node.y += cy;
+        }
+    });
+}
 
-    // Drag functions
-    function dragstarted(event, d) {
-        if (!event.active) simulation.alphaTarget(0.3).restart();
-        d.fx = d.x;
-        d.fy = d.y;
+// After a reload replaced the node objects, give every node that was already
+// on screen its previous position and velocity so the view does not jump
+function keepPositions(previousNodes) {
+    const previous = new Map(previousNodes.map(node => [node.id, node]));
+    graphData.nodes.forEach(node => {
+        const old = previous.get(node.id);
+        if (old && old.x !== undefined) {
+            Object.assign(node, { x: old.x, y: old.y, vx: old.vx, vy: old.vy });
+        }
+    });
+}
+
+// Node fields to copy onto a node already on screen, which keeps its position
+function withoutPosition(node) {
+    const { x, y, ...fields } = node;
+    return fields;
+}
+
+function setGraphStatus(text) {
+    const status = document.getElementById('graphStatus');
+    if (status) {
+        status.textContent = text;
     }
+}
 
-    function dragged(event, d) {
-        d.fx = event.x;
-        d.fy = event.y;
+// Endpoint ids of an edge; d3.forceLink replaces them with node objects
+function edgeEnds(edge) {
+    const source = typeof edge.source === 'object' ? edge.source.id : edge.source;
+    const target = typeof edge.target === 'object' ? edge.target.id : edge.target;
+    return [source, target];
+}
+
+function edgeKey(edge) {
+    return JSON.stringify(edgeEnds(edge));
+}
+
+// Merge a delta from /api/get_graph?since=... into graphData. Existing node
+// objects are updated in place so they keep their layout positions.
+// Returns false when the delta is empty.
+function applyGraphDelta(delta) {
+    if (!delta.nodes.length && !delta.edges.length &&
+        !delta.removed_nodes.length && !delta.removed_edges.length) {
+        return false;
     }
 
-    function dragended(event, d) {
-        if (!event.active) simulation.alphaTarget(0);
-        d.fx = null;
-        d.fy = null;
+    const nodesById = new Map(graphData.nodes.map(node => [node.id, node]));
+    placeNodes(delta.nodes);
+    delta.nodes.forEach(node => {
+        const existing = nodesById.get(node.id);
+        if (existing) {
+            Object.assign(existing, withoutPosition(node));
+        } else {
+            graphData.nodes.push(node);
+            nodesById.set(node.id, node);
+        }
+    });
+
+    const edgesByKey = new Map(graphData.edges.map(edge => [edgeKey(edge), edge]));
+    delta.edges.forEach(edge => {
+        const existing = edgesByKey.get(edgeKey(edge));
+        if (existing) {
+            existing.relationship = edge.relationship;
+        } else {
+            graphData.edges.push(edge);
+        }
+    });
+
+    const removedNodes = new Set(delta.removed_nodes);
+    const removedEdges = new Set(delta.removed_edges.map(edgeKey));
+    graphData.nodes = graphData.nodes.filter(node => !removedNodes.has(node.id));
+    graphData.edges = graphData.edges.filter(edge => {
+        const [source, target] = edgeEnds(edge);
+        return !removedEdges.has(edgeKey(edge)) && !removedNodes.has(source) && !removedNodes.has(target);
+    });
+    return true;
+}
+
+// Update the graph visualization. Nodes and links are joined by key, so
+// only added or removed elements are created or deleted and every node
+// keeps its position; one simulation is kept and reheated with the new data.
+function updateGraph() {
+    if (!svg) return;
+
+    setRenderer(graphData.nodes.length > CANVAS_NODE_THRESHOLD ? 'canvas' : 'svg');
+    if (renderer === 'svg') {
+        joinElements();
     }
 
+    // Create force simulation once; d3 places nodes that have no position yet
+    const placed = graphData.nodes.every(node => node.x !== undefined);
+    if (!simulation) {
+        simulation = d3.forceSimulation()
+            .force('link', d3.forceLink().id(d => d.id).distance(100))
+            .force('charge', d3.forceManyBody().strength(-300))
+            .force('center', d3.forceCenter(svg.node().clientWidth / 2, svg.node().clientHeight / 2))
+            .force('collision', d3.forceCollide().radius(30))
+            .on('tick', ticked);
+    }
+    simulation.nodes(graphData.nodes);
+    simulation.force('link').links(graphData.edges);
+    simulation.alpha(placed ? REFINE_ALPHA : 1).restart();
+
     updateNodeSelects();
 }
 
+// Switch between SVG and canvas drawing, carrying the zoom over
+function setRenderer(mode) {
+    if (mode === renderer) return;
+    renderer = mode;
+    g.style('display', mode === 'svg' ? null : 'none');
+    canvas.style('display', mode === 'canvas' ? null : 'none');
+    if (mode === 'canvas') {
+        // The canvas draws everything itself; drop the SVG elements
+        linkLayer.selectAll('*').remove();
+        nodeLayer.selectAll('*').remove();
+        link = node = d3.select(null);
+    }
+    surface().call(zoom.transform, transform);
+}
+
+// Keyed enter/update/exit join of the SVG elements with graphData
+function joinElements() {
+    link = linkLayer.selectAll('line')
+        .data(graphData.edges, edgeKey)
+        .join(enter => enter.append('line')
+            .attr('class', 'link')
+            .attr('stroke', '#999')
+            .attr('stroke-width', 2)
+            .attr('marker-end', 'url(#arrowhead)'));
+
+    node = nodeLayer.selectAll('g.node')
+        .data(graphData.nodes, d => d.id)
+        .join(enter => {
+            const entered = enter.append('g')
+                .attr('class', 'node')
+                .on('dblclick', (event, d) => expandNode(d))
+                .call(d3.drag()
+                    .on('start', dragstarted)
+                    .on('drag', dragged)
+                    .on('end', dragended));
+            entered.append('circle')
+                .attr('r', NODE_RADIUS);
+            entered.append('text')
+                .attr('dx', 12)
+                .attr('dy', '.35em')
+                .style('font-size', '12px')
+                .style('fill', '#333');
+            entered.append('title');
+            return entered;
+        });
+
+    // Redraw only the nodes whose name, type or hidden edges changed
+    node.filter(function(d) { return this.__drawn !== nodeSignature(d); })
+        .each(function(d) { this.__drawn = nodeSignature(d); })
+        .classed('expandable', d => d.hidden > 0)
+        .call(changed => {
+            changed.select('circle').attr('fill', d => getNodeColor(d.type));
+            changed.select('text').text(d => d.name);
+            changed.select('title').text(nodeTitle);
+        });
+}
+
+function nodeSignature(d) {
+    return `${d.name}|${d.type}|${d.hidden || 0}`;
+}
+
+function nodeTitle(d) {
+    return d.hidden ? `${d.name} (${d.type}), ${d.hidden} more connections` : `${d.name} (${d.type})`;
+}
+
+// Update positions on tick
+function ticked() {
+    if (renderer === 'canvas') {
+        drawCanvas();
+        return;
+    }
+    link
+        .attr('x1', d => d.source.x)
+        .attr('y1', d => d.source.y)
+        .attr('x2', d => d.target.x)
+        .attr('y2', d => d.target.y);
+
+    node
+        .attr('transform', d => `translate(${d.x},${d.y})`);
+}
+
+// Draw the whole graph on the canvas: every link in one path, arrowheads in
+// another, then one path per node colour. Only nodes in view are drawn, and
+// labels only once zoomed in far enough to read them.
+function drawCanvas() {
+    const ratio = window.devicePixelRatio || 1;
+    const width = canvas.node().width / ratio;
+    const height = canvas.node().height / ratio;
+    const [left, top] = transform.invert([0, 0]);
+    const [right, bottom] = transform.invert([width, height]);
+    const margin = NODE_RADIUS * 2;
+    const visible = graphData.nodes.filter(d =>
+        d.x > left - margin && d.x < right + margin && d.y > top - margin && d.y < bottom + margin);
+
+    context.save();
+    context.setTransform(ratio, 0, 0, ratio, 0, 0);
+    context.clearRect(0, 0, width, height);
+    context.translate(transform.x, transform.y);
+    context.scale(transform.k, transform.k);
+
+    context.beginPath();
+    graphData.edges.forEach(edge => {
+        if (typeof edge.source !== 'object') return;  // not yet resolved by forceLink
+        context.moveTo(edge.source.x, edge.source.y);
+        context.lineTo(edge.target.x, edge.target.y);
+    });
+    context.globalAlpha = 0.6;
+    context.strokeStyle = '#999';
+    context.lineWidth = 1.5;
+    context.stroke();
+
+    if (transform.k >= 0.5) {
+        context.beginPath();
+        graphData.edges.forEach(edge => {
+            if (typeof edge.source !== 'object') return;
+            const dx = edge.target.x - edge.source.x;
+            const dy = edge.target.y - edge.source.y;
+            const length = Math.hypot(dx, dy) || 1;
+            const ux = dx / length, uy = dy / length;
+            const tipX = edge.target.x - ux * NODE_RADIUS, tipY = edge.target.y - uy * NODE_RADIUS;
+            const baseX = tipX - ux * 6, baseY = tipY - uy * 6;
+            context.moveTo(tipX, tipY);
+            context.lineTo(baseX - uy * 3, baseY + ux * 3);
+            context.lineTo(baseX + uy * 3, baseY - ux * 3);
+            context.closePath();
+        });
+        context.fillStyle = '#999';
+        context.fill();
+    }
+    context.globalAlpha = 1;
+
+    d3.group(visible, d => d.type).forEach((nodes, type) => {
+        context.beginPath();
+        nodes.forEach(d => {
+            context.moveTo(d.x + NODE_RADIUS, d.y);
+            context.arc(d.x, d.y, NODE_RADIUS, 0, 2 * Math.PI);
+        });
+        context.fillStyle = getNodeColor(type);
+        context.fill();
+    });
+
+    const expandable = visible.filter(d => d.hidden > 0);
+    if (expandable.length) {
+        context.beginPath();
+        expandable.forEach(d => {
+            context.moveTo(d.x + NODE_RADIUS, d.y);
+            context.arc(d.x, d.y, NODE_RADIUS, 0, 2 * Math.PI);
+        });
+        context.setLineDash([2, 2]);
+        context.strokeStyle = '#333';
+        context.lineWidth = 2;
+        context.stroke();
+        context.setLineDash([]);
+    }
+
+    if (transform.k >= CANVAS_LABEL_SCALE) {
+        context.fillStyle = '#333';
+        context.font = '12px sans-serif';
+        context.textBaseline = 'middle';
+        visible.forEach(d => context.fillText(d.name, d.x + 12, d.y));
+    }
+    context.restore();
+}
+
+// The node under a canvas point, if any
+function canvasNodeAt(x, y) {
+    if (!simulation) return undefined;
+    const [graphX, graphY] = transform.invert([x, y]);
+    return simulation.find(graphX, graphY, NODE_RADIUS * 2);
+}
+
+// Drag functions; d is the dragged node (event.subject)
+function dragstarted(event) {
+    if (!event.active) simulation.alphaTarget(0.3).restart();
+    event.subject.fx = event.subject.x;
+    event.subject.fy = event.subject.y;
+}
+
+function dragged(event) {
+    event.subject.fx = event.x;
+    event.subject.fy = event.y;
+}
+
+// On the canvas the pointer is in screen coordinates, so undo the zoom
+function canvasDragged(event) {
+    const [x, y] = transform.invert(d3.pointer(event.sourceEvent, canvas.node()));
+    event.subject.fx = x;
+    event.subject.fy = y;
+}
+
+function dragended(event) {
+    if (!event.active) simulation.alphaTarget(0);
+    event.subject.fx = null;
+    event.subject.fy = null;
+}
+
 // Get color for node type
 function getNodeColor(type) {
     const colors = {
@@ -369,6 +791,7 @@ window.addEventListener('resize', () => {
         const height = graphContainer.clientHeight;
         
         svg.attr('width', width).attr('height', height);
+        resizeCanvas(width, height);
         
         // Update force simulation center
         if (simulation) {
@@ -0,0 +1,139 @@
+"""Seeded synthetic knowledge graphs for benchmarks and load tests.
+
+Graphs are layered like the real data::
+
+    activity -causes-> factor -affects-> consequence
+                       factor -occurs_in-> location -impacts-> consequence
+                       factor -contributes_to-> factor
+
+Edge targets are drawn with a skew towards low indices within each layer,
+so a few factors and consequences become hubs, as in the sample data. The
+same (nodes, seed, fanout) always gives the same graph.
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from binary_snapshot import write_snapshot
+from graph_store import KnowledgeGraph
+
+# Share of the nodes in each layer
+TYPE_SHARES = (('activity', 0.15), ('factor', 0.35), ('location', 0.15), ('consequence', 0.35))
+
+# Share of factors with a contributes_to edge to another factor
+FACTOR_LINK_SHARE = 0.2
+
+FORMATS = ('json', 'csv', 'ndjson', 'kgs')
+
+
+def generate_graph(nodes, seed=0, fanout=2):
+    """Return ``{'nodes': [...], 'edges': [...]}`` in the sample_data.json schema.
+
+    Activities and factors get ``fanout`` outgoing causes / affects edges
+    each; every factor occurs in one location and every location impacts
+    one consequence. Edges carry a weight in (0, 1]. Node ids are derived
+    from type and name the way the tabular upload derives them, so every
+    format written by write_graph() loads into the same graph.
+    """
+    rng = np.random.default_rng(seed)
+    counts = {node_type: max(1, int(nodes * share)) for node_type, share in TYPE_SHARES}
+    counts['consequence'] = max(1, nodes - sum(c for t, c in counts.items() if t != 'consequence'))
+    names = {node_type: [f'{node_type.capitalize()} {i}' for i in range(count)]
+             for node_type, count in counts.items()}
+    ids = {node_type: [f"{node_type}_{name.replace(' ', '_')}" for name in layer]
+           for node_type, layer in names.items()}
+
+    def skewed(count, size):
+        # Squaring a uniform sample favours low indices: index i is drawn
+        # with probability falling off like 1 / sqrt(i)
+        return (rng.random(size) ** 2 * count).astype(np.int64)
+
+    layers = []  # (source type, target type, relationship, sources, targets)
+    for source_type, target_type, relationship, per_node in (
+            ('activity', 'factor', 'causes', fanout),
+            ('factor', 'consequence', 'affects', fanout),
+            ('factor', 'location', 'occurs_in', 1),
+            ('location', 'consequence', 'impacts', 1)):
+        sources = np.repeat(np.arange(counts[source_type]), per_node)
+        layers.append((source_type, target_type, relationship, sources,
+                       skewed(counts[target_type], len(sources))))
+    linked = np.flatnonzero(rng.random(counts['factor']) < FACTOR_LINK_SHARE)
+    targets = skewed(counts['factor'], len(linked))
+    keep = targets != linked
+    layers.append(('factor', 'factor', 'contributes_to', linked[keep], targets[keep]))
+
+    node_list = [{'id': node_id, 'type': node_type, 'name': name}
+                 for node_type, _ in TYPE_SHARES
+                 for node_id, name in zip(ids[node_type], names[node_type])]
+    edge_list = []
+    for source_type, target_type, relationship, sources, targets in layers:
+        # Drop repeated pairs; a DiGraph would merge them anyway
+        pairs = np.unique(np.stack([sources, targets], axis=1), axis=0)
+        weights = np.round(rng.uniform(0.05, 1.0, len(pairs)), 3)
+        edge_list.extend({'source': ids[source_type][s], 'target': ids[target_type][t],
+                          'relationship': relationship, 'weight': w}
+                         for (s, t), w in zip(pairs.tolist(), weights.tolist()))
+    return {'nodes': node_list, 'edges': edge_list}
+
+
+def to_graph(data):
+    """Build a KnowledgeGraph from generate_graph() output"""
+    graph = KnowledgeGraph()
+    graph.add_nodes_from((node['id'], {'type': node['type'], 'name': node['name']}) for node in data['nodes'])
+    graph.add_edges_from((edge['source'], edge['target'],
+                          {'relationship': edge['relationship'], 'weight': edge['weight']})
+                         for edge in data['edges'])
+    return graph
+
+
+def to_frame(data):
+    """The edges as rows of the tabular (CSV / JSON list) upload format"""
+    nodes = {node['id']: node for node in data['nodes']}
+    return pd.DataFrame({
+        'source': [nodes[edge['source']]['name'] for edge in data['edges']],
+        'source_type': [nodes[edge['source']]['type'] for edge in data['edges']],
+        'target': [nodes[edge['target']]['name'] for edge in data['edges']],
+        'target_type': [nodes[edge['target']]['type'] for edge in data['edges']],
+        'relation': [edge['relationship'] for edge in data['edges']],
+        'weight': [edge['weight'] for edge in data['edges']],
+    })
+
+
+def ndjson_lines(data):
+    """The graph as NDJSON upload records, one encoded line at a time"""
+    for node in data['nodes']:
+        yield json.dumps(dict(node, kind='node')).encode('utf-8') + b'\n'
+    for edge in data['edges']:
+        yield json.dumps(dict(edge, kind='edge')).encode('utf-8') + b'\n'
+
+
+def write_graph(data, path, file_format=None):
+    """Write generated data as .json, .csv, .ndjson or .kgs, chosen by the
+    path's extension unless ``file_format`` is given"""
+    file_format = file_format or path.rsplit('.', 1)[-1]
+    if file_format == 'json':
+        with open(path, 'w') as f:
+            json.dump(data, f)
+    elif file_format == 'csv':
+        to_frame(data).to_csv(path, index=False)
+    elif file_format == 'ndjson':
+        with open(path, 'wb') as f:
+            f.writelines(ndjson_lines(data))
+    elif file_format == 'kgs':
+        write_snapshot(to_graph(data), path)
+    else:
+        raise ValueError(f'Unknown format "{file_format}"; expected one of {", ".join(FORMATS)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a seeded synthetic knowledge graph')
+    parser.add_argument('nodes', type=int, help='number of nodes')
+    parser.add_argument('path', help='output file (.json, .csv, .ndjson or .kgs)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--fanout', type=int, default=2, help='causes / affects edges per activity and factor')
+    args = parser.parse_args()
+    data = generate_graph(args.nodes, seed=args.seed, fanout=args.fanout)
+    write_graph(data, args.path)
+    print(f"Wrote {args.path}: {len(data['nodes'])} nodes, {len(data['edges'])} edges")
@@ -1,9 +1,32 @@
 import unittest
+import contextlib
+import gzip
+import io
 import json
+import random
+import sys
 import tempfile
+import threading
+import time
 import os
+import numpy as np
 import pandas as pd
-from knowledge_graph_app import app, G, NODE_TYPES, RELATIONSHIP_TYPES
+from knowledge_graph_app import app, G, NODE_TYPES, RELATIONSHIP_TYPES, impact_cache
+import knowledge_graph_app
+import ingest
+import synthetic_graph
+import load_test
+import profiling
+from impact_engine import ImpactCache, find_impacts
+from csr_graph import CSRGraph, CSRSnapshot
+from graph_store import ChangeLog, KnowledgeGraph
+from persistence import GraphJournal
+from binary_snapshot import BinarySnapshot, MappedSnapshot, SnapshotStrings, convert_json, encode_csr, write_snapshot
+from payload_cache import GraphPayloadCache
+from pattern_query import parse_pattern, match_pattern
+from concurrency import ReadWriteLock
+from shared_snapshot import SnapshotPublisher, SnapshotReader
+from jobs import JobManager, JobQueueFull
 import networkx as nx
 
 class TestKnowledgeGraphApp(unittest.TestCase):
@@ -18,6 +41,20 @@ class TestKnowledgeGraphApp(unittest.TestCase):
         """Clean up after each test"""
         G.clear()
     
+    def _graph_state(self, graph):
+        return (dict(graph.nodes(data=True)),
+                {(u, v): attrs for u, v, attrs in graph.edges(data=True)})
+    
+    def _assert_same_impacts(self, graph, source_id, impacts, expected):
+        """Check that impacts match expected up to the choice among equally short paths"""
+        self.assertEqual(sorted((i['consequence'], len(i['path'])) for i in impacts),
+                         sorted((i['consequence'], len(i['path'])) for i in expected))
+        ids = {attrs['name']: n for n, attrs in graph.nodes(data=True)}
+        for impact in impacts:
+            path = [ids[name] for name in impact['path']]
+            self.assertEqual(path[0], source_id)
+            self.assertTrue(all(graph.has_edge(u, v) for u, v in zip(path, path[1:])))
+    
     def test_index_page(self):
         """Test that the main page loads correctly"""
         response = self.app.get('/')
@@ -381,6 +418,1466 @@ class TestKnowledgeGraphApp(unittest.TestCase):
             self.assertEqual(response.status_code, 400)
         finally:
             os.unlink(temp_file_path)
+    
+    def test_name_index_lookup(self):
+        """Test that the name and type indexes follow every mutation path"""
+        self.app.post('/api/load_sample_data')
+        self.assertEqual(G.node_id_for_name('Industrial Manufacturing'), 'activity_1')
+        self.assertIn('activity_1', G.nodes_of_type('activity'))
+        
+        # Re-adding a node under a new name moves it in the index
+        G.add_node('activity_1', type='activity', name='Heavy Industry')
+        self.assertIsNone(G.node_id_for_name('Industrial Manufacturing'))
+        self.assertEqual(G.node_id_for_name('Heavy Industry'), 'activity_1')
+        
+        G.remove_node('activity_1')
+        self.assertIsNone(G.node_id_for_name('Heavy Industry'))
+        self.assertNotIn('activity_1', G.nodes_of_type('activity'))
+        
+        # Clearing the graph empties the indexes
+        G.clear()
+        self.assertIsNone(G.node_id_for_name('Deforestation'))
+        self.assertEqual(G.nodes_of_type('activity'), [])
+    
+    def test_add_node_duplicate_name(self):
+        """Test that a node name cannot be reused by a different node ID"""
+        node_data = {'id': 'n1', 'name': 'Shared Name', 'type': 'activity'}
+        response = self.app.post('/api/add_node',
+                               data=json.dumps(node_data),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        
+        # Updating the same node is allowed
+        response = self.app.post('/api/add_node',
+                               data=json.dumps(node_data),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        
+        node_data['id'] = 'n2'
+        response = self.app.post('/api/add_node',
+                               data=json.dumps(node_data),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertNotIn('n2', G.nodes())
+    
+    def test_duplicate_names_from_upload(self):
+        """Test that duplicate names from bulk loads are detected and resolved predictably"""
+        G.add_nodes_from([
+            ('factor_Water_Pollution', {'type': 'factor', 'name': 'Water Pollution'}),
+            ('consequence_Water_Pollution', {'type': 'consequence', 'name': 'Water Pollution'})
+        ])
+        self.assertEqual(G.duplicate_names, ['Water Pollution'])
+        self.assertEqual(G.node_id_for_name('Water Pollution'), 'factor_Water_Pollution')
+        
+        G.remove_node('factor_Water_Pollution')
+        self.assertEqual(G.duplicate_names, [])
+        self.assertEqual(G.node_id_for_name('Water Pollution'), 'consequence_Water_Pollution')
+    
+    def test_query_impacts_matches_shortest_paths(self):
+        """Test that the BFS impact engine finds every consequence via a shortest path"""
+        self.app.post('/api/load_sample_data')
+        source_id = G.node_id_for_name('Industrial Manufacturing')
+        
+        response = self.app.get('/api/query_impacts?source=Industrial Manufacturing')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        
+        expected = {G.nodes[n]['name'] for n in nx.descendants(G, source_id)
+                    if G.nodes[n]['type'] == 'consequence'}
+        self.assertEqual({impact['consequence'] for impact in data}, expected)
+        for impact in data:
+            target_id = G.node_id_for_name(impact['consequence'])
+            self.assertEqual(len(impact['path']), nx.shortest_path_length(G, source_id, target_id) + 1)
+            self.assertEqual(impact['path'][0], 'Industrial Manufacturing')
+            self.assertEqual(impact['path'][-1], impact['consequence'])
+    
+    def test_query_impacts_depth_and_limit(self):
+        """Test the max_depth and limit parameters of query_impacts"""
+        G.add_nodes_from([
+            ('a', {'type': 'activity', 'name': 'A'}),
+            ('c1', {'type': 'consequence', 'name': 'C1'}),
+            ('f', {'type': 'factor', 'name': 'F'}),
+            ('c2', {'type': 'consequence', 'name': 'C2'})
+        ])
+        G.add_edges_from([('a', 'c1'), ('a', 'f'), ('f', 'c2')], relationship='causes')
+        
+        data = json.loads(self.app.get('/api/query_impacts?source=A').data)
+        self.assertEqual([impact['consequence'] for impact in data], ['C1', 'C2'])
+        
+        data = json.loads(self.app.get('/api/query_impacts?source=A&max_depth=1').data)
+        self.assertEqual([impact['consequence'] for impact in data], ['C1'])
+        
+        data = json.loads(self.app.get('/api/query_impacts?source=A&limit=1').data)
+        self.assertEqual(len(data), 1)
+        
+        response = self.app.get('/api/query_impacts?source=A&max_depth=-1')
+        self.assertEqual(response.status_code, 400)
+        response = self.app.get('/api/query_impacts?source=A&limit=abc')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_impact_cache_hits_and_invalidation(self):
+        """Test that cached impact results are reused and invalidated only when affected"""
+        G.add_nodes_from([
+            ('a1', {'type': 'activity', 'name': 'A1'}),
+            ('a2', {'type': 'activity', 'name': 'A2'}),
+            ('f1', {'type': 'factor', 'name': 'F1'}),
+            ('f2', {'type': 'factor', 'name': 'F2'}),
+            ('c1', {'type': 'consequence', 'name': 'C1'}),
+            ('c2', {'type': 'consequence', 'name': 'C2'})
+        ])
+        G.add_edges_from([('a1', 'f1'), ('a2', 'f2'), ('f2', 'c2')], relationship='causes')
+        
+        self.app.get('/api/query_impacts?source=A1')
+        self.app.get('/api/query_impacts?source=A2')
+        before = impact_cache.stats()
+        data = json.loads(self.app.get('/api/query_impacts?source=A1').data)
+        self.assertEqual(data, [])
+        self.assertEqual(impact_cache.stats()['hits'], before['hits'] + 1)
+        
+        # An edge out of F1 only affects searches that reached F1
+        response = self.app.post('/api/add_edge',
+                               data=json.dumps({'source': 'F1', 'target': 'C1', 'relationship': 'contributes_to'}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(impact_cache), 1)
+        
+        data = json.loads(self.app.get('/api/query_impacts?source=A1').data)
+        self.assertEqual([impact['consequence'] for impact in data], ['C1'])
+        data = json.loads(self.app.get('/api/query_impacts?source=A2').data)
+        self.assertEqual([impact['consequence'] for impact in data], ['C2'])
+        
+        response = self.app.get('/api/cache_stats')
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.data)
+        self.assertEqual(stats['graph_version'], G.version)
+        self.assertIn('evictions', stats['impact_cache'])
+        
+        # Replacing the graph drops everything
+        self.app.post('/api/load_sample_data')
+        self.assertEqual(len(impact_cache), 0)
+    
+    def test_impact_cache_eviction(self):
+        """Test LRU eviction by entry count and by memory cost"""
+        cache = ImpactCache(max_entries=2, max_cost=10)
+        cache.put('a', 0, [], {'a', 'b'})
+        cache.put('b', 0, [], {'b', 'c'})
+        cache.get('a')
+        cache.put('c', 0, [], {'c'})
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertEqual(cache.evictions, 1)
+        
+        cache.put('big', 0, [{'consequence': 'x', 'path': list('abcdefg')}], {'x', 'y'})
+        self.assertLessEqual(cache.stats()['cost'], 10)
+        self.assertIsNotNone(cache.get('big'))
+        self.assertEqual(len(cache), 1)
+        
+        cache.invalidate_nodes(['y'])
+        self.assertEqual(len(cache), 0)
+    
+    def test_add_nodes_and_edges_bulk(self):
+        """Test the bulk node and edge endpoints"""
+        with open('sample_data.json', 'r') as f:
+            sample_data = json.load(f)
+        
+        response = self.app.post('/api/add_nodes_bulk',
+                               data=json.dumps({'nodes': sample_data['nodes']}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['added'], len(sample_data['nodes']))
+        
+        response = self.app.post('/api/add_edges_bulk',
+                               data=json.dumps({'edges': sample_data['edges'], 'match': 'id'}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(G.edges()), len(sample_data['edges']))
+        
+        # Edges can also be addressed by node name, like /api/add_edge
+        response = self.app.post('/api/add_edges_bulk',
+                               data=json.dumps([{'source': 'Deforestation', 'target': 'CO2 Emissions', 'relationship': 'causes'}]),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(G.has_edge('activity_2', 'factor_1'))
+    
+    def test_add_bulk_is_atomic(self):
+        """Test that an invalid item rejects the whole batch with per-item errors"""
+        nodes = [
+            {'id': 'n1', 'name': 'Node 1', 'type': 'activity'},
+            {'id': 'n2', 'name': 'Node 2', 'type': 'invalid_type'},
+            {'id': 'n3', 'name': 'Node 1', 'type': 'factor'},
+            {'id': 'n4', 'name': 'Node 4'}
+        ]
+        response = self.app.post('/api/add_nodes_bulk',
+                               data=json.dumps(nodes),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertEqual([error['index'] for error in data['errors']], [1, 2, 3])
+        self.assertEqual(len(G.nodes()), 0)
+        
+        G.add_node('n1', name='Node 1', type='activity')
+        edges = [
+            {'source': 'Node 1', 'target': 'Node 1', 'relationship': 'causes'},
+            {'source': 'Node 1', 'target': 'Missing', 'relationship': 'causes'}
+        ]
+        response = self.app.post('/api/add_edges_bulk',
+                               data=json.dumps({'edges': edges}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        data = json.loads(response.data)
+        self.assertEqual([error['index'] for error in data['errors']], [1])
+        self.assertEqual(len(G.edges()), 0)
+        
+        response = self.app.post('/api/add_edges_bulk',
+                               data=json.dumps({'items': []}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_upload_csv_in_chunks(self):
+        """Test that chunked CSV ingestion gives the same graph as a single pass"""
+        rows = [
+            {'source': 'Activity %d' % (i % 7), 'source_type': 'activity',
+             'target': 'Factor %d' % (i % 5), 'target_type': 'factor', 'relation': 'causes'}
+            for i in range(35)
+        ]
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False) as f:
+            pd.DataFrame(rows).to_csv(f, index=False)
+            temp_file_path = f.name
+        
+        original_chunk_rows = knowledge_graph_app.UPLOAD_CHUNK_ROWS
+        knowledge_graph_app.UPLOAD_CHUNK_ROWS = 4
+        try:
+            with open(temp_file_path, 'rb') as f:
+                response = self.app.post('/api/upload_data',
+                                       data={'file': (f, 'test.csv')},
+                                       content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(G.nodes()), 12)
+            self.assertEqual(len(G.edges()), 35)
+            self.assertEqual(G.nodes['activity_Activity_3'], {'type': 'activity', 'name': 'Activity 3'})
+            self.assertEqual(G.node_id_for_name('Factor 4'), 'factor_Factor_4')
+        finally:
+            knowledge_graph_app.UPLOAD_CHUNK_ROWS = original_chunk_rows
+            os.unlink(temp_file_path)
+    
+    def test_upload_tabular_validation(self):
+        """Test column-wise validation of tabular uploads"""
+        rows = [
+            {'source': 'Activity 1', 'source_type': 'activity',
+             'target': 'Factor 1', 'target_type': 'factor', 'relation': 'causes'},
+            {'source': 'Activity 2', 'source_type': 'activity',
+             'target': 'Factor 2', 'target_type': 'impact', 'relation': 'causes'},
+            {'source': 'Activity 3', 'source_type': 'activity',
+             'target': 'Factor 3', 'target_type': 'factor', 'relation': 'leads to'}
+        ]
+        response = self.app.post('/api/upload_data',
+                               data={'file': (io.BytesIO(json.dumps(rows).encode('utf-8')), 'test.json')},
+                               content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid node type in rows 2', json.loads(response.data)['error'])
+        
+        with self.assertRaises(ValueError) as context:
+            ingest.validate_edge_frame(pd.DataFrame(rows[2:]), NODE_TYPES, RELATIONSHIP_TYPES)
+        self.assertIn('Invalid relationship type', str(context.exception))
+        
+        with self.assertRaises(ValueError) as context:
+            ingest.validate_edge_frame(pd.DataFrame([{'source': 'A'}]), NODE_TYPES, RELATIONSHIP_TYPES)
+        self.assertIn("Missing required field: 'source_type'", str(context.exception))
+
+    def test_upload_invalid_chunk_keeps_graph(self):
+        """Test that a bad row in a later chunk leaves the graph as it was"""
+        self.app.post('/api/load_sample_data')
+        before = (dict(G.nodes(data=True)), set(G.edges()))
+        rows = [
+            {'source': 'Activity %d' % i, 'source_type': 'activity',
+             'target': 'Factor %d' % i, 'target_type': 'factor', 'relation': 'causes'}
+            for i in range(10)
+        ]
+        rows[7]['relation'] = 'melts'
+        original_chunk_rows = knowledge_graph_app.UPLOAD_CHUNK_ROWS
+        knowledge_graph_app.UPLOAD_CHUNK_ROWS = 3
+        try:
+            for filename, payload in [('test.csv', pd.DataFrame(rows).to_csv(index=False)),
+                                      ('test.json', json.dumps(rows))]:
+                response = self.app.post('/api/upload_data',
+                                       data={'file': (io.BytesIO(payload.encode('utf-8')), filename)},
+                                       content_type='multipart/form-data')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('rows 8', json.loads(response.data)['error'])
+                self.assertEqual((dict(G.nodes(data=True)), set(G.edges())), before)
+        finally:
+            knowledge_graph_app.UPLOAD_CHUNK_ROWS = original_chunk_rows
+
+    def test_upload_ndjson_data(self):
+        """Test streaming an NDJSON upload in batches"""
+        with open('sample_data.json', 'r') as f:
+            sample_data = json.load(f)
+        lines = [json.dumps(dict(node, kind='node')) for node in sample_data['nodes']]
+        lines += [json.dumps(dict(edge, kind='edge')) for edge in sample_data['edges']]
+        payload = ('\n'.join(lines) + '\n\n').encode('utf-8')
+        
+        original_batch = knowledge_graph_app.UPLOAD_NDJSON_BATCH
+        knowledge_graph_app.UPLOAD_NDJSON_BATCH = 5
+        try:
+            response = self.app.post('/api/upload_data',
+                                   data={'file': (io.BytesIO(payload), 'graph.ndjson')},
+                                   content_type='multipart/form-data')
+        finally:
+            knowledge_graph_app.UPLOAD_NDJSON_BATCH = original_batch
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['nodes'], len(sample_data['nodes']))
+        self.assertEqual(data['edges'], len(sample_data['edges']))
+        self.assertEqual(len(G.edges()), len(sample_data['edges']))
+        self.assertEqual(G.node_id_for_name('Industrial Manufacturing'), 'activity_1')
+        
+        progress = json.loads(self.app.get('/api/upload_progress').data)
+        self.assertEqual(progress['status'], 'done')
+        self.assertEqual(progress['bytes'], len(payload))
+    
+    def test_upload_ndjson_invalid_line(self):
+        """Test that a bad NDJSON record is reported by line number"""
+        progress = []
+        stream = io.BytesIO(b'{"kind": "node", "id": "a", "type": "activity", "name": "A"}\n'
+                            b'{"kind": "edge", "source": "a", "target": "b", "relationship": "melts"}\n')
+        with self.assertRaises(ValueError) as context:
+            ingest.load_ndjson(G, stream, NODE_TYPES, RELATIONSHIP_TYPES, batch_size=1, progress=progress.append)
+        self.assertIn('Line 2', str(context.exception))
+        self.assertIn('a', G.nodes())
+        self.assertEqual(progress[-1]['nodes'], 1)
+        
+        response = self.app.post('/api/upload_data',
+                               data={'file': (io.BytesIO(b'{"kind": "node"\n'), 'graph.ndjson')},
+                               content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('line 1', json.loads(response.data)['error'])
+        self.assertEqual(json.loads(self.app.get('/api/upload_progress').data)['status'], 'failed')
+
+    def test_upload_ndjson_keeps_graph(self):
+        """Test that a bad NDJSON line or an edge to an unknown node leaves the graph as it was"""
+        self.app.post('/api/load_sample_data')
+        before = (dict(G.nodes(data=True)), set(G.edges()))
+        good = [b'{"kind": "node", "id": "a", "type": "activity", "name": "A"}',
+                b'{"kind": "node", "id": "b", "type": "factor", "name": "B"}',
+                b'{"kind": "edge", "source": "a", "target": "b", "relationship": "causes"}']
+        original_batch = knowledge_graph_app.UPLOAD_NDJSON_BATCH
+        knowledge_graph_app.UPLOAD_NDJSON_BATCH = 1
+        try:
+            for bad, error in [(b'{"kind": "node", "id": "c"', 'line 4'),
+                               (b'{"kind": "edge", "source": "a", "target": "c", "relationship": "causes"}',
+                                'Line 4: Target node "c" not found')]:
+                response = self.app.post('/api/upload_data',
+                                       data={'file': (io.BytesIO(b'\n'.join(good + [bad])), 'graph.ndjson')},
+                                       content_type='multipart/form-data')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(error, json.loads(response.data)['error'])
+                self.assertEqual((dict(G.nodes(data=True)), set(G.edges())), before)
+        finally:
+            knowledge_graph_app.UPLOAD_NDJSON_BATCH = original_batch
+
+    def test_get_graph_delta(self):
+        """Test that get_graph returns only the changes since a version"""
+        self.app.post('/api/load_sample_data')
+        snapshot = json.loads(self.app.get('/api/get_graph').data)
+        self.assertTrue(snapshot['full'])
+        version = snapshot['version']
+        
+        data = json.loads(self.app.get(f'/api/get_graph?since={version}').data)
+        self.assertFalse(data['full'])
+        self.assertEqual(data['nodes'], [])
+        self.assertEqual(data['edges'], [])
+        
+        self.app.post('/api/add_node',
+                     data=json.dumps({'id': 'activity_9', 'name': 'Mining', 'type': 'activity'}),
+                     content_type='application/json')
+        self.app.post('/api/add_edge',
+                     data=json.dumps({'source': 'Mining', 'target': 'Water Pollution', 'relationship': 'causes'}),
+                     content_type='application/json')
+        G.remove_node('activity_2')
+        
+        data = json.loads(self.app.get(f'/api/get_graph?since={version}').data)
+        self.assertFalse(data['full'])
+        self.assertEqual(data['version'], G.version)
+        self.assertEqual([node['id'] for node in data['nodes']], ['activity_9'])
+        self.assertEqual(data['edges'], [{'source': 'activity_9', 'target': 'factor_2', 'relationship': 'causes'}])
+        self.assertEqual(data['removed_nodes'], ['activity_2'])
+        self.assertTrue(all('activity_2' in (edge['source'], edge['target']) for edge in data['removed_edges']))
+        self.assertGreater(len(data['removed_edges']), 0)
+    
+    def test_get_graph_delta_falls_back_to_snapshot(self):
+        """Test that a cleared graph or a truncated log yields a full snapshot"""
+        version = G.version
+        self.app.post('/api/load_sample_data')
+        data = json.loads(self.app.get(f'/api/get_graph?since={version}').data)
+        self.assertTrue(data['full'])
+        self.assertEqual(len(data['nodes']), len(G.nodes()))
+        
+        data = json.loads(self.app.get(f'/api/get_graph?since={G.version + 1}').data)
+        self.assertTrue(data['full'])
+        
+        log = ChangeLog(G, max_items=2)
+        version = G.version
+        G.add_node('x1', name='X1', type='factor')
+        self.assertIsNotNone(log.changes_since(version))
+        G.add_nodes_from([('x2', {'name': 'X2', 'type': 'factor'}), ('x3', {'name': 'X3', 'type': 'factor'})])
+        self.assertIsNone(log.changes_since(version))
+        G.remove_listener(log.record)
+        
+        response = self.app.get('/api/get_graph?since=abc')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_get_graph_etag_and_gzip(self):
+        """Test conditional and compressed get_graph responses"""
+        self.app.post('/api/load_sample_data')
+        # Let the background layout finish so the payload stays put
+        self.app.get('/api/get_graph')
+        knowledge_graph_app.layout_cache.wait()
+        response = self.app.get('/api/get_graph')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        
+        response = self.app.get('/api/get_graph', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        
+        response = self.app.get('/api/get_graph', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        data = json.loads(gzip.decompress(response.data))
+        self.assertEqual(len(data['nodes']), len(G.nodes()))
+        
+        # Any change produces a new ETag
+        G.add_node('activity_9', name='Mining', type='activity')
+        response = self.app.get('/api/get_graph', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn('Mining', [node['name'] for node in json.loads(response.data)['nodes']])
+    
+    def test_graph_payload_cache(self):
+        """Test that the serialized payload is only rebuilt when the version changes"""
+        builds = []
+        cache = GraphPayloadCache(lambda: builds.append(1) or {'nodes': []})
+        body, etag, encoding = cache.get(1)
+        self.assertEqual(json.loads(body), {'nodes': []})
+        self.assertIsNone(encoding)
+        cache.get(1, accept_gzip=True)
+        self.assertEqual(len(builds), 1)
+        _, new_etag, _ = cache.get(2)
+        self.assertEqual(len(builds), 2)
+        self.assertNotEqual(etag, new_etag)
+    
+    def test_csr_snapshot_matches_graph(self):
+        """Test that CSR traversals agree with the networkx graph"""
+        self.app.post('/api/load_sample_data')
+        G.add_node('activity_9', name='Mining', type='activity')
+        G.add_edges_from([('activity_9', 'factor_2'), ('factor_2', 'activity_9')], relationship='causes')
+        snapshot = CSRGraph(G)
+        self.assertEqual(len(snapshot), len(G.nodes()))
+        self.assertEqual(snapshot.edge_count, len(G.edges()))
+        
+        for node_id in G.nodes():
+            source = snapshot.index[node_id]
+            self.assertEqual(set(snapshot.node_ids_at(snapshot.descendants(source))),
+                             nx.descendants(G, node_id))
+            for max_depth, limit in [(None, None), (1, None), (2, 1), (None, 2)]:
+                expected, expected_reached = find_impacts(G, node_id, max_depth=max_depth, limit=limit)
+                impacts, reached = snapshot.impacts(node_id, max_depth=max_depth, limit=limit)
+                self.assertEqual(impacts, expected)
+                self.assertTrue(expected_reached <= reached)
+        
+        relationship = snapshot.relations[snapshot.indptr[snapshot.index['activity_9']]]
+        self.assertEqual(snapshot.relationship_names[relationship], 'causes')
+    
+    def test_csr_snapshot_rebuild(self):
+        """Test that the CSR snapshot is rebuilt lazily after mutations"""
+        manager = CSRSnapshot(G, min_interval=0)
+        G.add_node('a', name='A', type='activity')
+        first = manager.current()
+        self.assertIs(manager.current(), first)
+        G.add_node('c', name='C', type='consequence')
+        G.add_edge('a', 'c', relationship='causes')
+        second = manager.current()
+        self.assertIsNot(second, first)
+        self.assertEqual(second.impacts('a')[0], [{'consequence': 'C', 'path': ['A', 'C']}])
+        self.assertEqual(manager.rebuilds, 2)
+        
+        # Inside the rebuild interval a stale snapshot is not served at all
+        manager.min_interval = 3600
+        G.add_node('b', name='B', type='factor')
+        self.assertIsNone(manager.current())
+        
+        # unless the caller forces a rebuild, which is then kept for the version
+        forced = manager.current(force=True)
+        self.assertEqual(forced.version, G.version)
+        self.assertIs(manager.current(), forced)
+        self.assertIs(manager.current(force=True), forced)
+        self.assertEqual(manager.rebuilds, 3)
+
+    def test_csr_search_buffers(self):
+        """Test that searches reuse one scratch buffer without clearing it"""
+        self.app.post('/api/load_sample_data')
+        snapshot = CSRGraph(G)
+        expected = {node_id: snapshot.impacts(node_id) for node_id in G.nodes()}
+        self.assertEqual(len(snapshot._search_buffers._free), 1)
+        buffer = snapshot._search_buffers._free[0]
+
+        # Results stay the same over many reuses and across the generation wrapping around
+        buffer.generation = np.iinfo(np.uint32).max - 2
+        for _ in range(2):
+            for node_id in G.nodes():
+                self.assertEqual(snapshot.impacts(node_id), expected[node_id])
+        self.assertLess(buffer.generation, 100)
+        self.assertIs(snapshot._search_buffers._free[0], buffer)
+
+    def test_journal_recovery(self):
+        """Test that a graph is rebuilt from its write-ahead log"""
+        with tempfile.TemporaryDirectory() as directory:
+            graph = KnowledgeGraph()
+            journal = GraphJournal(graph, directory, flush_interval=0.001)
+            journal.recover()
+            journal.start()
+            graph.add_nodes_from([('a', {'name': 'A', 'type': 'activity'}),
+                                  ('f', {'name': 'F', 'type': 'factor'}),
+                                  ('c', {'name': 'C', 'type': 'consequence'})])
+            graph.add_edge('a', 'f', relationship='causes')
+            graph.add_edge('f', 'c', relationship='contributes_to')
+            graph.add_node('a', name='A2', type='activity')
+            graph.remove_edge('f', 'c')
+            self.assertTrue(journal.commit(timeout=5))
+            journal.close()
+            
+            recovered = KnowledgeGraph()
+            replayed = GraphJournal(recovered, directory).recover()
+            self.assertGreater(replayed, 0)
+            self.assertEqual(self._graph_state(recovered), self._graph_state(graph))
+            self.assertEqual(recovered.version, graph.version)
+            self.assertEqual(recovered.node_id_for_name('A2'), 'a')
+            
+            # A torn final line from a crash is ignored
+            wal_path = os.path.join(directory, sorted(os.listdir(directory))[-1])
+            with open(wal_path, 'a') as f:
+                f.write('{"v": 99, "op": "add_nod')
+            recovered = KnowledgeGraph()
+            GraphJournal(recovered, directory).recover()
+            self.assertEqual(self._graph_state(recovered), self._graph_state(graph))
+    
+    def test_journal_snapshot_compaction(self):
+        """Test that snapshots replace older log segments and recover correctly"""
+        with tempfile.TemporaryDirectory() as directory:
+            graph = KnowledgeGraph()
+            lock = ReadWriteLock()
+            journal = GraphJournal(graph, directory, flush_interval=0.001, snapshot_every=5, lock=lock)
+            journal.start()
+            with lock.write():
+                for i in range(12):
+                    graph.add_node(f'n{i}', name=f'Node {i}', type='factor')
+                # The snapshot that came due is taken only once the write is over
+                self.assertTrue(journal.stats()['snapshot_due'])
+                self.assertEqual(journal.snapshots, 0)
+            with lock.write():
+                graph.clear()
+                graph.add_node('x', name='X', type='activity')
+                graph.add_edge('x', 'y', relationship='causes')
+            journal.commit(timeout=5)
+            deadline = time.monotonic() + 5
+            while journal.stats()['snapshot_due'] and time.monotonic() < deadline:
+                time.sleep(0.01)
+            journal.close()
+            
+            self.assertGreater(journal.snapshots, 0)
+            self.assertLessEqual(journal.snapshots, 2)
+            snapshots = [f for f in os.listdir(directory) if f.startswith('snapshot-')]
+            self.assertEqual(len(snapshots), 1)
+            
+            recovered = KnowledgeGraph()
+            GraphJournal(recovered, directory).recover()
+            self.assertEqual(self._graph_state(recovered), self._graph_state(graph))
+        
+        response = self.app.post('/api/snapshot')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_binary_snapshot_round_trip(self):
+        """Test exporting, mapping and re-uploading a binary snapshot"""
+        self.app.post('/api/load_sample_data')
+        expected = self._graph_state(G)
+        response = self.app.get('/api/export_snapshot')
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.kgs')
+            with open(path, 'wb') as f:
+                f.write(data)
+            snapshot = MappedSnapshot(path, verify=True)
+            try:
+                self.assertEqual(snapshot.node_count, len(G.nodes()))
+                self.assertEqual(snapshot.edge_count, len(G.edges()))
+                self.assertEqual(snapshot.node_name(0), G.nodes[snapshot.node_id(0)]['name'])
+                csr = snapshot.to_csr()
+                self.assertEqual(csr.impacts('activity_1')[0], find_impacts(G, 'activity_1')[0])
+                del csr
+            finally:
+                snapshot.close()
+        
+        G.clear()
+        response = self.app.post('/api/upload_data',
+                               data={'file': (io.BytesIO(data), 'graph.kgs')},
+                               content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._graph_state(G), expected)
+    
+    def test_binary_snapshot_checksum(self):
+        """Test that corrupted or foreign files are rejected"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sample.kgs')
+            nodes, edges, _ = convert_json('sample_data.json', path)
+            with open(path, 'rb') as f:
+                data = bytearray(f.read())
+        self.assertEqual(BinarySnapshot(bytes(data), verify=True).node_count, nodes)
+        
+        data[-1] ^= 0xFF
+        with self.assertRaises(ValueError):
+            BinarySnapshot(bytes(data), verify=True)
+        response = self.app.post('/api/upload_data',
+                               data={'file': (io.BytesIO(bytes(data)), 'graph.kgs')},
+                               content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(ValueError):
+            BinarySnapshot(b'not a snapshot' * 8)
+
+    def test_load_snapshot_file(self):
+        """Test loading a snapshot file at startup and serving traversals from its mapped arrays"""
+        rebuilds = knowledge_graph_app.csr_snapshot.rebuilds
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sample.kgs')
+            convert_json('sample_data.json', path)
+            knowledge_graph_app.load_snapshot_file(path)
+        # Reads are answered while G may still be building
+        data = json.loads(self.app.get('/api/get_graph').data)
+        self.assertEqual(len(data['nodes']), 12)
+        data = json.loads(self.app.get('/api/query_impacts?source=Deforestation').data)
+        self.assertIn('Biodiversity Loss', [impact['consequence'] for impact in data])
+        
+        self.assertTrue(knowledge_graph_app.graph_ready.wait(5))
+        self.assertIsNone(knowledge_graph_app.mapped_csr)
+        self.assertEqual(len(G.nodes()), 12)
+        self.assertEqual(G.nodes['activity_2']['name'], 'Deforestation')
+        
+        csr = knowledge_graph_app.csr_snapshot.current()
+        self.assertTrue(np.shares_memory(csr.indptr, knowledge_graph_app.mapped_snapshot.indptr))
+        self.assertEqual(csr.version, G.version)
+        data = json.loads(self.app.get('/api/impact_paths?source=Deforestation').data)
+        self.assertEqual(data['results'][0]['consequence'], 'Biodiversity Loss')
+        self.assertEqual(knowledge_graph_app.csr_snapshot.rebuilds, rebuilds)
+
+    def test_binary_snapshot_exact_round_trip(self):
+        """Test that id types, explicit 1.0 weights and missing types survive a snapshot"""
+        graph = KnowledgeGraph()
+        graph.add_nodes_from([(1, {'name': 'One', 'type': 'activity'}),
+                              ('1', {'name': 'String one', 'type': 'factor'}),
+                              ('untyped', {'name': 'Untyped'})])
+        graph.add_edges_from([(1, '1', {'relationship': 'causes', 'weight': 1.0}),
+                              ('1', 'untyped', {'relationship': 'affects'}),
+                              ('untyped', 1, {'weight': 0.5})])
+        snapshot = BinarySnapshot(encode_csr(CSRGraph(graph)), verify=True)
+        loaded = KnowledgeGraph()
+        snapshot.load_into(loaded)
+        self.assertEqual(self._graph_state(loaded), self._graph_state(graph))
+        self.assertEqual([type(n) for n in loaded.nodes()], [int, str, str])
+        csr = snapshot.to_csr()
+        self.assertEqual(csr.node_ids.tolist(), [1, '1', 'untyped'])
+        self.assertEqual(csr.weight_set.tolist(), [True, False, True])
+
+        # Graphs the format cannot hold exactly are refused rather than changed
+        for node, attrs in [(('a', 'b'), {'name': 'Tuple'}),
+                            ('empty', {'name': 'Empty', 'type': ''}),
+                            ('extra', {'name': 'Extra', 'colour': 'red'}),
+                            ('unnamed', {})]:
+            unsupported = KnowledgeGraph()
+            unsupported.add_nodes_from([(node, attrs)])
+            with tempfile.TemporaryDirectory() as directory:
+                with self.assertRaises(ValueError):
+                    write_snapshot(unsupported, os.path.join(directory, 'graph.kgs'))
+
+        G.add_node('extra', name='Extra', colour='red')
+        response = self.app.get('/api/export_snapshot')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('colour', json.loads(response.data)['error'])
+
+    def test_read_write_lock(self):
+        """Test that readers share the lock, writers exclude everyone and waiting writers go first"""
+        lock = ReadWriteLock()
+        both_reading = threading.Barrier(2, timeout=5)
+        
+        def reader():
+            with lock.read():
+                both_reading.wait()  # only passes if two readers hold the lock together
+        threads = [threading.Thread(target=reader) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        order = []
+        lock.acquire_read()
+        writer = threading.Thread(target=lambda: (lock.acquire_write(), order.append('writer'), lock.release_write()))
+        writer.start()
+        while not lock.stats()['waiting_writers']:
+            threading.Event().wait(0.001)
+        late_reader = threading.Thread(target=lambda: (lock.acquire_read(), order.append('reader'), lock.release_read()))
+        late_reader.start()
+        threading.Event().wait(0.05)
+        self.assertEqual(order, [])  # the writer waits for the first reader, the late reader for the writer
+        lock.release_read()
+        writer.join(5)
+        late_reader.join(5)
+        self.assertEqual(order, ['writer', 'reader'])
+        self.assertEqual(lock.stats(), {'readers': 0, 'writer': False, 'waiting_writers': 0})
+    
+    def test_concurrent_reads_and_writes(self):
+        """Stress test: readers always see a consistent graph while writers add to it"""
+        self.app.post('/api/add_node', json={'id': 'hub', 'type': 'activity', 'name': 'Hub'})
+        writers, readers, rounds = 4, 4, 50
+        errors = []
+        done = threading.Event()
+        # Switch threads far more often than usual so interleavings actually happen
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, switch_interval)
+        
+        def write(w):
+            client = app.test_client()
+            for i in range(rounds):
+                node_id = f'c_{w}_{i}'
+                response = client.post('/api/add_nodes_bulk', json=[
+                    {'id': node_id, 'type': 'consequence', 'name': f'Consequence {w} {i}'}])
+                if response.status_code != 200:
+                    errors.append(('add_nodes_bulk', response.status_code))
+                response = client.post('/api/add_edges_bulk', json={'match': 'id', 'edges': [
+                    {'source': 'hub', 'target': node_id, 'relationship': 'causes'}]})
+                if response.status_code != 200:
+                    errors.append(('add_edges_bulk', response.status_code))
+        
+        def read():
+            client = app.test_client()
+            last_version, last_impacts = -1, 0
+            while not done.is_set():
+                response = client.get('/api/get_graph')
+                if response.status_code != 200:
+                    errors.append(('get_graph', response.status_code))
+                    continue
+                data = json.loads(response.data)
+                node_ids = {node['id'] for node in data['nodes']}
+                if any(edge['source'] not in node_ids or edge['target'] not in node_ids for edge in data['edges']):
+                    errors.append(('get_graph', 'dangling edge'))
+                if data['version'] < last_version:
+                    errors.append(('get_graph', 'version went backwards'))
+                last_version = data['version']
+                
+                response = client.get('/api/query_impacts?source=Hub')
+                if response.status_code != 200:
+                    errors.append(('query_impacts', response.status_code))
+                    continue
+                impacts = len(json.loads(response.data))
+                if impacts < last_impacts:
+                    errors.append(('query_impacts', 'impacts went backwards'))
+                last_impacts = impacts
+        
+        reader_threads = [threading.Thread(target=read) for _ in range(readers)]
+        writer_threads = [threading.Thread(target=write, args=(w,)) for w in range(writers)]
+        for thread in reader_threads + writer_threads:
+            thread.start()
+        for thread in writer_threads:
+            thread.join()
+        done.set()
+        for thread in reader_threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        self.assertEqual(len(G.nodes()), 1 + writers * rounds)
+        self.assertEqual(len(G.edges()), writers * rounds)
+        response = self.app.get('/api/query_impacts?source=Hub')
+        self.assertEqual(len(json.loads(response.data)), writers * rounds)
+
+    def test_upload_loads_outside_write_lock(self):
+        """Test that an upload is received and loaded while readers hold the lock, which it only takes to swap"""
+        lines = [b'{"kind": "node", "id": "a", "type": "activity", "name": "A"}',
+                 b'{"kind": "node", "id": "b", "type": "factor", "name": "B"}',
+                 b'{"kind": "edge", "source": "a", "target": "b", "relationship": "causes"}']
+        responses = []
+        upload = threading.Thread(target=lambda: responses.append(app.test_client().post(
+            '/api/upload_data', data={'file': (io.BytesIO(b'\n'.join(lines)), 'graph.ndjson')},
+            content_type='multipart/form-data')))
+        with knowledge_graph_app.graph_lock.read():
+            upload.start()
+            for _ in range(500):
+                if knowledge_graph_app.upload_progress.get('status') == 'done':
+                    break
+                threading.Event().wait(0.01)
+            self.assertEqual(knowledge_graph_app.upload_progress['status'], 'done')
+            self.assertEqual(len(G), 0)  # loaded, but waiting for the lock to swap in
+        upload.join(5)
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(set(G.edges()), {('a', 'b')})
+
+    def test_shared_snapshot_publish_and_swap(self):
+        """Test that a reader follows the versions a publisher writes to shared memory"""
+        name = f'kg-test-{os.getpid()}'
+        graph = KnowledgeGraph()
+        graph.add_node('a', name='A', type='activity')
+        reader = SnapshotReader(name)
+        self.assertIsNone(reader.current())  # nothing published yet
+        publisher = SnapshotPublisher(graph, name)
+        try:
+            publisher.publish()
+            first = reader.current()
+            self.assertEqual((first.version, len(first)), (graph.version, 1))
+            self.assertIs(reader.current(), first)  # unchanged version, no re-attach
+            
+            graph.add_node('c', name='C', type='consequence')
+            graph.add_edge('a', 'c', relationship='causes')
+            publisher.publish()
+            second = reader.current()
+            self.assertEqual(second.version, graph.version)
+            self.assertEqual(second.impacts(second.node_id_for_name('A')), find_impacts(graph, 'a'))
+            
+            for _ in range(3):  # older segments are unlinked once enough newer ones exist
+                graph.add_node('x', name=f'X{graph.version}', type='factor')
+                publisher.publish()
+            self.assertEqual(reader.current().version, graph.version)
+            self.assertEqual(len(publisher._segments), publisher.keep)
+            del first, second
+        finally:
+            reader.close()
+            publisher.close()
+    
+    def test_shared_snapshot_reader_follows_in_background(self):
+        """Test that a started reader swaps snapshots on its own thread and decodes strings lazily"""
+        name = f'kg-test-follow-{os.getpid()}'
+        graph = KnowledgeGraph()
+        graph.add_nodes_from([(1, {'name': 'One', 'type': 'activity'}), ('two', {'name': 'Two', 'type': 'consequence'})])
+        graph.add_edge(1, 'two', relationship='causes')
+        publisher = SnapshotPublisher(graph, name)
+        reader = SnapshotReader(name, interval=0.01)
+        
+        def newest(version):
+            for _ in range(500):
+                csr = reader.current()
+                if csr is not None and csr.version == version:
+                    return csr
+                threading.Event().wait(0.01)
+            self.fail(f'reader never attached version {version}')
+        try:
+            publisher.publish()
+            reader.start()
+            csr = newest(graph.version)
+            self.assertIsInstance(csr.names, SnapshotStrings)
+            self.assertEqual(csr.names[[1, 0]].tolist(), ['Two', 'One'])
+            self.assertEqual((csr.names == 'Two').tolist(), [False, True])
+            self.assertEqual(csr.node_ids.tolist(), [1, 'two'])
+            self.assertEqual(csr.impacts(1), find_impacts(graph, 1))
+            
+            graph.add_node('three', name='Three', type='factor')
+            publisher.publish()
+            self.assertEqual(len(newest(graph.version)), 3)
+            del csr
+        finally:
+            reader.close()
+            publisher.close()
+
+    def test_shared_snapshot_reader_worker(self):
+        """Test that a reader worker serves reads from the shared snapshot and refuses writes"""
+        self.app.post('/api/load_sample_data')
+        self.app.get('/api/get_graph')
+        knowledge_graph_app.layout_cache.wait()
+        expected = json.loads(self.app.get('/api/get_graph').data)
+        expected_impacts = json.loads(self.app.get('/api/query_impacts?source=Industrial Manufacturing').data)
+        self.assertGreater(len(expected_impacts), 0)
+        name = f'kg-test-worker-{os.getpid()}'
+        publisher = SnapshotPublisher(G, name)
+        publisher.publish()
+        knowledge_graph_app.shared_reader = SnapshotReader(name)
+        try:
+            G.clear()  # a reader worker's own graph stays empty
+            data = json.loads(self.app.get('/api/get_graph').data)
+            self.assertEqual(data['version'], expected['version'])
+            self.assertEqual(sorted(map(str, data['nodes'])), sorted(map(str, expected['nodes'])))
+            self.assertEqual(sorted(map(str, data['edges'])), sorted(map(str, expected['edges'])))
+            response = self.app.get('/api/query_impacts?source=Industrial Manufacturing')
+            self.assertEqual(json.loads(response.data), expected_impacts)
+            
+            response = self.app.post('/api/add_node', json={'id': 'n', 'type': 'activity', 'name': 'N'})
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(len(G.nodes()), 0)
+        finally:
+            knowledge_graph_app.shared_reader.close()
+            knowledge_graph_app.shared_reader = None
+            publisher.close()
+
+    def test_jobs_query_impacts(self):
+        """Test running an impact query as a background job"""
+        self.app.post('/api/load_sample_data')
+        expected = json.loads(self.app.get('/api/query_impacts?source=Industrial Manufacturing').data)
+        
+        response = self.app.post('/api/jobs', json={'type': 'query_impacts', 'source': 'Industrial Manufacturing'})
+        self.assertEqual(response.status_code, 202)
+        job = json.loads(response.data)
+        self.assertEqual(response.headers['Location'], f"/api/jobs/{job['id']}")
+        
+        response = self.app.get(f"/api/jobs/{job['id']}/result?wait=5")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), expected)
+        response = self.app.get(f"/api/jobs/{job['id']}/result?format=ndjson")
+        self.assertEqual([json.loads(line) for line in response.data.splitlines()], expected)
+        
+        # The same query on the same graph version reuses the finished job
+        response = self.app.post('/api/jobs', json={'source': 'Industrial Manufacturing'})
+        again = json.loads(response.data)
+        self.assertEqual((again['id'], again['deduplicated'], again['status']), (job['id'], True, 'done'))
+        self.assertIn(job['id'], [j['id'] for j in json.loads(self.app.get('/api/jobs').data)['jobs']])
+        
+        self.assertEqual(self.app.post('/api/jobs', json={'source': 'Nowhere'}).status_code, 404)
+        self.assertEqual(self.app.post('/api/jobs', json={'type': 'layout', 'source': 'X'}).status_code, 400)
+        self.assertEqual(self.app.get('/api/jobs/unknown').status_code, 404)
+    
+    def test_jobs_upload(self):
+        """Test uploading data through a background job"""
+        with open('sample_data.json', 'rb') as f:
+            content = f.read()
+        response = self.app.post('/api/jobs', data={'file': (io.BytesIO(content), 'sample.json')},
+                                 content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 202)
+        job = json.loads(self.app.get(f"/api/jobs/{json.loads(response.data)['id']}?wait=5").data)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(len(G.nodes()), len(json.loads(content)['nodes']))
+        
+        response = self.app.post('/api/jobs', data={'file': (io.BytesIO(b'{"nodes": ['), 'broken.json')},
+                                 content_type='multipart/form-data')
+        job_id = json.loads(response.data)['id']
+        response = self.app.get(f'/api/jobs/{job_id}/result?wait=5')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.data)['status'], 'failed')
+    
+    def test_job_manager_cancel_and_limits(self):
+        """Test job cancellation, the pending limit and result expiry"""
+        manager = JobManager(max_workers=1, max_pending=2, result_ttl=60)
+        started, release = threading.Event(), threading.Event()
+        
+        def blocking(job):
+            started.set()
+            while not release.wait(0.01):
+                job.check()
+            return 'finished'
+        running, _ = manager.submit('test', 'a', {}, blocking)
+        self.assertTrue(started.wait(5))
+        queued, _ = manager.submit('test', 'b', {}, lambda job: 'b')
+        self.assertEqual(manager.submit('test', 'a', {}, blocking), (running, True))
+        with self.assertRaises(JobQueueFull):
+            manager.submit('test', 'c', {}, lambda job: 'c')
+        
+        self.assertEqual(manager.cancel(queued.id).status, 'cancelled')  # never starts
+        manager.cancel(running.id)  # stops at its next check()
+        self.assertTrue(running.wait(5))
+        self.assertEqual(running.status, 'cancelled')
+        
+        # Cancelled jobs are not reused; a resubmission runs again
+        job, deduplicated = manager.submit('test', 'a', {}, lambda job: 'again')
+        self.assertFalse(deduplicated)
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.result, 'again')
+        
+        manager.result_ttl = 0
+        self.assertEqual(manager.list(), [])
+        self.assertEqual((manager.stats()['submitted'], manager.stats()['deduplicated']), (3, 1))
+        manager.shutdown()
+
+    def test_multi_source_impacts(self):
+        """Test that the shared multi-source traversal agrees with per-source searches"""
+        rng = random.Random(7)
+        graph = KnowledgeGraph()
+        types = list(NODE_TYPES)
+        graph.add_nodes_from((i, {'name': f'N{i}', 'type': types[i % 4]}) for i in range(300))
+        graph.add_edges_from((rng.randrange(300), rng.randrange(300), {'relationship': 'causes'}) for _ in range(700))
+        snapshot = CSRGraph(graph)
+        sources = list(range(0, 300, 3))  # more than 64, so several bit chunks
+        
+        for max_depth, limit in [(None, None), (2, None), (None, 3), (3, 2), (None, 0)]:
+            results = snapshot.multi_impacts(sources, max_depth=max_depth, limit=limit)
+            self.assertEqual(set(results), set(sources))
+            for source in sources:
+                impacts, reached = results[source]
+                expected, expected_reached = snapshot.impacts(source, max_depth=max_depth, limit=limit)
+                if limit is None:
+                    self._assert_same_impacts(graph, source, impacts, expected)
+                    self.assertEqual(reached, expected_reached)
+                else:
+                    # Ties at the cut-off level may pick different consequences
+                    self.assertEqual([len(i['path']) for i in impacts], [len(i['path']) for i in expected])
+        
+        results = snapshot.multi_impacts(sources, target_type='missing')
+        self.assertTrue(all(impacts == [] for impacts, _ in results.values()))
+    
+    def test_query_impacts_batch(self):
+        """Test the batch impact endpoint against individual queries"""
+        self.app.post('/api/load_sample_data')
+        names = [attrs['name'] for _, attrs in G.nodes(data=True) if attrs['type'] == 'activity']
+        response = self.app.post('/api/query_impacts_batch', json={'sources': names + ['Nowhere', names[0]]})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(sorted(data['results']), sorted(names))
+        self.assertEqual(data['not_found'], ['Nowhere'])
+        for name in names:
+            expected = json.loads(self.app.get(f'/api/query_impacts?source={name}').data)
+            self._assert_same_impacts(G, G.node_id_for_name(name), data['results'][name], expected)
+        
+        # Now every source is answered from the impact cache
+        hits = impact_cache.hits
+        response = self.app.post('/api/query_impacts_batch', json={'sources': names, 'max_depth': 2})
+        limited = json.loads(response.data)['results']
+        self.assertTrue(all(len(i['path']) <= 3 for impacts in limited.values() for i in impacts))
+        self.app.post('/api/query_impacts_batch', json={'sources': names, 'max_depth': 2})
+        self.assertEqual(impact_cache.hits - hits, len(names))
+        
+        self.assertEqual(self.app.post('/api/query_impacts_batch', json={'sources': 'x'}).status_code, 400)
+        self.assertEqual(self.app.post('/api/query_impacts_batch', json={'sources': [1]}).status_code, 400)
+        self.assertEqual(self.app.post('/api/query_impacts_batch', json={'sources': [], 'limit': -1}).status_code, 400)
+
+    def test_edge_weights(self):
+        """Test that edge weights are validated and kept by every write path"""
+        for node_id, node_type, name in [('a', 'activity', 'Mining'), ('f', 'factor', 'Dust'),
+                                         ('c', 'consequence', 'Asthma')]:
+            self.app.post('/api/add_node', json={'id': node_id, 'type': node_type, 'name': name})
+        response = self.app.post('/api/add_edge', json={'source': 'Mining', 'target': 'Dust',
+                                                        'relationship': 'causes', 'weight': 0.5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(G.edges['a', 'f'], {'relationship': 'causes', 'weight': 0.5})
+        for weight in [-1, 'heavy', True, float('inf')]:
+            response = self.app.post('/api/add_edge', json={'source': 'Dust', 'target': 'Asthma',
+                                                            'relationship': 'causes', 'weight': weight})
+            self.assertEqual(response.status_code, 400)
+        self.app.post('/api/add_edges_bulk', json=[{'source': 'Dust', 'target': 'Asthma', 'relationship': 'causes'}])
+        self.assertEqual(G.edges['f', 'c'], {'relationship': 'causes'})
+        edges = json.loads(self.app.get('/api/get_graph').data)['edges']
+        self.assertEqual(sorted(edge.get('weight', 1) for edge in edges), [0.5, 1])
+
+        # Snapshots keep weights, and unweighted edges stay unweighted
+        graph = KnowledgeGraph()
+        BinarySnapshot(encode_csr(CSRGraph(G))).load_into(graph)
+        self.assertEqual(self._graph_state(graph), self._graph_state(G))
+
+        # Tabular uploads take an optional weight column; blank cells mean no weight
+        csv = (b'source,source_type,target,target_type,relation,weight\n'
+               b'Mining,activity,Dust,factor,causes,2\n'
+               b'Dust,factor,Asthma,consequence,causes,\n')
+        response = self.app.post('/api/upload_data', data={'file': (io.BytesIO(csv), 'test.csv')},
+                                 content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(G.edges['activity_Mining', 'factor_Dust']['weight'], 2.0)
+        self.assertNotIn('weight', G.edges['factor_Dust', 'consequence_Asthma'])
+        response = self.app.post('/api/upload_data', data={'file': (io.BytesIO(csv.replace(b',2\n', b',-2\n')), 'test.csv')},
+                                 content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid weight in rows 1', json.loads(response.data)['error'])
+
+        ndjson = (b'{"kind": "node", "id": "a", "type": "activity", "name": "Mining"}\n'
+                  b'{"kind": "node", "id": "c", "type": "consequence", "name": "Asthma"}\n'
+                  b'{"kind": "edge", "source": "a", "target": "c", "relationship": "causes", "weight": 0.25}\n')
+        response = self.app.post('/api/upload_data', data={'file': (io.BytesIO(ndjson), 'test.ndjson')},
+                                 content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(G.edges['a', 'c']['weight'], 0.25)
+
+        # A bad weight or record anywhere in a nodes/edges JSON upload leaves the graph as it was
+        before = self._graph_state(G)
+        nodes = [{'id': 'x', 'type': 'activity', 'name': 'X'}, {'id': 'y', 'type': 'factor', 'name': 'Y'}]
+        edge = {'source': 'x', 'target': 'y', 'relationship': 'causes', 'weight': 1}
+        for bad_nodes, bad_edge, error in [
+                (nodes, {'source': 'y', 'target': 'x', 'relationship': 'causes', 'weight': -1}, 'Edge 1'),
+                (nodes + [{'id': 'z', 'name': 'Z'}], edge, 'Node 2: Missing required fields'),
+                (nodes + [{'id': 'z', 'type': 'planet', 'name': 'Z'}], edge, 'Node 2: Invalid node type'),
+                (nodes + [['z']], edge, 'Node 2: Record must be an object'),
+                (nodes, {'source': 'y', 'relationship': 'causes'}, 'Edge 1: Missing required fields'),
+                (nodes, {'source': 'y', 'target': 'x', 'relationship': 'likes'}, 'Edge 1: Invalid relationship'),
+                (nodes, {'source': 'y', 'target': 'w', 'relationship': 'causes'}, 'Edge 1: Target node "w" not found')]:
+            graph_json = json.dumps({'nodes': bad_nodes, 'edges': [edge, bad_edge]})
+            response = self.app.post('/api/upload_data', data={'file': (io.BytesIO(graph_json.encode()), 'test.json')},
+                                     content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(error, json.loads(response.data)['error'])
+            self.assertEqual(self._graph_state(G), before)
+
+    def test_impact_scores(self):
+        """Test weighted impact scores against hand-computed sums"""
+        G.add_nodes_from([('a', {'type': 'activity', 'name': 'A'}), ('b', {'type': 'activity', 'name': 'B'}),
+                          ('f', {'type': 'factor', 'name': 'F'}), ('g', {'type': 'factor', 'name': 'G'}),
+                          ('c', {'type': 'consequence', 'name': 'C'}), ('d', {'type': 'consequence', 'name': 'D'})])
+        G.add_edges_from([('a', 'f', {'relationship': 'causes', 'weight': 0.5}),
+                          ('a', 'g', {'relationship': 'causes', 'weight': 2.0}),
+                          ('f', 'c', {'relationship': 'causes', 'weight': 4.0}),
+                          ('g', 'c', {'relationship': 'causes'}),
+                          ('g', 'd', {'relationship': 'causes', 'weight': 0.1}),
+                          ('c', 'd', {'relationship': 'causes', 'weight': 0.5}),
+                          ('b', 'd', {'relationship': 'causes', 'weight': 3.0})])
+
+        # Every activity: C = 0.5*4 + 2*1, D = 2*0.1 + C*0.5
+        data = json.loads(self.app.get('/api/impact_scores').data)
+        self.assertEqual(sorted(data['results']), ['A', 'B'])
+        scores = {r['consequence']: r['score'] for r in data['results']['A']}
+        self.assertAlmostEqual(scores['C'], 4.0)
+        self.assertAlmostEqual(scores['D'], 2.2)
+        self.assertEqual([r['consequence'] for r in data['results']['A']], ['C', 'D'])
+        self.assertEqual(data['results']['B'], [{'consequence': 'D', 'score': 3.0}])
+
+        # Depth bounds the walks and damping scales each further hop
+        response = self.app.get('/api/impact_scores?source=A&source=Nowhere&max_depth=2&damping=0.5&k=1')
+        data = json.loads(response.data)
+        self.assertEqual(data['not_found'], ['Nowhere'])
+        self.assertEqual(len(data['results']['A']), 1)
+        self.assertEqual(data['results']['A'][0]['consequence'], 'C')
+        self.assertAlmostEqual(data['results']['A'][0]['score'], 2.0)
+
+        for query in ['k=0', 'max_depth=0', 'damping=0', 'damping=2', 'damping=x']:
+            self.assertEqual(self.app.get(f'/api/impact_scores?{query}').status_code, 400)
+
+    def test_subgraph(self):
+        """Test k-hop neighborhood extraction with filters and a node budget"""
+        G.add_nodes_from([('a', {'type': 'activity', 'name': 'A'}), ('f', {'type': 'factor', 'name': 'F'}),
+                          ('g', {'type': 'factor', 'name': 'G'}), ('l', {'type': 'location', 'name': 'L'}),
+                          ('c', {'type': 'consequence', 'name': 'C'}), ('d', {'type': 'consequence', 'name': 'D'})])
+        G.add_edges_from([('a', 'f', {'relationship': 'causes'}), ('a', 'g', {'relationship': 'causes'}),
+                          ('a', 'l', {'relationship': 'occurs_in'}), ('f', 'c', {'relationship': 'affects'}),
+                          ('g', 'c', {'relationship': 'causes', 'weight': 0.5}), ('c', 'd', {'relationship': 'impacts'})])
+
+        def subgraph(query):
+            response = self.app.get(f'/api/subgraph?{query}')
+            self.assertEqual(response.status_code, 200)
+            return json.loads(response.data)
+
+        data = subgraph('node=F')
+        self.assertEqual(sorted(n['id'] for n in data['nodes']), ['a', 'c', 'f'])
+        self.assertEqual(sorted((e['source'], e['target']) for e in data['edges']), [('a', 'f'), ('f', 'c')])
+        self.assertEqual({n['id']: n['hidden'] for n in data['nodes']}, {'a': 2, 'c': 2, 'f': 0})
+        self.assertFalse(data['truncated'])
+
+        data = subgraph('id=a&hops=2&direction=out&relationships=causes,affects,impacts')
+        self.assertEqual(sorted(n['id'] for n in data['nodes']), ['a', 'c', 'f', 'g'])
+        self.assertIn({'source': 'g', 'target': 'c', 'relationship': 'causes', 'weight': 0.5}, data['edges'])
+        data = subgraph('node=A&hops=3&types=activity,factor')
+        self.assertEqual(sorted(n['id'] for n in data['nodes']), ['a', 'f', 'g'])
+
+        # Over budget, the highest-degree nodes of the last level are kept
+        data = subgraph('node=C&hops=2&max_nodes=3')
+        self.assertTrue(data['truncated'])
+        self.assertEqual(len(data['nodes']), 3)
+        self.assertEqual(sorted(n['id'] for n in data['nodes']), ['c', 'f', 'g'])
+        data = subgraph('max_nodes=2')
+        self.assertTrue(data['truncated'])
+        self.assertEqual(sorted(n['id'] for n in data['nodes']), ['a', 'c'])
+        self.assertEqual(len(subgraph('')['nodes']), 6)
+        self.assertEqual(subgraph('node=Nowhere&id=nope')['not_found'], ['Nowhere', 'nope'])
+
+        # Matches networkx on a random graph
+        random.seed(7)
+        G.clear()
+        G.add_nodes_from((i, {'type': 'factor', 'name': f'N{i}'}) for i in range(200))
+        G.add_edges_from((random.randrange(200), random.randrange(200), {'relationship': 'causes'}) for _ in range(400))
+        data = subgraph('node=N0&hops=2&max_nodes=1000')
+        expected = nx.ego_graph(G, 0, radius=2, undirected=True)
+        self.assertEqual(sorted(n['id'] for n in data['nodes']), sorted(expected))
+
+        for query in ['hops=x', 'hops=100', 'max_nodes=0', 'direction=up', 'types=planet', 'relationships=loves']:
+            self.assertEqual(self.app.get(f'/api/subgraph?{query}').status_code, 400)
+
+    def test_graph_layout(self):
+        """Test that node positions are computed per version in the background and updated incrementally"""
+        layout_cache = knowledge_graph_app.layout_cache
+        self.app.post('/api/load_sample_data')
+        layout_cache.wait()
+        first = self.app.get('/api/get_graph')
+        self.assertTrue(layout_cache.wait(timeout=30))
+        # Once the layout has finished the payload and its ETag change
+        response = self.app.get('/api/get_graph', headers={'If-None-Match': first.headers['ETag']})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        positions = {node['id']: (node['x'], node['y']) for node in data['nodes']}
+        self.assertEqual(len(positions), len(G))
+        self.assertEqual(len(set(positions.values())), len(G))
+        # Linked nodes end up closer together than the average pair
+        coords = np.array(list(positions.values()))
+        linked = np.mean([np.hypot(*np.subtract(positions[u], positions[v])) for u, v in G.edges()])
+        overall = np.mean(np.hypot(*(coords[:, None] - coords[None]).transpose(2, 0, 1)))
+        self.assertLess(linked, overall)
+
+        # A new node has no position until the refinement has run; then it
+        # comes with one near its neighbour and the rest barely move
+        stats = layout_cache.stats()
+        self.app.post('/api/add_node', json={'id': 'activity_new', 'type': 'activity', 'name': 'New'})
+        self.app.post('/api/add_edge', json={'source': 'New', 'target': 'Deforestation', 'relationship': 'causes'})
+        csr = knowledge_graph_app.csr_snapshot.current(force=True)
+        carried = layout_cache.positions(csr)
+        self.assertTrue(np.isnan(carried[csr.index['activity_new']]).all())
+        np.testing.assert_allclose(carried[csr.index['activity_2']], positions['activity_2'], atol=0.1)
+        self.assertTrue(layout_cache.wait(timeout=30))
+        delta = json.loads(self.app.get(f"/api/get_graph?since={data['version']}").data)
+        new = next(node for node in delta['nodes'] if node['id'] == 'activity_new')
+        self.assertIn('x', new)
+        after = {node['id']: (node['x'], node['y'])
+                 for node in json.loads(self.app.get('/api/get_graph').data)['nodes']}
+        moved = np.mean([np.hypot(*np.subtract(after[n], positions[n])) for n in positions])
+        self.assertLess(moved, layout_cache.edge_length)
+        new_stats = layout_cache.stats()
+        self.assertEqual(new_stats['full_layouts'], stats['full_layouts'])
+        self.assertGreater(new_stats['refinements'], stats['refinements'])
+
+        # Positions are cached per version
+        self.app.get('/api/subgraph?node=New')
+        self.assertEqual(layout_cache.stats(), new_stats)
+
+    def test_metrics(self):
+        """Test request counts, latency histograms and graph size at /api/metrics"""
+        metrics = knowledge_graph_app.metrics
+        requests = metrics.value('kg_http_requests_total', '/api/query_impacts', 'GET', '200')
+        missing = metrics.value('kg_http_requests_total', '/api/query_impacts', 'GET', '404')
+        timed = metrics.value('kg_http_request_duration_seconds', '/api/query_impacts', 'GET')
+        traversals = metrics.value('kg_traversal_nodes', 'impacts')
+        self.app.post('/api/load_sample_data')
+        self.app.get('/api/query_impacts?source=Deforestation')
+        self.app.get('/api/query_impacts?source=Nothing')
+        self.assertEqual(metrics.value('kg_http_requests_total', '/api/query_impacts', 'GET', '200'), requests + 1)
+        self.assertEqual(metrics.value('kg_http_requests_total', '/api/query_impacts', 'GET', '404'), missing + 1)
+        self.assertEqual(metrics.value('kg_http_request_duration_seconds', '/api/query_impacts', 'GET'), timed + 2)
+        self.assertGreaterEqual(metrics.value('kg_traversal_nodes', 'impacts'), traversals)
+
+        response = self.app.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        text = response.data.decode()
+        self.assertIn('# TYPE kg_http_request_duration_seconds histogram', text)
+        self.assertIn('kg_http_request_duration_seconds_bucket{route="/api/query_impacts",method="GET",le="+Inf"}', text)
+        self.assertIn(f'kg_graph_nodes {len(G)}', text)
+        self.assertIn(f'kg_graph_edges {G.number_of_edges()}', text)
+        # Every sample line is "name[{labels}] value"
+        for line in text.splitlines():
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                float(value)
+
+    def test_synthetic_graph(self):
+        """Test that generated graphs are reproducible and load the same through every upload format"""
+        data = synthetic_graph.generate_graph(500, seed=3)
+        self.assertEqual(data, synthetic_graph.generate_graph(500, seed=3))
+        self.assertNotEqual(data, synthetic_graph.generate_graph(500, seed=4))
+        self.assertEqual(len(data['nodes']), 500)
+        self.assertEqual({node['type'] for node in data['nodes']}, set(NODE_TYPES))
+        self.assertTrue({edge['relationship'] for edge in data['edges']} <= set(RELATIONSHIP_TYPES))
+        expected = synthetic_graph.to_graph(data)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for file_format in synthetic_graph.FORMATS:
+                path = os.path.join(directory, f'graph.{file_format}')
+                synthetic_graph.write_graph(data, path)
+                with open(path, 'rb') as f:
+                    response = self.app.post('/api/upload_data',
+                                             data={'file': (f, f'graph.{file_format}')},
+                                             content_type='multipart/form-data')
+                self.assertEqual(response.status_code, 200, file_format)
+                # The tabular format has no rows for nodes without edges
+                edges = {(u, v): (d['relationship'], d['weight']) for u, v, d in G.edges(data=True)}
+                self.assertEqual(edges, {(u, v): (d['relationship'], d['weight'])
+                                         for u, v, d in expected.edges(data=True)}, file_format)
+                if file_format != 'csv':
+                    self.assertEqual(dict(G.nodes(data='name')), dict(expected.nodes(data='name')), file_format)
+
+    def test_load_test_mix_and_summary(self):
+        """Test the load generator's mix parsing and latency summary"""
+        self.assertEqual(load_test.parse_mix('get_graph=3, add_edge=1'), {'get_graph': 3.0, 'add_edge': 1.0})
+        for mix in ('get_graph=x', 'nothing=1', 'get_graph=-1', 'get_graph=0'):
+            with self.assertRaises(ValueError):
+                load_test.parse_mix(mix)
+
+        results = [('get_graph', 0.0, latency / 1000, 200, None) for latency in range(1, 101)]
+        results.append(('add_edge', 0.0, 0.5, 500, 'Internal Server Error'))
+        summary = load_test.summarize(results, elapsed=10.0)
+        self.assertEqual(summary['get_graph']['requests'], 100)
+        self.assertEqual(summary['get_graph']['errors'], 0)
+        self.assertAlmostEqual(summary['get_graph']['p50_ms'], 50.5)
+        self.assertAlmostEqual(summary['get_graph']['p99_ms'], 99.01)
+        self.assertEqual(summary['add_edge']['error_rate'], 1.0)
+        self.assertEqual(summary['all']['requests'], 101)
+        self.assertAlmostEqual(summary['all']['throughput'], 10.1)
+        self.assertEqual(summary['all']['max_ms'], 500.0)
+
+        # Routes without samples (nothing completed) print placeholders
+        summary = load_test.summarize([], elapsed=10.0)
+        self.assertIsNone(summary['all']['p50_ms'])
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            load_test.print_summary(summary)
+        self.assertIn(' -', out.getvalue().splitlines()[1])
+
+    def test_request_profiling(self):
+        """Test on-demand profiles, the on-disk ring buffer, slow-request sampling and the token"""
+        self.assertEqual(self.app.get('/api/profiles').status_code, 400)
+        self.app.post('/api/load_sample_data')
+        with tempfile.TemporaryDirectory() as directory:
+            knowledge_graph_app.init_profiling(directory, keep=3, slow_ms=0)
+            try:
+                response = self.app.get('/api/query_impacts?source=Deforestation')
+                self.assertNotIn('X-Profile-Id', response.headers)
+                response = self.app.get('/api/query_impacts?source=Deforestation', headers={'X-Profile': '1'})
+                self.assertEqual(response.status_code, 200)
+                profile_id = response.headers['X-Profile-Id']
+                profiles = json.loads(self.app.get('/api/profiles').data)['profiles']
+                self.assertEqual([p['id'] for p in profiles], [profile_id])
+                self.assertEqual(profiles[0]['route'], '/api/query_impacts')
+                self.assertEqual(profiles[0]['kind'], 'cprofile')
+                text = self.app.get(f'/api/profiles/{profile_id}?format=text').data.decode()
+                self.assertIn('query_impacts', text)
+                self.assertEqual(self.app.get(f'/api/profiles/{profile_id}').status_code, 200)
+                self.assertEqual(self.app.get('/api/profiles/00000000-000000').status_code, 404)
+
+                # Only the newest profiles are kept
+                ids = [self.app.get('/api/test?profile=1').headers['X-Profile-Id'] for _ in range(3)]
+                profiles = json.loads(self.app.get('/api/profiles').data)['profiles']
+                self.assertEqual([p['id'] for p in profiles], ids[::-1])
+                self.assertEqual(len(os.listdir(directory)), 6)
+                # A restarted store continues the sequence
+                store = profiling.ProfileStore(directory, max_profiles=3)
+                self.assertEqual([p['id'] for p in store.list()], ids[::-1])
+
+                knowledge_graph_app.PROFILE_TOKEN = 'secret'
+                self.assertEqual(self.app.get('/api/profiles').status_code, 403)
+                self.assertEqual(self.app.get('/api/profiles', headers={'X-Profile-Token': 'secret'}).status_code, 200)
+                self.assertNotIn('X-Profile-Id', self.app.get('/api/test?profile=1').headers)
+                self.assertNotIn('X-Profile-Id', self.app.get('/api/test?profile=1&token=secret').headers)
+                self.assertNotIn('X-Profile-Id', self.app.get('/api/test?profile=1',
+                                                              headers={'X-Profile-Token': 'secreT'}).headers)
+                self.assertIn('X-Profile-Id', self.app.get('/api/test?profile=1',
+                                                           headers={'X-Profile-Token': 'secret'}).headers)
+            finally:
+                knowledge_graph_app.PROFILE_TOKEN = None
+                knowledge_graph_app.profile_store = None
+
+            # Requests over the threshold have their stacks sampled; others leave nothing
+            store = profiling.ProfileStore(directory, max_profiles=10)
+            sampler = profiling.SlowRequestSampler(store, threshold=0.02, interval=0.002)
+            try:
+                sampler.begin()
+                self.assertIsNone(sampler.end({'path': '/fast'}))
+                sampler.begin()
+                deadline = time.perf_counter() + 0.2
+                while time.perf_counter() < deadline:
+                    pass
+                profile_id = sampler.end({'path': '/slow'})
+            finally:
+                sampler.stop()
+            meta = store.get(profile_id)
+            self.assertEqual(meta['kind'], 'sampled')
+            self.assertGreater(meta['samples'], 0)
+            with open(store.data_path(meta)) as f:
+                stacks = f.read()
+            self.assertIn('test_knowledge_graph.py:test_request_profiling', stacks)
+
+    def test_impact_paths(self):
+        """Test k-shortest path enumeration, target filters and the search limits"""
+        G.add_nodes_from([('a', {'type': 'activity', 'name': 'A'}), ('f', {'type': 'factor', 'name': 'F'}),
+                          ('g', {'type': 'factor', 'name': 'G'}), ('h', {'type': 'factor', 'name': 'H'}),
+                          ('c', {'type': 'consequence', 'name': 'C'}), ('d', {'type': 'consequence', 'name': 'D'})])
+        G.add_edges_from([('a', 'f', {'relationship': 'causes', 'weight': 0.5}),
+                          ('a', 'g', {'relationship': 'causes', 'weight': 2.0}),
+                          ('a', 'h', {'relationship': 'causes'}),
+                          ('f', 'c', {'relationship': 'affects'}),
+                          ('g', 'c', {'relationship': 'affects'}),
+                          ('h', 'c', {'relationship': 'affects'}),
+                          ('c', 'd', {'relationship': 'impacts'}),
+                          ('a', 'd', {'relationship': 'impacts', 'weight': 0.1})])
+
+        # Fewest hops first, then the strongest; at most k per consequence
+        data = json.loads(self.app.get('/api/impact_paths?source=A&k=2').data)
+        self.assertFalse(data['truncated'])
+        # Consequences with the shortest best path first
+        self.assertEqual([r['consequence'] for r in data['results']], ['D', 'C'])
+        c_paths = data['results'][1]['paths']
+        self.assertEqual([p['path'] for p in c_paths], [['A', 'G', 'C'], ['A', 'H', 'C']])
+        self.assertEqual(c_paths[0]['relationships'], ['causes', 'affects'])
+        self.assertEqual(c_paths[0]['hops'], 2)
+        self.assertAlmostEqual(c_paths[0]['weight'], 2.0)
+        d_paths = data['results'][0]['paths']
+        self.assertEqual([p['path'] for p in d_paths], [['A', 'D'], ['A', 'G', 'C', 'D']])
+
+        # Depth bound and target filter
+        data = json.loads(self.app.get('/api/impact_paths?source=A&k=5&max_depth=2&target=D&target=Nowhere').data)
+        self.assertEqual(data['not_found'], ['Nowhere'])
+        self.assertEqual([p['path'] for r in data['results'] for p in r['paths']], [['A', 'D']])
+
+        # Hitting max_paths returns the paths found so far
+        data = json.loads(self.app.get('/api/impact_paths?source=A&k=5&max_paths=2').data)
+        self.assertEqual(data['truncated'], 'max_paths')
+        self.assertEqual(data['paths'], 2)
+
+        self.assertEqual(self.app.get('/api/impact_paths?source=Nowhere').status_code, 404)
+        for query in ['', 'source=A&k=0', 'source=A&max_depth=0', 'source=A&max_paths=0',
+                      'source=A&time_budget=0', 'source=A&time_budget=x']:
+            self.assertEqual(self.app.get(f'/api/impact_paths?{query}').status_code, 400)
+
+    def test_pattern_query(self):
+        """Test typed pattern matching with branches, wildcards and name conditions"""
+        G.add_nodes_from([('a', {'type': 'activity', 'name': 'A'}), ('b', {'type': 'activity', 'name': 'B'}),
+                          ('f', {'type': 'factor', 'name': 'F'}), ('g', {'type': 'factor', 'name': 'G'}),
+                          ('l', {'type': 'location', 'name': 'L'}), ('m', {'type': 'location', 'name': 'M'}),
+                          ('c', {'type': 'consequence', 'name': 'C'}), ('d', {'type': 'consequence', 'name': 'D'})])
+        G.add_edges_from([('a', 'f', {'relationship': 'causes'}), ('b', 'f', {'relationship': 'causes'}),
+                          ('b', 'g', {'relationship': 'causes'}), ('f', 'c', {'relationship': 'affects'}),
+                          ('g', 'd', {'relationship': 'affects'}), ('g', 'c', {'relationship': 'impacts'}),
+                          ('a', 'l', {'relationship': 'occurs_in'}), ('b', 'm', {'relationship': 'occurs_in'})])
+
+        def matches(pattern, **params):
+            response = self.app.get('/api/pattern_query', query_string=dict(params, pattern=pattern))
+            self.assertEqual(response.status_code, 200)
+            return json.loads(response.data)
+
+        data = matches('activity -causes-> factor -affects-> consequence')
+        self.assertEqual(data['steps'], ['activity', 'factor', 'consequence'])
+        self.assertEqual([m['nodes'] for m in data['matches']],
+                         [['A', 'F', 'C'], ['B', 'F', 'C'], ['B', 'G', 'D']])
+        self.assertEqual(data['matches'][0]['relationships'], ['causes', 'affects'])
+        self.assertFalse(data['truncated'])
+
+        # A branch through an alias, restricted by location
+        data = matches('x:activity -causes-> factor -affects-> consequence, x -occurs_in-> location '
+                       'where location = M')
+        self.assertEqual([m['nodes'] for m in data['matches']], [['B', 'F', 'C', 'M'], ['B', 'G', 'D', 'M']])
+        self.assertEqual(data['plan'][0], 'location = M')
+
+        # Reverse arrows and wildcard relationships
+        data = matches('consequence <-*- factor where consequence = "C"')
+        self.assertEqual([m['nodes'] for m in data['matches']], [['C', 'F'], ['C', 'G']])
+        self.assertEqual([m['relationships'] for m in data['matches']], [['affects'], ['impacts']])
+
+        data = matches('activity -causes-> factor', limit=2)
+        self.assertEqual(len(data['matches']), 2)
+        self.assertEqual(data['truncated'], 'limit')
+
+        for pattern in ['', 'activity -eats-> factor', 'animal -causes-> factor', 'activity factor',
+                        'activity -causes->', 'activity -causes-> factor, location',
+                        'factor -affects-> consequence where activity = A', 'activity where = A']:
+            response = self.app.get('/api/pattern_query', query_string={'pattern': pattern})
+            self.assertEqual(response.status_code, 400, pattern)
+        self.assertEqual(self.app.get('/api/pattern_query?pattern=activity&limit=0').status_code, 400)
+
+        # max_rows caps every step; below the full answer it returns a subset
+        csr = CSRGraph(synthetic_graph.to_graph(synthetic_graph.generate_graph(300, seed=3)))
+        for text in ['activity -causes-> factor -affects-> consequence',
+                     'a:activity -*-> f:factor, b:activity -*-> f']:
+            pattern = parse_pattern(text, NODE_TYPES, RELATIONSHIP_TYPES)
+            full, _, truncated, _ = match_pattern(csr, pattern)
+            self.assertIsNone(truncated)
+            full = set(map(tuple, full.tolist()))
+            self.assertGreater(len(full), 100)
+            for max_rows in (1, 7, len(full)):
+                nodes, _, truncated, _ = match_pattern(csr, pattern, max_rows=max_rows)
+                self.assertLessEqual(len(nodes), max_rows)
+                self.assertLessEqual(set(map(tuple, nodes.tolist())), full)
+                self.assertEqual(truncated, 'max_rows' if max_rows < len(full) else None)
 
 if __name__ == '__main__':
     # Create test suite